@@ -0,0 +1,111 @@
+import asyncio
+import math
+import os
+import re
+import time
+from starlette.responses import JSONResponse
+from app.metrics import observe_stage, ADMISSION_REJECTED
+
+# Requests of each heavy endpoint group allowed to run at once
+SPLIT_AUDIO_LIMIT = int(os.getenv("SPLIT_AUDIO_LIMIT", "2"))
+TRANSCRIBE_LIMIT = int(os.getenv("TRANSCRIBE_LIMIT", "1"))
+DOWNLOAD_LIMIT = int(os.getenv("DOWNLOAD_LIMIT", "2"))
+DATASET_LOAD_LIMIT = int(os.getenv("DATASET_LOAD_LIMIT", "1"))
+EXPORT_LIMIT = int(os.getenv("EXPORT_LIMIT", "1"))
+
+# Requests allowed to wait for a slot; any more are turned away with 429 at once
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "4"))
+
+# Seconds a queued request waits for a slot before it is turned away with 503
+ADMISSION_WAIT_SECONDS = float(os.getenv("ADMISSION_WAIT_SECONDS", "5"))
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+# Concurrency limit with a bounded waiting queue for one group of endpoints
+class Admission:
+    def __init__(self, name, limit, queue_size=ADMISSION_QUEUE_SIZE, wait_seconds=ADMISSION_WAIT_SECONDS):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.wait_seconds = wait_seconds
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+        self._hold_seconds = None  # Moving average of how long a request keeps its slot
+
+    def retry_after(self):
+        """Whole seconds until a slot is likely to be free for a new request."""
+        hold = self._hold_seconds or 1.0
+        return max(1, math.ceil(hold * (self.waiting + 1) / self.limit))
+
+    async def acquire(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        if self.waiting >= self.queue_size:
+            raise Overloaded(429, f"Too many {self.name} requests; try again later", self.retry_after())
+
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            raise Overloaded(503, f"The server is busy with {self.name} requests", self.retry_after())
+        finally:
+            self.waiting -= 1
+            observe_stage("admission_wait", time.perf_counter() - started)
+
+    def release(self, held_seconds):
+        self._hold_seconds = held_seconds if self._hold_seconds is None else (
+            0.8 * self._hold_seconds + 0.2 * held_seconds
+        )
+        self._slots.release()
+
+
+# ASGI middleware, so a slot is held until a streamed response has been sent in full
+class AdmissionMiddleware:
+    """Admit requests to the endpoints matching ``rules`` only while their limit allows.
+
+    ``rules`` is a list of (path regex, Admission); the first match applies and
+    unmatched paths pass straight through. A request that finds the queue full
+    gets 429, one that waits longer than ``wait_seconds`` gets 503, and both
+    carry a Retry-After estimated from how long recent requests held a slot.
+    """
+
+    def __init__(self, app, rules):
+        self.app = app
+        self.rules = [(re.compile(pattern), admission) for pattern, admission in rules]
+
+    def admission_for(self, path):
+        for pattern, admission in self.rules:
+            if pattern.match(path):
+                return admission
+        return None
+
+    async def __call__(self, scope, receive, send):
+        admission = self.admission_for(scope["path"]) if scope["type"] == "http" else None
+        if admission is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await admission.acquire()
+        except Overloaded as e:
+            ADMISSION_REJECTED.labels(admission.name, str(e.status_code)).inc()
+            response = JSONResponse(
+                {"detail": e.detail}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(time.perf_counter() - started)
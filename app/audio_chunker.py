@@ -1,103 +1,142 @@
 import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from pydub import AudioSegment
-from pydub.silence import detect_nonsilent, split_on_silence
+from sqlalchemy import update, delete, func, and_, or_, case, literal
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError
-from app.models import Download_videos, AudioChunks
+from app.models import Download_videos, AudioChunks, ChunkStatus, TranscriptionStatus, chunk_id_for, has_source_audio
 from app.database import async_session
+from app.storage import chunk_directory, atomic_output
+from app.silence import samples_from_bytes, frame_power, frame_length, chunk_ranges, DEFAULT_SEGMENTATION
+from app.wavfile import read_wav_info, open_payload, duration_ms, ms_to_frame, write_wav_frames, payload_hash
+from app.envelope import envelope_path, compute_envelope, save_envelope, load_envelope
+from app.metrics import stage_timer, count_audio, collect_metrics, replay_metrics
+from app.chunk_encoding import DEFAULT_PROFILE, is_passthrough, pcm_to_float, write_frames, write_chunk
+
+# Worker processes used for batch chunking; chunking is CPU-bound
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 1)))
+
+# Chunk rows buffered in the parent before each bulk insert
+CHUNK_INSERT_BATCH_SIZE = int(os.getenv("CHUNK_INSERT_BATCH_SIZE", "5000"))
+
+# Chunks saved per checkpoint of a single-video run; a crash redoes at most this many
+CHUNK_CHECKPOINT_EVERY = int(os.getenv("CHUNK_CHECKPOINT_EVERY", "20"))
 
 # Fetch video from database using UUID and return its location
-async def audio_chunker(uuid, output_dir):
+async def audio_chunker(uuid, output_dir, materialize=False, profile=DEFAULT_PROFILE,
+                        segmentation=DEFAULT_SEGMENTATION):
+    """Chunk one video, saving its chunks and progress every ``CHUNK_CHECKPOINT_EVERY`` chunks.
+
+    A video left pending by an interrupted run continues after its checkpoint;
+    a video that was chunked before is chunked from the start again, which
+    rewrites the same chunk rows and removes the ones new ``segmentation``
+    parameters no longer produce. Boundaries come from the video's envelope
+    index, which is built on the first run. Returns the chunks cut by this run.
+    """
     try:
         async with async_session() as session:
-            async with session.begin():
-                stmt = select(Download_videos).where(Download_videos.uuid == uuid)
-                result = await session.execute(stmt)
-                video = result.scalars().first()
-                
-                if video:
-                    #Create output directory using the UUID of the video
-                    output_dir = os.path.join(output_dir, uuid)
-
-                    #ensure the output directory exist
-                    if not os.path.exists(output_dir):
-                        os.makedirs(output_dir)
-                    print(f"Saving chunks in directory: {output_dir}")
-
-                    # # If the video exists, display the file location and process audio
-                    # print(f"File location for UUID {uuid}: {video.location}")
-                    audio_chunks = split_audio_with_silence(video.location, output_dir)
-
-                    # Save each chunk to the database
-                    if audio_chunks:
-                        await save_chunks_to_db(uuid, video.id, audio_chunks)
-                    
-                    # Update chunk_status in the Download_videos table
-                    video.chunk_status = "True"
-                    await session.commit()
-
-                    return {"location": video.location, "chunks": audio_chunks}
-                else:
-                    print(f"No video found with UUID {uuid}")
-                    return {"error": "No video found with this UUID"}
+            stmt = select(Download_videos).where(Download_videos.uuid == uuid)
+            result = await session.execute(stmt)
+            video = result.scalars().first()
     except SQLAlchemyError as e:
         print(f"Error querying the database: {e}")
         raise
 
+    if not video:
+        print(f"No video found with UUID {uuid}")
+        return {"error": "No video found with this UUID"}
+    if not has_source_audio(video.meta_data):
+        print(f"Video {uuid} was streamed without keeping its audio; it cannot be chunked again")
+        return {"error": "Only the chunks of this video were kept, so it cannot be chunked again"}
+
+    #Create output directory using the UUID of the video
+    output_dir = chunk_directory(output_dir, uuid)
+
+    if materialize:
+        print(f"Saving chunks in directory: {output_dir}")
+
+    resume_from = video.chunk_checkpoint if video.chunk_status == ChunkStatus.PENDING else 0
+    if resume_from:
+        print(f"Resuming chunking of {uuid} from frame {resume_from}")
+
+    envelope_file = video.envelope_path or envelope_path(uuid)
+    audio_chunks, unsaved = [], []
+    chunks = iter_audio_chunks(video.location, output_dir, materialize=materialize, resume_from=resume_from,
+                               segmentation=segmentation, profile=profile, envelope_file=envelope_file)
+    try:
+        # Chunks are cut in a thread so the event loop keeps serving while a long file is split
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            audio_chunks.append(chunk)
+            unsaved.append(chunk)
+            if len(unsaved) >= CHUNK_CHECKPOINT_EVERY:
+                await save_chunk_checkpoint(uuid, video.id, unsaved)
+                unsaved = []
+    except Exception as e:
+        print(f"Error chunking video {uuid}: {e}")
+        await mark_chunking_failed([video.id])
+        raise
+
+    # Update chunk_status in the Download_videos table
+    info = read_wav_info(video.location)
+    await save_chunk_checkpoint(uuid, video.id, unsaved, finish={
+        "resume_from": resume_from,
+        "chunk_ids": [chunk_id_for(uuid, chunk["start_sample"]) for chunk in audio_chunks],
+        "envelope_file": envelope_file,
+        "duration": duration_ms(info),
+        "sample_rate": info.sample_rate,
+    })
+
+    return {"location": video.location, "chunks": audio_chunks, "resumed_from": resume_from}
+
 # Split audio based on silence and export chunks
-def split_audio_with_silence(audio_file, output_dir):
+def split_audio_with_silence(audio_file, output_dir, silence_thresh=-40, min_silence_len=1000,
+                             min_chunk_len=5000, max_chunk_len=18000, profile=DEFAULT_PROFILE):
     """Split audio file based on silence and export chunks."""
     try:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
         # Load audio file
-        audio = AudioSegment.from_wav(audio_file)
-
-        # Parameters for silence detection
-        silence_duration = 1000  # 1 second of silence
-        max_chunk_size = 18 * 1000  # 18 seconds max chunk size
-        min_chunk_size = 5 * 1000  # 5 seconds min chunk size
-
-        # Detect non-silent ranges in the audio
-        nonsilent_ranges = detect_nonsilent(
-            audio, 
-            min_silence_len=silence_duration, 
-            silence_thresh=-40, 
-            seek_step=100
-        )
+        with stage_timer("wav_decode"):
+            audio = AudioSegment.from_wav(audio_file)
+        count_audio("chunking", len(audio.raw_data), len(audio) / 1000)
 
-        final_chunks = []
-        if not nonsilent_ranges:
-            print("No nonsilent ranges detected.")
-            return []
+        with stage_timer("silence_detection"):
+            # Build the energy envelope in one vectorized pass over the samples
+            samples = samples_from_bytes(audio.raw_data, audio.sample_width)
+            power = frame_power(samples, audio.channels, audio.sample_width, frame_length(audio.frame_rate))
 
-        # Process and create chunks
-        for start, end in nonsilent_ranges:
-            chunk = audio[start:end]
-            if min_chunk_size <= len(chunk) <= max_chunk_size:
-                final_chunks.append(chunk)
-            elif len(chunk) > max_chunk_size:
-                # Split larger chunks based on additional silence
-                split_chunks = split_on_silence(
-                    chunk, 
-                    min_silence_len=silence_duration, 
-                    silence_thresh=-40, 
-                    keep_silence=500
-                )
-                for sub_chunk in split_chunks:
-                    if min_chunk_size <= len(sub_chunk) <= max_chunk_size:
-                        final_chunks.append(sub_chunk)
+            # Detect non-silent ranges and fit them into the chunk size bounds
+            ranges = chunk_ranges(
+                power,
+                duration_ms=len(audio),
+                silence_thresh=silence_thresh,
+                min_silence_len=min_silence_len,
+                min_chunk_len=min_chunk_len,
+                max_chunk_len=max_chunk_len
+            )
 
         # Export chunks to the output directory and return paths
-        if not final_chunks:
+        if not ranges:
             print("No chunks created after processing.")
             return []
 
+        passthrough = is_passthrough(profile, audio.frame_rate, audio.channels, audio.sample_width)
         output_paths = []
-        for i, final_chunk in enumerate(final_chunks):
-            output_path = os.path.join(output_dir, f"chunk_{i+1}.wav")
-            final_chunk.export(output_path, format="wav")
+        for i, (start, end) in enumerate(ranges):
+            path_stem = os.path.join(output_dir, f"chunk_{i+1}")
+            with stage_timer("chunk_export"):
+                if passthrough:
+                    output_path = f"{path_stem}.wav"
+                    with atomic_output(output_path) as temporary:
+                        audio[start:end].export(temporary, format="wav")
+                else:
+                    first = start * audio.frame_rate // 1000 * audio.channels
+                    last = end * audio.frame_rate // 1000 * audio.channels
+                    frames = pcm_to_float(samples[first:last], audio.channels, audio.sample_width)
+                    output_path = write_frames(path_stem, frames, audio.frame_rate, profile)
             output_paths.append(output_path)
 
         return output_paths
@@ -106,21 +145,285 @@ def split_audio_with_silence(audio_file, output_dir):
         print(f"Error splitting audio: {e}")
         return []
 
+# Detect chunk boundaries of a WAV file without loading it into memory
+def detect_chunk_ranges(audio_file, info, segmentation=DEFAULT_SEGMENTATION, envelope_file=None):
+    """Return [start_ms, end_ms] chunk boundaries for a WAV file.
+
+    With ``envelope_file`` the envelope index is read from it when it exists,
+    and otherwise built from the audio and written there.
+    """
+    if envelope_file and os.path.exists(envelope_file):
+        power = load_envelope(envelope_file)
+    else:
+        power = compute_envelope(audio_file, info)
+        if envelope_file:
+            save_envelope(envelope_file, power)
+
+    with stage_timer("silence_detection"):
+        return chunk_ranges(power, duration_ms=duration_ms(info), **segmentation._asdict())
+
+# Cut a WAV file on silence one chunk at a time, without loading it into memory
+def iter_audio_chunks(audio_file, output_dir, materialize=False, resume_from=0,
+                      segmentation=DEFAULT_SEGMENTATION, profile=DEFAULT_PROFILE, envelope_file=None):
+    """Yield the chunks of a memory-mapped WAV file in order.
+
+    Every chunk is recorded as sample offsets into ``audio_file``. With
+    ``materialize`` the chunk is also written to ``output_dir`` in ``profile``'s
+    format and its PCM payload hashed; other chunks are hashed when they are
+    first transcribed. Chunks are read from the mapped buffer one at a time,
+    so memory stays bounded by the chunk length rather than the file length. Chunks ending at
+    or before frame ``resume_from`` were saved by an earlier run and are
+    skipped; boundaries and file names do not depend on where a run started.
+    The audio is only decoded when no envelope index exists at ``envelope_file``
+    yet, or when chunks are materialized.
+    """
+    info = read_wav_info(audio_file)
+    ranges = detect_chunk_ranges(audio_file, info, segmentation, envelope_file)
+    if not ranges:
+        print("No chunks created after processing.")
+        return
+
+    if materialize and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    payload = open_payload(audio_file, info)
+    passthrough = is_passthrough(profile, info.sample_rate, info.channels, info.sample_width)
+
+    for i, (start, end) in enumerate(ranges):
+        start_sample = ms_to_frame(info, start)
+        end_sample = ms_to_frame(info, end)
+        if end_sample <= resume_from:
+            continue
+        file_path, content_hash = None, None
+        if materialize:
+            path_stem = os.path.join(output_dir, f"chunk_{i+1}")
+            with stage_timer("chunk_export"):
+                if passthrough:
+                    file_path = write_wav_frames(f"{path_stem}.wav", info, payload, start_sample, end_sample)
+                else:
+                    file_path = write_chunk(path_stem, info, audio_file, start_sample, end_sample, profile)
+            with stage_timer("chunk_hash"):
+                content_hash = payload_hash(info, payload, start_sample, end_sample)
+        count_audio("chunk_output", seconds=(end_sample - start_sample) / info.sample_rate)
+        yield {
+            "file_path": file_path,
+            "source_path": audio_file,
+            "start_sample": start_sample,
+            "end_sample": end_sample,
+            "content_hash": content_hash
+        }
+
+# Split a WAV file on silence without loading it into memory
+def split_audio_streaming(audio_file, output_dir, materialize=False, resume_from=0,
+                          segmentation=DEFAULT_SEGMENTATION, profile=DEFAULT_PROFILE, envelope_file=None):
+    """Split a memory-mapped WAV file based on silence and return all its chunks.
+
+    Errors are raised rather than returned as no chunks, since finishing a
+    video with no chunks removes the ones saved before.
+    """
+    return list(iter_audio_chunks(audio_file, output_dir, materialize, resume_from, segmentation, profile,
+                                  envelope_file))
+
+# Insert chunk rows, or update the ones an earlier run already saved. Chunk IDs
+# come from the video and start frame, so retries never duplicate a chunk, and
+# rows that did not change are left untouched. A chunk whose audio changed goes
+# back to pending transcription, since its old transcript no longer matches it.
+# Chunks are only hashed when materialized, so an unchanged chunk saved without
+# a hash keeps the one it has
+async def upsert_chunks(session, rows):
+    rows = [
+        dict(row, chunk_id=row.get("chunk_id") or chunk_id_for(row["video_uuid"], row["start_sample"]))
+        for row in rows
+    ]
+    stmt = insert(AudioChunks)
+    audio_changed = or_(
+        AudioChunks.source_path.is_distinct_from(stmt.excluded.source_path),
+        AudioChunks.end_sample.is_distinct_from(stmt.excluded.end_sample),
+        and_(stmt.excluded.content_hash.is_not(None),
+             AudioChunks.content_hash.is_distinct_from(stmt.excluded.content_hash)),
+    )
+    changes = {
+        "file_path": func.coalesce(stmt.excluded.file_path, AudioChunks.file_path),
+        "source_path": stmt.excluded.source_path,
+        "end_sample": stmt.excluded.end_sample,
+        "content_hash": case(
+            (audio_changed, stmt.excluded.content_hash),
+            else_=func.coalesce(stmt.excluded.content_hash, AudioChunks.content_hash)
+        ),
+    }
+    pending = literal(TranscriptionStatus.PENDING, AudioChunks.transcription_status.type)
+    resets = {
+        "transcribe": case((audio_changed, None), else_=AudioChunks.transcribe),
+        "transcription_status": case((audio_changed, pending), else_=AudioChunks.transcription_status),
+        "transcribed_at": case((audio_changed, None), else_=AudioChunks.transcribed_at),
+    }
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[AudioChunks.chunk_id],
+        set_={**changes, **resets},
+        where=or_(*(getattr(AudioChunks, column).is_distinct_from(value) for column, value in changes.items()))
+    )
+    await session.execute(stmt, rows)
+
 # Save audio chunks to the database
-async def save_chunks_to_db(video_uuid, video_id, chunk_paths):
+async def save_chunks_to_db(video_uuid, video_id, chunks):
     """Save each chunk's metadata to the AudioChunks table."""
     try:
         async with async_session() as session:
-            async with session.begin():
-                for chunk_path in chunk_paths:
-                    new_chunk = AudioChunks(
-                        video_id=video_id,
-                        video_uuid=video_uuid,
-                        file_path=chunk_path
-                    )
-                    session.add(new_chunk)
-            await session.commit()
+            with stage_timer("chunk_db_commit"):
+                async with session.begin():
+                    if chunks:
+                        await upsert_chunks(
+                            session, [dict(chunk, video_id=video_id, video_uuid=video_uuid) for chunk in chunks]
+                        )
             print(f"Audio chunks saved to database for video UUID: {video_uuid}")
     except SQLAlchemyError as e:
         print(f"Error saving chunks to database: {e}")
         raise
+
+# Mark a video as chunked and point it at its envelope index. Chunks an earlier
+# run saved after ``resume_from`` that this run did not cut (because the
+# segmentation parameters changed) are removed
+async def _finish_video(session, video_id, resume_from, chunk_ids, envelope_file, duration, sample_rate):
+    await session.execute(
+        delete(AudioChunks).where(
+            AudioChunks.video_id == video_id,
+            AudioChunks.start_sample >= resume_from,
+            AudioChunks.chunk_id.not_in(chunk_ids)
+        )
+    )
+    await session.execute(
+        update(Download_videos)
+        .where(Download_videos.id == video_id)
+        .values(chunk_status=ChunkStatus.DONE, chunked_at=func.now(), envelope_path=envelope_file,
+                duration_ms=duration, sample_rate=sample_rate)
+    )
+
+# Record videos that could not be chunked; the chunks they already have are kept
+async def mark_chunking_failed(video_ids):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Download_videos)
+                .where(Download_videos.id.in_(video_ids))
+                .values(chunk_status=ChunkStatus.FAILED)
+            )
+
+# Save chunks and move the video's checkpoint past them in one transaction;
+# ``finish`` holds the _finish_video arguments once the last chunk is cut
+async def save_chunk_checkpoint(video_uuid, video_id, chunks, finish=None):
+    async with async_session() as session:
+        with stage_timer("chunk_db_commit"):
+            async with session.begin():
+                if chunks:
+                    await upsert_chunks(
+                        session, [dict(chunk, video_id=video_id, video_uuid=video_uuid) for chunk in chunks]
+                    )
+                    await session.execute(
+                        update(Download_videos)
+                        .where(Download_videos.id == video_id)
+                        .values(chunk_checkpoint=chunks[-1]["end_sample"])
+                    )
+                if finish is not None:
+                    await _finish_video(session, video_id, **finish)
+
+# Fetch the videos to batch-chunk: the given UUIDs, or every video not chunked yet.
+# Videos whose WAV was not kept have nothing to cut and are left out
+async def fetch_videos_to_chunk(uuids=None):
+    async with async_session() as session:
+        stmt = select(Download_videos.id, Download_videos.uuid, Download_videos.location,
+                      Download_videos.chunk_status, Download_videos.chunk_checkpoint,
+                      Download_videos.envelope_path)
+        stmt = stmt.where(func.coalesce(Download_videos.meta_data["source_kept"].as_boolean(), True))
+        if uuids:
+            stmt = stmt.where(Download_videos.uuid.in_(uuids))
+        else:
+            stmt = stmt.where(Download_videos.chunk_status == ChunkStatus.PENDING)
+        result = await session.execute(stmt.order_by(Download_videos.id))
+        return result.all()
+
+# Runs in a worker process: detect silence from the envelope index and export one video.
+# A failure is returned as ``error`` so the parent knows which video to mark failed
+def _chunk_video(video_id, uuid, location, envelope_file, output_dir, materialize, profile, segmentation,
+                 resume_from=0):
+    chunks, finish, error = [], None, None
+    with collect_metrics() as metrics:
+        try:
+            chunks = split_audio_streaming(location, chunk_directory(output_dir, uuid), materialize=materialize,
+                                           resume_from=resume_from, segmentation=segmentation, profile=profile,
+                                           envelope_file=envelope_file)
+            info = read_wav_info(location)
+            finish = {
+                "resume_from": resume_from,
+                "chunk_ids": [chunk_id_for(uuid, chunk["start_sample"]) for chunk in chunks],
+                "envelope_file": envelope_file,
+                "duration": duration_ms(info),
+                "sample_rate": info.sample_rate,
+            }
+        except Exception as e:
+            print(f"Error chunking video {uuid}: {e}")
+            error = str(e)
+    return video_id, uuid, chunks, finish, error, metrics
+
+# Insert buffered chunk rows and mark their videos as chunked in one transaction;
+# ``finished`` maps video ids to their _finish_video arguments
+async def save_chunk_batch(rows, video_ids, finished):
+    async with async_session() as session:
+        with stage_timer("chunk_db_commit"):
+            async with session.begin():
+                if rows:
+                    await upsert_chunks(session, rows)
+                for video_id in video_ids:
+                    await _finish_video(session, video_id, **finished[video_id])
+
+# Chunk many videos across a process pool, yielding a result per video as it finishes
+async def chunk_videos(uuids=None, output_dir=None, materialize=False, workers=CHUNK_WORKERS,
+                       profile=DEFAULT_PROFILE, segmentation=DEFAULT_SEGMENTATION):
+    """Chunk videos in parallel and save their chunks in bulk.
+
+    Yields ``{"uuid", "chunks"}`` for each video as soon as its worker returns.
+    Chunk rows are collected here in the parent and upserted every
+    ``CHUNK_INSERT_BATCH_SIZE`` rows, so a video is saved as a whole; videos an
+    interrupted single-video run left pending continue after their checkpoint.
+    Boundaries come from each video's envelope index, which is built on its
+    first run, so re-chunking with new ``segmentation`` skips decoding.
+    """
+    videos = await fetch_videos_to_chunk(uuids)
+    found = {video.uuid for video in videos}
+    for missing in sorted(set(uuids or ()) - found):
+        yield {"uuid": missing, "error": "No video with this UUID, or only its chunks were kept"}
+    if not videos:
+        return
+
+    loop = asyncio.get_running_loop()
+    rows, video_ids, finished = [], [], {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(videos))) as pool:
+        futures = [
+            loop.run_in_executor(pool, _chunk_video, video.id, video.uuid, video.location,
+                                 video.envelope_path or envelope_path(video.uuid), output_dir, materialize,
+                                 profile, segmentation,
+                                 video.chunk_checkpoint if video.chunk_status == ChunkStatus.PENDING else 0)
+            for video in videos
+        ]
+        for future in asyncio.as_completed(futures):
+            try:
+                video_id, uuid, chunks, finish, error, metrics = await future
+            except Exception as e:
+                print(f"Error chunking video in worker: {e}")
+                yield {"error": str(e)}
+                continue
+
+            replay_metrics(metrics)
+            if error is not None:
+                await mark_chunking_failed([video_id])
+                yield {"uuid": uuid, "error": error}
+                continue
+            rows.extend(dict(chunk, video_id=video_id, video_uuid=uuid) for chunk in chunks)
+            video_ids.append(video_id)
+            finished[video_id] = finish
+            if len(rows) >= CHUNK_INSERT_BATCH_SIZE:
+                await save_chunk_batch(rows, video_ids, finished)
+                rows, video_ids, finished = [], [], {}
+
+            yield {"uuid": uuid, "chunks": len(chunks)}
+
+    if video_ids:
+        await save_chunk_batch(rows, video_ids, finished)
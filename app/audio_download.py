@@ -2,85 +2,224 @@ import yt_dlp
 import uuid
 import os
 import re
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 from fastapi import HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.models import Download_videos
+from app.models import Download_videos, ChunkStatus
 from app.core.config import ORIGINAL_DIRECTORY
 from app.database import async_session
+from app.local_extractor import LocalMediaExtractor
+from app.metadata_cache import MetadataCache
+from app.wavfile import file_content_hash, read_wav_info, duration_ms
+from app.metrics import stage_timer, observe_stage, count_audio, IN_FLIGHT
+from app.storage import video_path, temp_path
+from app.stream_ingest import stream_ingest
+from app.chunk_encoding import DEFAULT_PROFILE
+from app.silence import DEFAULT_SEGMENTATION
+
+# Downloads running at once, and at most this many against a single host
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+DOWNLOAD_PER_HOST_CONCURRENCY = int(os.getenv("DOWNLOAD_PER_HOST_CONCURRENCY", "4"))
+
+# "local" swaps yt-dlp for a stand-in that serves files from LOCAL_MEDIA_DIRECTORY
+DOWNLOAD_EXTRACTOR = os.getenv("DOWNLOAD_EXTRACTOR", "yt-dlp")
+
+# yt-dlp and FFmpeg are blocking, so they run on these threads instead of the event loop
+download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY, thread_name_prefix="download")
+_host_limits = {}
+
+# Search results are stable for a while; resolved video info holds signed media
+# URLs that expire, so it is kept for a shorter time
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(24 * 3600)))
+VIDEO_INFO_CACHE_TTL = int(os.getenv("VIDEO_INFO_CACHE_TTL", str(3 * 3600)))
+
+metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+# Video URLs already in the database, loaded on first use
+_known_urls = None
+_known_urls_lock = asyncio.Lock()
+
+# Latest progress reported by yt-dlp for each query being downloaded
+download_progress = {}
+
+# URLs being downloaded right now; the database only knows about finished ones
+_in_flight_urls = set()
 
 def sanitize_filename(s):
     return re.sub(r'[\\/*?:"<>|]', "_", s)
 
-def get_next_video_name(directory):
-    # Find all files in the directory that match the pattern 'videoX.wav'
-    existing_files = [f for f in os.listdir(directory) if f.startswith("video") and f.endswith(".wav")]
-    
-    # Extract numbers from file names and find the next available number
-    video_numbers = [int(re.findall(r'\d+', f)[0]) for f in existing_files if re.findall(r'\d+', f)]
-    
-    next_video_number = max(video_numbers) + 1 if video_numbers else 1
-    return f"video{next_video_number}"  # Return only the name without extension
+def _host_limit(url):
+    host = urlparse(url).netloc or "local"
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(DOWNLOAD_PER_HOST_CONCURRENCY)
+    return _host_limits[host]
+
+def _extractor(ydl_opts):
+    if DOWNLOAD_EXTRACTOR == "local":
+        return LocalMediaExtractor(ydl_opts)
+    return yt_dlp.YoutubeDL(ydl_opts)
+
+# Record yt-dlp progress for one query
+def _progress_hook(query):
+    def hook(status):
+        download_progress[query] = {
+            "status": status.get("status"),
+            "downloaded_bytes": status.get("downloaded_bytes"),
+            "total_bytes": status.get("total_bytes") or status.get("total_bytes_estimate")
+        }
+    return hook
+
+# Time yt-dlp's post-processors (the FFmpeg audio extraction) as their own stage
+def _postprocessor_timer():
+    started = {}
+    def hook(status):
+        name = status.get("postprocessor")
+        if status.get("status") == "started":
+            started[name] = time.perf_counter()
+        elif status.get("status") == "finished" and name in started:
+            observe_stage("ffmpeg", time.perf_counter() - started.pop(name))
+    return hook
+
+# Bytes and seconds of the decoded audio, for the download metrics
+def _count_downloaded_audio(path):
+    try:
+        seconds = duration_ms(read_wav_info(path)) / 1000
+    except ValueError:
+        seconds = 0
+    count_audio("download", os.path.getsize(path), seconds)
+
+def _metadata_cache():
+    global metadata_cache
+    with _metadata_cache_lock:
+        if metadata_cache is None:
+            metadata_cache = MetadataCache()
+    return metadata_cache
+
+# Blocking: look up the video for a URL or the first search result for a topic
+def _resolve_video(ydl, query, is_url, use_cache=True):
+    """Return the info dict of the video to download, from the cache when possible."""
+    cache = _metadata_cache()
+    key = f"url:{query}" if is_url else f"search:{query}"
+    info_dict = cache.get(key) if use_cache else None
+    if info_dict is not None:
+        print(f"Using cached metadata for: {query}")
+        return info_dict
+
+    if is_url:
+        print(f"Downloading audio from URL: {query}")
+        # Extract the video info without downloading it yet
+        with stage_timer("resolve_metadata"):
+            info_dict = ydl.extract_info(query, download=False)
+        ttl = VIDEO_INFO_CACHE_TTL
+    else:
+        print(f"Searching for the first audio for topic: {query}")
+        # Use ytsearch to find the first video for the topic without downloading
+        with stage_timer("resolve_metadata"):
+            search_results = ydl.extract_info(f"ytsearch:{query}", download=False)
+        if not search_results.get('entries'):
+            raise HTTPException(status_code=404, detail="No video found for the topic.")
+        info_dict = search_results['entries'][0]
+        print(f"Found video URL: {info_dict.get('webpage_url')}")
+        ttl = SEARCH_CACHE_TTL
+
+    info_dict = ydl.sanitize_info(info_dict)
+    cache.put(key, info_dict, ttl)
+    cache.put(f"url:{info_dict.get('webpage_url')}", info_dict, VIDEO_INFO_CACHE_TTL)
+    return info_dict
+
+# Blocking: download using the info dict we already have instead of resolving it again.
+# Timed as yt_dlp, which includes the FFmpeg post-processing also timed as ffmpeg
+def _download_video(ydl, info_dict):
+    with stage_timer("yt_dlp"):
+        try:
+            return ydl.process_ie_result(dict(info_dict), download=True)
+        except Exception as e:
+            # Media URLs in cached info can expire; resolve the page again in that case
+            print(f"Downloading from cached metadata failed ({e}); extracting {info_dict.get('webpage_url')} again")
+            return ydl.extract_info(info_dict['webpage_url'], download=True)
+
+# Whether a video URL is already stored; known URLs are answered from memory
+async def is_duplicate_url(video_url):
+    global _known_urls
+    async with _known_urls_lock:
+        if _known_urls is None:
+            async with async_session() as session:
+                result = await session.execute(
+                    select(Download_videos.video_url).where(Download_videos.video_url != None)
+                )
+                _known_urls = set(result.scalars().all())
+    if video_url in _known_urls:
+        return True
+
+    # Other workers may have added it since the set was loaded
+    async with async_session() as session:
+        stmt = select(Download_videos.id).where(Download_videos.video_url == video_url).limit(1)
+        result = await session.execute(stmt)
+        if result.first() is None:
+            return False
+    _known_urls.add(video_url)
+    return True
+
+async def find_video_by_content_hash(content_hash):
+    async with async_session() as session:
+        stmt = select(Download_videos.uuid).where(Download_videos.content_hash == content_hash).limit(1)
+        result = await session.execute(stmt)
+        return result.scalar()
 
 async def download_audio(query: str, is_url: bool, use_sample_rate_16000: bool = False):
-    output_directory = ORIGINAL_DIRECTORY
+    loop = asyncio.get_running_loop()
 
-    # Create the output directory if it doesn't exist
-    if not os.path.exists(output_directory):
-        os.makedirs(output_directory)
+    # The video's UUID names its file, so allocating a name needs no directory scan
+    video_uuid = str(uuid.uuid4())
+    file_path_with_extension = video_path(ORIGINAL_DIRECTORY, video_uuid)
+    os.makedirs(os.path.dirname(file_path_with_extension), exist_ok=True)
 
-    # Generate the next available video name (e.g., "video1", "video2", etc.)
-    file_name = get_next_video_name(output_directory)
-    file_path = os.path.join(output_directory, file_name)  # Add ".wav" here once
+    # Download to a temporary name and rename it into place once it is complete
+    file_path = temp_path(file_path_with_extension[:-len(".wav")])
 
-    # Set options for yt-dlp to save audio in WAV format and directly name the file as 'videoX.wav'
+    # Set options for yt-dlp to save audio in WAV format as '<temporary name>.wav'
     ydl_opts = {
         'format': 'bestaudio/best',
         'postprocessors': [{
             'key': 'FFmpegExtractAudio',
             'preferredcodec': 'wav',
         }],
-        'outtmpl': f'{file_path}',  # Set output template with .wav extension
+        'outtmpl': f'{file_path}',  # Set output template; the post-processor adds .wav
         'quiet': True,
-        'noplaylist': True
+        'noplaylist': True,
+        'progress_hooks': [_progress_hook(query)],
+        'postprocessor_hooks': [_postprocessor_timer()]
     }
-    file_path_with_extension = f"{file_path}.wav"
+    downloaded_path = f"{file_path}.wav"
 
     # If the user opts for a sample rate of 16000, add corresponding FFmpeg arguments
     if use_sample_rate_16000:
         ydl_opts['postprocessor_args'] = ['-ar', '16000', '-ac', '1']  # Set sample rate to 16000 Hz and convert to mono
 
+    video_url = None
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            if is_url:
-                print(f"Downloading audio from URL: {query}")
-                # Extract and download the video directly from the URL
-                info_dict = ydl.extract_info(query, download=False)  # Don't download yet to get the info
-                video_url = info_dict.get('webpage_url')
-                video_title = info_dict.get('title', 'unknown')  # Extract the original title
-            else:
-                print(f"Searching for the first audio for topic: {query}")
-                # Use ytsearch to find the first video for the topic without downloading
-                search_results = ydl.extract_info(f"ytsearch:{query}", download=False)
-                if 'entries' in search_results and len(search_results['entries']) > 0:
-                    first_result = search_results['entries'][0]
-                    video_url = first_result.get('webpage_url')
-                    video_title = first_result.get('title', 'unknown')  # Extract the original title
-                    print(f"Found video URL: {video_url}")
-                else:
-                    raise HTTPException(status_code=404, detail="No video found for the topic.")
+        with _extractor(ydl_opts) as ydl:
+            resolved_info = await loop.run_in_executor(download_executor, _resolve_video, ydl, query, is_url)
+            video_url = resolved_info.get('webpage_url')
+            video_title = resolved_info.get('title', 'unknown')  # Extract the original title
+            if video_url in _in_flight_urls:
+                video_url = None
+                raise HTTPException(status_code=400, detail="Audio is already being downloaded.")
+            _in_flight_urls.add(video_url)
 
             # Check for duplicate in the database
-            async with async_session() as session:
-                async with session.begin():
-                    stmt = select(Download_videos).where(Download_videos.video_url == video_url)
-                    result = await session.execute(stmt)
-                    existing_video = result.scalars().first()
-                    if existing_video:
-                        raise HTTPException(status_code=400, detail="Audio already exists in the database.")
+            if await is_duplicate_url(video_url):
+                raise HTTPException(status_code=400, detail="Audio already exists in the database.")
 
             # Now proceed to download the video since it's not a duplicate
-            info_dict = ydl.extract_info(video_url, download=True)
+            async with _host_limit(video_url):
+                with IN_FLIGHT.labels("download").track_inprogress():
+                    info_dict = await loop.run_in_executor(download_executor, _download_video, ydl, resolved_info)
 
             # Extract metadata 
             audio_length = info_dict.get('duration')
@@ -97,24 +236,40 @@ async def download_audio(query: str, is_url: bool, use_sample_rate_16000: bool =
             }
 
             # Display the video download is completed
-            print(f"Download completed and saved as: {file_name}")
+            print(f"Download completed and saved as: {file_path_with_extension}")
+
+            # Mirrors and re-uploads decode to the same audio; don't keep a second copy
+            await loop.run_in_executor(download_executor, _count_downloaded_audio, downloaded_path)
+            with stage_timer("content_hash"):
+                content_hash = await loop.run_in_executor(download_executor, file_content_hash, downloaded_path)
+            existing_uuid = await find_video_by_content_hash(content_hash)
+            if existing_uuid:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Audio content already exists in the database (video {existing_uuid})."
+                )
 
-            # Generate a UUID for the video
-            video_uuid = str(uuid.uuid4())
+            # Publish the finished file under its final name
+            os.replace(downloaded_path, file_path_with_extension)
 
             # Save video info to the database with the original name and full path of the file
             async with async_session() as session:
-                async with session.begin():
-                    new_video = Download_videos(
-                        uuid=video_uuid,
-                        video_url=video_url,
-                        video_name=video_title,  # Save the original name in the database
-                        location=file_path_with_extension,       # Save the full path (including directory and .wav extension)
-                        meta_data=meta_data,
-                        chunk_status="False"
-                    )
-                    session.add(new_video)
-                await session.commit()
+                with stage_timer("download_db_commit"):
+                    async with session.begin():
+                        new_video = Download_videos(
+                            uuid=video_uuid,
+                            video_url=video_url,
+                            video_name=video_title,  # Save the original name in the database
+                            location=file_path_with_extension,       # Save the full path (including directory and .wav extension)
+                            meta_data=meta_data,
+                            chunk_status=ChunkStatus.PENDING,
+                            content_hash=content_hash
+                        )
+                        session.add(new_video)
+                    await session.commit()
+
+            if _known_urls is not None:
+                _known_urls.add(video_url)
 
             # Display message after pushing to the database
             print(f"Video information pushed to the database for: {video_title}")
@@ -123,8 +278,95 @@ async def download_audio(query: str, is_url: bool, use_sample_rate_16000: bool =
                 "uuid": video_uuid,
                 "video_name": video_title,  # Return the original title as the video name
                 "video_url": video_url,
-                "location": {file_path}  # Return the full path with .wav extension
+                "location": file_path_with_extension  # Return the full path with .wav extension
             }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Failed to download audio for query {query}. Error: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to download. Error: {e}")
+    finally:
+        _in_flight_urls.discard(video_url)
+        # Leftovers of a failed or rejected download
+        for leftover in (file_path, downloaded_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+# Decode a resolved video straight from its media URL, chunking while it streams
+async def stream_audio(query: str, is_url: bool, use_sample_rate_16000: bool = True, keep_source: bool = True,
+                       profile=DEFAULT_PROFILE, on_chunk=None, segmentation=DEFAULT_SEGMENTATION):
+    """Like download_audio, but chunks are registered while the audio is still decoding.
+
+    yt-dlp only resolves the media URL; FFmpeg reads it and pipes PCM into
+    stream_ingest. A cached media URL that has expired is resolved again once.
+    """
+    loop = asyncio.get_running_loop()
+    ydl_opts = {'format': 'bestaudio/best', 'quiet': True, 'noplaylist': True}
+    video_url = None
+    try:
+        with _extractor(ydl_opts) as ydl:
+            info_dict = await loop.run_in_executor(download_executor, _resolve_video, ydl, query, is_url)
+            video_url = info_dict.get('webpage_url')
+            if video_url in _in_flight_urls:
+                video_url = None
+                raise HTTPException(status_code=400, detail="Audio is already being downloaded.")
+            _in_flight_urls.add(video_url)
+            if await is_duplicate_url(video_url):
+                raise HTTPException(status_code=400, detail="Audio already exists in the database.")
+
+            if use_sample_rate_16000:
+                sample_rate, channels = 16000, 1
+            else:
+                sample_rate, channels = info_dict.get('asr') or 44100, info_dict.get('audio_channels') or 2
+
+            # Info cached by an older release may lack the media URL
+            if not info_dict.get('url'):
+                info_dict = await loop.run_in_executor(download_executor, _resolve_video, ydl, video_url, True, False)
+
+            for attempt in range(2):
+                try:
+                    async with _host_limit(video_url):
+                        with IN_FLIGHT.labels("download").track_inprogress():
+                            result = await stream_ingest(
+                                info_dict['url'], str(uuid.uuid4()), info_dict.get('title', 'unknown'), video_url,
+                                sample_rate, channels, headers=info_dict.get('http_headers'),
+                                keep_source=keep_source, profile=profile, on_chunk=on_chunk,
+                                segmentation=segmentation
+                            )
+                    break
+                except RuntimeError as e:
+                    if attempt:
+                        raise
+                    print(f"Streaming from resolved metadata failed ({e}); resolving {video_url} again")
+                    info_dict = await loop.run_in_executor(
+                        download_executor, _resolve_video, ydl, video_url, True, False
+                    )
+
+        if _known_urls is not None:
+            _known_urls.add(video_url)
+        return dict(result, video_name=info_dict.get('title', 'unknown'), video_url=video_url)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Failed to stream audio for query {query}. Error: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to stream. Error: {e}")
+    finally:
+        _in_flight_urls.discard(video_url)
+
+# Download many queries concurrently; a failed query is reported, not raised
+async def download_many(queries, is_url=False, use_sample_rate_16000=False, concurrency=DOWNLOAD_CONCURRENCY):
+    """Yield one result per query, in completion order."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download_one(query):
+        async with semaphore:
+            try:
+                result = await download_audio(query, is_url, use_sample_rate_16000)
+                return dict(result, query=query)
+            except HTTPException as e:
+                return {"query": query, "error": e.detail, "status_code": e.status_code}
+            finally:
+                download_progress.pop(query, None)
+
+    for result in asyncio.as_completed([download_one(query) for query in queries]):
+        yield await result
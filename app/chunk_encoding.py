@@ -0,0 +1,136 @@
+import io
+import os
+from collections import namedtuple
+import numpy as np
+import soundfile as sf
+import soxr
+from pydub import AudioSegment
+from app.silence import samples_from_bytes
+from app.storage import atomic_output
+from app.wavfile import is_mappable, open_samples
+
+# Format of exported and uploaded chunks. ASR models work on 16 kHz mono, so
+# anything above that is wasted disk and upload bandwidth; 0 keeps the source
+# sample rate or channel count
+CHUNK_SAMPLE_RATE = int(os.getenv("CHUNK_SAMPLE_RATE", "16000"))
+CHUNK_CHANNELS = int(os.getenv("CHUNK_CHANNELS", "1"))
+
+# wav, flac (lossless) or opus (lossy, smallest)
+CHUNK_CODEC = os.getenv("CHUNK_CODEC", "flac")
+
+# soundfile container and subtype, file extension and MIME type of each codec
+Codec = namedtuple("Codec", ["format", "subtype", "extension", "mime_type"])
+CODECS = {
+    "wav": Codec("WAV", "PCM_16", ".wav", "audio/wav"),
+    "flac": Codec("FLAC", "PCM_16", ".flac", "audio/flac"),
+    "opus": Codec("OGG", "OPUS", ".opus", "audio/ogg"),
+}
+
+# Opus only encodes at these rates; other rates are resampled to 48 kHz
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+ChunkProfile = namedtuple("ChunkProfile", ["sample_rate", "channels", "codec"])
+
+
+def chunk_profile(sample_rate=None, channels=None, codec=None):
+    """Build an output profile, taking unset fields from the environment."""
+    profile = ChunkProfile(
+        CHUNK_SAMPLE_RATE if sample_rate is None else sample_rate,
+        CHUNK_CHANNELS if channels is None else channels,
+        CHUNK_CODEC if codec is None else codec
+    )
+    if profile.codec not in CODECS:
+        raise ValueError(f"Unknown chunk codec {profile.codec!r}; expected one of {', '.join(CODECS)}")
+    if profile.sample_rate < 0 or profile.channels < 0:
+        raise ValueError("Chunk sample rate and channels must be positive, or 0 to keep the source")
+    return profile
+
+
+DEFAULT_PROFILE = chunk_profile()
+
+
+def mime_type(path):
+    """MIME type of a chunk file, from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    for codec in CODECS.values():
+        if codec.extension == extension:
+            return codec.mime_type
+    return "application/octet-stream"
+
+
+def is_passthrough(profile, sample_rate, channels, sample_width):
+    """Whether the profile leaves PCM WAV audio exactly as it is."""
+    return (
+        profile.codec == "wav"
+        and sample_width == 2
+        and profile.sample_rate in (0, sample_rate)
+        and profile.channels in (0, channels)
+    )
+
+
+# Interleaved integer PCM as (frames, channels) floats in [-1, 1]
+def pcm_to_float(samples, channels, sample_width):
+    full_scale = float(1 << (8 * sample_width - 1))
+    return np.asarray(samples).reshape(-1, channels).astype(np.float32) / full_scale
+
+
+def read_frames(path, info, start_sample, end_sample):
+    """Read frames [start_sample, end_sample) of a WAV file as float (frames, channels)."""
+    if is_mappable(info):
+        samples = open_samples(path, info)[start_sample * info.channels:end_sample * info.channels]
+        return pcm_to_float(samples, info.channels, info.sample_width)
+    # 8/24-bit payloads need converting to signed samples first
+    audio = AudioSegment.from_wav(path)
+    samples = samples_from_bytes(audio.raw_data, audio.sample_width)
+    return pcm_to_float(samples[start_sample * info.channels:end_sample * info.channels],
+                        info.channels, audio.sample_width)
+
+
+# Downmix and resample in one vectorized pass; soxr filters all channels together
+def apply_profile(frames, sample_rate, profile):
+    """Return the frames and sample rate the profile asks for."""
+    channels = frames.shape[1]
+    if profile.channels and profile.channels != channels:
+        if profile.channels == 1:
+            frames = frames.mean(axis=1, keepdims=True)
+        elif channels == 1:
+            frames = np.repeat(frames, profile.channels, axis=1)
+        else:
+            frames = frames[:, :profile.channels]
+
+    rate = profile.sample_rate or sample_rate
+    if profile.codec == "opus" and rate not in OPUS_SAMPLE_RATES:
+        rate = 48000
+    if rate != sample_rate and len(frames):
+        frames = soxr.resample(frames, sample_rate, rate, quality="HQ")
+    return frames, rate
+
+
+def encode_frames(target, frames, sample_rate, profile):
+    """Encode float frames to ``target`` (a path or binary file) in the profile's format."""
+    frames, rate = apply_profile(frames, sample_rate, profile)
+    codec = CODECS[profile.codec]
+    sf.write(target, np.clip(frames, -1.0, 1.0), rate, format=codec.format, subtype=codec.subtype)
+
+
+def encode_chunk(path, info, start_sample, end_sample, profile=DEFAULT_PROFILE):
+    """Encode a frame range of a WAV file in memory and return it as a file object."""
+    buffer = io.BytesIO()
+    encode_frames(buffer, read_frames(path, info, start_sample, end_sample), info.sample_rate, profile)
+    buffer.seek(0)
+    return buffer
+
+
+def write_frames(path_stem, frames, sample_rate, profile=DEFAULT_PROFILE):
+    """Write frames to ``path_stem`` plus the codec's extension and return that path."""
+    path = path_stem + CODECS[profile.codec].extension
+    with atomic_output(path) as temporary:
+        with open(temporary, "wb") as f:
+            encode_frames(f, frames, sample_rate, profile)
+    return path
+
+
+def write_chunk(path_stem, info, source_path, start_sample, end_sample, profile=DEFAULT_PROFILE):
+    """Export a frame range of a WAV file in the profile's format and return its path."""
+    return write_frames(path_stem, read_frames(source_path, info, start_sample, end_sample),
+                        info.sample_rate, profile)
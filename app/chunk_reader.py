@@ -0,0 +1,100 @@
+import os
+import asyncio
+from sqlalchemy.future import select
+from app.database import async_session
+from app.models import AudioChunks
+from app.storage import chunk_directory
+from app.wavfile import WavSlice, read_wav_info, open_payload, write_wav_frames, payload_hash, file_content_hash
+from app.chunk_encoding import DEFAULT_PROFILE, CODECS, is_passthrough, encode_chunk, write_chunk, mime_type
+
+# Size of the blocks yielded when streaming chunk audio
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def is_virtual(chunk):
+    """Whether the chunk only exists as offsets into its parent WAV."""
+    return not chunk.file_path and chunk.source_path is not None
+
+
+# Open a chunk's audio as a file object, whether it was exported or not
+def open_chunk_audio(chunk):
+    """Return a readable binary file object holding the chunk: a WAV slice if virtual, else its stored file."""
+    if is_virtual(chunk):
+        return WavSlice(chunk.source_path, chunk.start_sample, chunk.end_sample)
+    return open(chunk.file_path, "rb")
+
+
+# Exported chunks keep the codec they were encoded with (FLAC by default)
+def chunk_mime_type(chunk):
+    """MIME type of the bytes open_chunk_audio returns: WAV for virtual chunks, the file's own otherwise."""
+    return "audio/wav" if is_virtual(chunk) else mime_type(chunk.file_path)
+
+
+# File name, file object and MIME type to upload a chunk with
+def open_chunk_upload(chunk, profile=DEFAULT_PROFILE):
+    """Exported chunks are sent as stored; virtual chunks are encoded with ``profile``."""
+    if not is_virtual(chunk):
+        return os.path.basename(chunk.file_path), open(chunk.file_path, "rb"), mime_type(chunk.file_path)
+
+    info = read_wav_info(chunk.source_path)
+    if is_passthrough(profile, info.sample_rate, info.channels, info.sample_width):
+        return f"{chunk.chunk_id}.wav", open_chunk_audio(chunk), "audio/wav"
+    codec = CODECS[profile.codec]
+    audio_file = encode_chunk(chunk.source_path, info, chunk.start_sample, chunk.end_sample, profile)
+    return f"{chunk.chunk_id}{codec.extension}", audio_file, codec.mime_type
+
+
+# Chunks cut without being materialized are only hashed once their audio is needed
+def chunk_content_hash(chunk):
+    """xxh3-128 of the chunk's PCM payload, the same hash chunking records for materialized chunks."""
+    if chunk.source_path is not None and chunk.start_sample is not None:
+        info = read_wav_info(chunk.source_path)
+        return payload_hash(info, open_payload(chunk.source_path, info), chunk.start_sample, chunk.end_sample)
+    return file_content_hash(chunk.file_path)
+
+
+def iter_chunk_audio(chunk, block_size=READ_BLOCK_SIZE):
+    """Yield the chunk's audio bytes in blocks, for streaming responses; see chunk_mime_type for their format."""
+    with open_chunk_audio(chunk) as audio_file:
+        while True:
+            block = audio_file.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+# Write a virtual chunk to its own WAV file for consumers that need a path
+def materialize_chunk(chunk, output_dir, profile=DEFAULT_PROFILE):
+    """Export a virtual chunk to ``output_dir`` in ``profile``'s format and return its new file path."""
+    if not is_virtual(chunk):
+        return chunk.file_path
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    info = read_wav_info(chunk.source_path)
+    path_stem = os.path.join(output_dir, chunk.chunk_id)
+    if is_passthrough(profile, info.sample_rate, info.channels, info.sample_width):
+        return write_wav_frames(f"{path_stem}.wav", info, open_payload(chunk.source_path, info),
+                                chunk.start_sample, chunk.end_sample)
+    return write_chunk(path_stem, info, chunk.source_path, chunk.start_sample, chunk.end_sample, profile)
+
+
+async def get_chunk(chunk_id):
+    async with async_session() as session:
+        result = await session.execute(select(AudioChunks).where(AudioChunks.chunk_id == chunk_id))
+        return result.scalars().first()
+
+
+# Materialize a chunk and record its file path
+async def materialize_chunk_by_id(chunk_id, output_dir, profile=DEFAULT_PROFILE):
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(select(AudioChunks).where(AudioChunks.chunk_id == chunk_id))
+            chunk = result.scalars().first()
+            if chunk is None:
+                return None
+            chunk.file_path = await asyncio.to_thread(
+                materialize_chunk, chunk, chunk_directory(output_dir, chunk.video_uuid), profile
+            )
+        return chunk.file_path
@@ -6,12 +6,34 @@ from sqlalchemy import MetaData, text
 import pandas as pd
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncAttrs
+from app.transcript_text import TRANSCRIPT_TSVECTOR_FUNCTION
+import os
+
+# Connection pool and statement cache settings
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
 
 # Database configuration
-DATABASE_URL = f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
+DATABASE_URL = (
+    f'postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}'
+    f'?prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}'
+)
 
-# Create an async engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Create an async engine; SQL echo is opt-in so production logs stay quiet
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=DB_ECHO,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    query_cache_size=DB_STATEMENT_CACHE_SIZE
+)
 
 # Create a sessionmaker factory
 async_session = sessionmaker(
@@ -28,6 +50,81 @@ async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+# Idempotent migrations for tables created by earlier releases; create_all does not alter existing tables
+SCHEMA_UPGRADES = [
+    "ALTER TABLE audio_chunks ALTER COLUMN file_path DROP NOT NULL",
+    "ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS source_path VARCHAR",
+    "ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS start_sample INTEGER",
+    "ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS end_sample INTEGER",
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_download_videos_content_hash ON download_videos (content_hash)",
+    "ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_audio_chunks_content_hash ON audio_chunks (content_hash)",
+    # Status enums replace the "True"/"False" chunk_status strings and transcribe IS NULL checks
+    """DO $$ BEGIN
+        CREATE TYPE chunk_status AS ENUM ('pending', 'done', 'failed');
+    EXCEPTION WHEN duplicate_object THEN NULL; END $$""",
+    """DO $$ BEGIN
+        CREATE TYPE transcription_status AS ENUM ('pending', 'done', 'failed');
+    EXCEPTION WHEN duplicate_object THEN NULL; END $$""",
+    """DO $$ BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'download_videos' AND column_name = 'chunk_status') = 'character varying' THEN
+            ALTER TABLE download_videos ALTER COLUMN chunk_status DROP DEFAULT;
+            ALTER TABLE download_videos ALTER COLUMN chunk_status TYPE chunk_status
+                USING (CASE WHEN chunk_status = 'True' THEN 'done' ELSE 'pending' END)::chunk_status;
+            ALTER TABLE download_videos ALTER COLUMN chunk_status SET DEFAULT 'pending';
+            ALTER TABLE download_videos ALTER COLUMN chunk_status SET NOT NULL;
+        END IF;
+    END $$""",
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()",
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS chunked_at TIMESTAMP WITH TIME ZONE",
+    """DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'audio_chunks' AND column_name = 'transcription_status') THEN
+            ALTER TABLE audio_chunks ADD COLUMN transcription_status transcription_status NOT NULL DEFAULT 'pending';
+            UPDATE audio_chunks SET transcription_status = (CASE
+                WHEN transcribe IN ('Transcription failed', 'File not found',
+                                    'Error during transcription', 'Error: Non-JSON response') THEN 'failed'
+                ELSE 'done' END)::transcription_status
+            WHERE transcribe IS NOT NULL;
+        END IF;
+    END $$""",
+    "ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS transcribed_at TIMESTAMP WITH TIME ZONE",
+    # Indexes for the hot work-finding queries
+    "CREATE INDEX IF NOT EXISTS ix_audio_chunks_video_uuid ON audio_chunks (video_uuid)",
+    "CREATE INDEX IF NOT EXISTS ix_download_videos_pending_chunking ON download_videos (id) WHERE chunk_status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS ix_audio_chunks_pending_transcription ON audio_chunks (chunk_id) WHERE transcription_status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS ix_audio_chunks_pending_transcription_by_video ON audio_chunks (video_uuid, chunk_id) WHERE transcription_status = 'pending'",
+    # Progress of an interrupted chunking run
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS chunk_checkpoint INTEGER NOT NULL DEFAULT 0",
+    # Envelope index used to re-chunk without decoding the audio again
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS envelope_path VARCHAR",
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS duration_ms INTEGER",
+    # meta_data's rate is the source stream's, except for streamed videos, which record the decoded one;
+    # other videos get their rate when they are next chunked
+    "ALTER TABLE download_videos ADD COLUMN IF NOT EXISTS sample_rate INTEGER",
+    # Streams ingested without keeping their WAV have a chunk directory as location
+    """UPDATE download_videos SET meta_data = (meta_data::jsonb || '{"source_kept": false}')::json
+        WHERE meta_data->>'streamed' = 'true' AND meta_data->>'source_kept' IS NULL
+            AND location NOT LIKE '%.wav'""",
+    """UPDATE download_videos SET sample_rate = (meta_data->>'sampling_frequency(Hz)')::integer
+        WHERE sample_rate IS NULL AND meta_data->>'streamed' = 'true' AND chunk_status = 'done'""",
+    # Full-text search over transcripts
+    TRANSCRIPT_TSVECTOR_FUNCTION,
+    """ALTER TABLE audio_chunks ADD COLUMN IF NOT EXISTS transcript_tsv tsvector
+        GENERATED ALWAYS AS (transcript_tsvector(transcribe)) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_audio_chunks_transcript_tsv ON audio_chunks USING gin (transcript_tsv)",
+    """CREATE INDEX IF NOT EXISTS ix_audio_chunks_listing
+        ON audio_chunks (video_id, coalesce(start_sample, -1), chunk_id)""",
+]
+
+# Bring existing tables up to date with the models
+async def upgrade_schema():
+    async with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
+
 # Define a function to fetch data from PostgreSQL
 async def fetch_data(table_name):
     try:
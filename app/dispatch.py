@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from collections import deque
+import httpx
+from app.metrics import TRANSCRIPTION_ENDPOINT_REQUESTS, TRANSCRIPTION_HEDGES, TRANSCRIPTION_ENDPOINT_EJECTED
+from app.core.config import TRANSCRIPTION_API_URL
+
+# Transcription servers, comma-separated; just TRANSCRIPTION_API_URL when unset
+TRANSCRIPTION_API_URLS = [
+    url.strip() for url in os.getenv("TRANSCRIPTION_API_URLS", TRANSCRIPTION_API_URL).split(",") if url.strip()
+]
+
+# A request still running after this quantile of its server's recent latencies
+# is sent to a second server as well, and the first answer is used
+HEDGE_QUANTILE = float(os.getenv("TRANSCRIPTION_HEDGE_QUANTILE", "0.95"))
+
+# Bounds of the hedge delay in seconds; the upper bound applies until a server
+# has answered HEDGE_MIN_SAMPLES requests
+HEDGE_MIN_DELAY = float(os.getenv("TRANSCRIPTION_HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_DELAY = float(os.getenv("TRANSCRIPTION_HEDGE_MAX_DELAY", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("TRANSCRIPTION_HEDGE_MIN_SAMPLES", "20"))
+
+# Hedged requests allowed per request sent, so a cluster-wide slowdown does not double the load
+HEDGE_BUDGET = float(os.getenv("TRANSCRIPTION_HEDGE_BUDGET", "0.1"))
+
+# Consecutive failures that take a server out of rotation, and seconds before it is probed again
+BREAKER_FAILURES = int(os.getenv("TRANSCRIPTION_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("TRANSCRIPTION_BREAKER_COOLDOWN", "30"))
+
+# Recent latencies kept per server
+_LATENCY_WINDOW = 200
+
+
+# Health of one transcription server, shared by every dispatcher in the process
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.latency = None  # Moving average of successful request seconds
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+        self.failures = 0  # Consecutive
+        self.open_until = 0.0
+        self.probing = False
+
+    @property
+    def ejected(self):
+        return self.failures >= BREAKER_FAILURES
+
+    def available(self, now):
+        """Closed breakers take any request; an open one takes a single probe after its cooldown."""
+        return not self.ejected or (now >= self.open_until and not self.probing)
+
+    def hedge_delay(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_MAX_DELAY
+        ordered = sorted(self.latencies)
+        quantile = ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * len(ordered)))]
+        return min(max(quantile, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def succeeded(self, seconds):
+        self.latencies.append(seconds)
+        self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+        self.answered()
+
+    # Any answer that does not count against the server closes its breaker
+    def answered(self):
+        if self.ejected:
+            print(f"Transcription server {self.url} is back in rotation")
+        self.failures = 0
+        self.probing = False
+        TRANSCRIPTION_ENDPOINT_EJECTED.labels(self.url).set(0)
+
+    def failed(self):
+        self.failures += 1
+        self.probing = False
+        if self.ejected:
+            if self.failures == BREAKER_FAILURES:
+                print(f"Transcription server {self.url} failed {self.failures} times in a row; "
+                      f"ejecting it for {BREAKER_COOLDOWN:.0f}s")
+            self.open_until = time.monotonic() + BREAKER_COOLDOWN
+            TRANSCRIPTION_ENDPOINT_EJECTED.labels(self.url).set(1)
+
+    def status(self):
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "latency_seconds": self.latency,
+            "hedge_delay_seconds": self.hedge_delay(),
+            "consecutive_failures": self.failures,
+            "ejected": self.ejected,
+        }
+
+
+_endpoints = {}
+
+
+def endpoint_for(url):
+    if url not in _endpoints:
+        _endpoints[url] = Endpoint(url)
+    return _endpoints[url]
+
+
+def endpoint_status():
+    """Health of every transcription server this process has sent requests to."""
+    return [endpoint.status() for endpoint in _endpoints.values()]
+
+
+# Errors that say nothing about a server's health, e.g. a chunk it cannot decode
+def _counts_against_server(error):
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return True
+
+
+def _close_files(files):
+    for _, file_object, *_ in files.values():
+        if hasattr(file_object, "close"):
+            file_object.close()
+
+
+class TranscriptionDispatcher:
+    """Send transcription requests across ``urls`` through one pooled client.
+
+    Each request goes to the available server with the shortest expected wait,
+    (outstanding requests + 1) x its recent latency. A request still running
+    after the server's p95 latency is hedged to a second server, and one that
+    fails is retried there at once; the first successful answer is returned.
+    A server failing BREAKER_FAILURES times in a row is ejected for
+    BREAKER_COOLDOWN seconds, after which a single request probes it.
+    """
+
+    def __init__(self, client, urls=TRANSCRIPTION_API_URLS):
+        if not urls:
+            raise ValueError("No transcription servers configured")
+        self.client = client
+        self.endpoints = [endpoint_for(url) for url in urls]
+        self._hedge_tokens = 1.0
+
+    def pick(self, exclude=()):
+        now = time.monotonic()
+        candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+        if not candidates:
+            return None
+        known = sorted(e.latency for e in self.endpoints if e.latency is not None)
+        # Servers that have not answered yet are assumed to be as fast as the typical one
+        typical = known[len(known) // 2] if known else 1.0
+        chosen = min(candidates, key=lambda e: ((e.outstanding + 1) * (e.latency or typical), e.outstanding))
+        if chosen.ejected:
+            chosen.probing = True
+        return chosen
+
+    # With every server ejected, wait for the first cooldown to end
+    async def wait_for_endpoint(self):
+        while (endpoint := self.pick()) is None:
+            now = time.monotonic()
+            reopening = [e.open_until - now for e in self.endpoints if e.open_until > now]
+            await asyncio.sleep(max(0.1, min(reopening, default=0.1)))
+        return endpoint
+
+    def _spend_hedge(self):
+        if self._hedge_tokens < 1:
+            return False
+        self._hedge_tokens -= 1
+        return True
+
+    async def _attempt(self, endpoint, files, reopen=None):
+        probe = endpoint.ejected
+        endpoint.outstanding += 1
+        outcome = "cancelled"
+        opened = None
+        try:
+            if reopen is not None:
+                files = opened = await reopen()
+            started = time.perf_counter()
+            response = await self.client.post(endpoint.url, files=files)
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError as e:
+                if _counts_against_server(e):
+                    raise
+                endpoint.answered()
+                outcome = "rejected"
+                return response
+            endpoint.succeeded(time.perf_counter() - started)
+            outcome = "ok"
+            return response
+        except httpx.HTTPError:
+            endpoint.failed()
+            outcome = "error"
+            raise
+        finally:
+            # A cancelled probe (a hedge that lost, or a cancelled caller) must not keep the server out
+            if probe:
+                endpoint.probing = False
+            endpoint.outstanding -= 1
+            TRANSCRIPTION_ENDPOINT_REQUESTS.labels(endpoint.url, outcome).inc()
+            if opened is not None:
+                _close_files(opened)
+
+    async def post(self, files, reopen=None):
+        """POST multipart ``files`` and return the first response a server gives without failing.
+
+        A streamed body can only be sent once, so a hedged or retried request
+        sends the files ``await reopen()`` returns instead; without ``reopen``
+        ``files`` must hold bytes.
+        """
+        self._hedge_tokens = min(self._hedge_tokens + HEDGE_BUDGET, 10.0)
+        primary = await self.wait_for_endpoint()
+        attempts = {asyncio.create_task(self._attempt(primary, files)): primary}
+        tried = [primary]
+        error = None
+        try:
+            while attempts:
+                # Only the first request is ever hedged or retried
+                delay = primary.hedge_delay() if len(tried) == 1 else None
+                done, _ = await asyncio.wait(attempts, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    endpoint = attempts.pop(task)
+                    try:
+                        response = task.result()
+                    except httpx.HTTPError as e:
+                        error = e
+                        continue
+                    if endpoint is not primary:
+                        TRANSCRIPTION_HEDGES.labels("won").inc()
+                    return response
+
+                if len(tried) == 1:
+                    backup = self.pick(exclude=tried) if done or self._spend_hedge() else None
+                    tried.append(backup)
+                    if backup is not None:
+                        if not done:
+                            TRANSCRIPTION_HEDGES.labels("sent").inc()
+                        attempts[asyncio.create_task(self._attempt(backup, files, reopen))] = backup
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+            await asyncio.gather(*attempts, return_exceptions=True)
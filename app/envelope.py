@@ -0,0 +1,129 @@
+import os
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from pydub import AudioSegment
+from sqlalchemy.future import select
+from app.database import async_session
+from app.models import Download_videos
+from app.silence import (
+    ENVELOPE_FRAME_MS, samples_from_bytes, frame_power, frame_length, power_to_dbfs, dbfs_to_power, chunk_ranges
+)
+from app.storage import shard_path, atomic_output
+from app.wavfile import is_mappable, open_samples, duration_ms
+from app.metrics import stage_timer, count_audio
+from app.core.config import ORIGINAL_DIRECTORY
+
+# Where envelope indexes are stored; next to the decoded WAVs unless set
+ENVELOPE_DIRECTORY = os.getenv("ENVELOPE_DIRECTORY", ORIGINAL_DIRECTORY)
+
+# Worker processes used to preview chunk boundaries of many videos
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", str(os.cpu_count() or 1)))
+
+
+def envelope_path(video_uuid, root=ENVELOPE_DIRECTORY):
+    """Where the envelope index of a video is stored."""
+    return shard_path(root, video_uuid) + ".envelope.npy"
+
+
+# An index holds one float32 dBFS level per ENVELOPE_FRAME_MS frame; chunking
+# always works from these stored levels, so boundaries do not depend on
+# whether the index was just built or read back
+def quantize(power):
+    """Return a power envelope exactly as it reads back from an index."""
+    return dbfs_to_power(power_to_dbfs(power).astype(np.float32))
+
+
+def compute_envelope(audio_file, info):
+    """Decode a WAV file block by block and return its power envelope."""
+    count_audio("chunking", info.data_size, duration_ms(info) / 1000)
+    with stage_timer("wav_decode"):
+        if is_mappable(info):
+            # Pages of the mapped samples are read lazily, so their I/O shows up
+            # under silence_detection
+            samples = open_samples(audio_file, info)
+            sample_width = info.sample_width
+        else:
+            # 8/24-bit payloads need converting to signed samples first
+            audio = AudioSegment.from_wav(audio_file)
+            samples = samples_from_bytes(audio.raw_data, audio.sample_width)
+            sample_width = audio.sample_width
+
+    with stage_timer("silence_detection"):
+        return quantize(frame_power(samples, info.channels, sample_width, frame_length(info.sample_rate)))
+
+
+def save_envelope(path, power):
+    """Write a power envelope to ``path`` as a memory-mappable .npy of dBFS levels."""
+    with atomic_output(path) as temporary:
+        with open(temporary, "wb") as f:
+            np.save(f, power_to_dbfs(power).astype(np.float32))
+    return path
+
+
+def load_envelope(path):
+    """Read an envelope index back as a power envelope."""
+    with stage_timer("envelope_load"):
+        return dbfs_to_power(np.load(path, mmap_mode="r"))
+
+
+# Runs in a worker process: chunk boundaries of one video from its index
+def _preview_video(video_uuid, envelope_file, duration, params):
+    ranges = chunk_ranges(load_envelope(envelope_file), ENVELOPE_FRAME_MS, duration, **params._asdict())
+    return video_uuid, ranges
+
+
+async def fetch_indexed_videos(uuids=None):
+    async with async_session() as session:
+        stmt = select(Download_videos.uuid, Download_videos.envelope_path, Download_videos.duration_ms)
+        stmt = stmt.where(Download_videos.envelope_path.is_not(None))
+        if uuids:
+            stmt = stmt.where(Download_videos.uuid.in_(uuids))
+        result = await session.execute(stmt.order_by(Download_videos.id))
+        return result.all()
+
+
+def summarize_ranges(ranges, duration):
+    seconds = sum(end - start for start, end in ranges) / 1000
+    return {
+        "chunks": len(ranges),
+        "chunk_seconds": seconds,
+        "audio_seconds": duration / 1000,
+        "mean_chunk_seconds": seconds / len(ranges) if ranges else 0,
+    }
+
+
+# Chunk boundaries for new parameters, read from the indexes alone
+async def preview_videos(params, uuids=None, include_ranges=False, workers=PREVIEW_WORKERS):
+    """Yield the chunk boundaries ``params`` would give each indexed video.
+
+    Only the envelope indexes are read, so a sweep over many videos takes
+    seconds. Videos are indexed when they are chunked; ones that have not been
+    chunked since indexes were introduced are reported as missing.
+    """
+    videos = await fetch_indexed_videos(uuids)
+    found = {video.uuid for video in videos}
+    for missing in sorted(set(uuids or ()) - found):
+        yield {"uuid": missing, "error": "No envelope index; chunk the video to build one"}
+    if not videos:
+        return
+
+    loop = asyncio.get_running_loop()
+    durations = {video.uuid: video.duration_ms for video in videos}
+    with ProcessPoolExecutor(max_workers=min(workers, len(videos))) as pool:
+        futures = [
+            loop.run_in_executor(pool, _preview_video, video.uuid, video.envelope_path, video.duration_ms, params)
+            for video in videos
+        ]
+        for future in asyncio.as_completed(futures):
+            try:
+                video_uuid, ranges = await future
+            except Exception as e:
+                print(f"Error previewing video in worker: {e}")
+                yield {"error": str(e)}
+                continue
+            result = {"uuid": video_uuid, **summarize_ranges(ranges, durations[video_uuid])}
+            if include_ranges:
+                result["ranges"] = ranges
+            yield result
+
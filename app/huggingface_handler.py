@@ -1,23 +1,68 @@
+import asyncio
+import json
+import os
+import time
 from datasets import load_dataset, Dataset
-from app.database import async_session, create_tables, Base
-from sqlalchemy import Column, Integer, String
+from app.database import create_tables, Base, engine
+from sqlalchemy import Column, Integer, BigInteger, Float, Boolean, String
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncSession
 import pandas as pd
 from app.core.config import HUGGINGFACE_TOKEN
 from huggingface_hub import HfApi
 
 HF_TOKEN = HUGGINGFACE_TOKEN
 
+# Rows written per COPY; each batch is committed on its own
+COPY_BATCH_SIZE = int(os.getenv("COPY_BATCH_SIZE", "50000"))
+
+# Rows inspected to infer the column types
+TYPE_SAMPLE_SIZE = int(os.getenv("TYPE_SAMPLE_SIZE", "1000"))
+
+_INT32_MAX = 2 ** 31 - 1
+_INT64_MAX = 2 ** 63 - 1
+
+# Type of a single value, or None when it says nothing about the column
+def _value_type(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return Boolean
+    if isinstance(value, int):
+        if -_INT32_MAX - 1 <= value <= _INT32_MAX:
+            return Integer
+        # JSON numbers keep integers too large for BIGINT exactly
+        return BigInteger if -_INT64_MAX - 1 <= value <= _INT64_MAX else JSONB
+    if isinstance(value, float):
+        return Float
+    if isinstance(value, str):
+        return String
+    return JSONB
+
+# Widen a column type so it can hold values of both types
+def _merge_types(current, new):
+    # A null says nothing about the column
+    if new is None or current is new:
+        return current
+    if current is None:
+        return new
+    numeric = [Integer, BigInteger, Float]
+    if current in numeric and new in numeric:
+        return max(current, new, key=numeric.index)
+    return JSONB
+
 # Function to determine SQLAlchemy data types
-def determine_column_types(sample):
+def determine_column_types(samples):
+    """Infer a column type for every key seen in one sample row or a list of them."""
+    if isinstance(samples, dict):
+        samples = [samples]
     column_types = {}
-    for key, value in sample.items():
-        if isinstance(value, int):
-            column_types[key] = Integer
-        elif isinstance(value, str):
-            column_types[key] = String
-    return column_types
+    for sample in samples:
+        for key, value in sample.items():
+            column_types[key] = _merge_types(column_types.get(key), _value_type(value))
+    # Columns that were always null can hold anything
+    return {key: dtype or JSONB for key, dtype in column_types.items()}
 
 # Function to dynamically create a table class
 def create_table_class(table_name, columns):
@@ -31,30 +76,144 @@ def create_table_class(table_name, columns):
     
     return DynamicTable
 
-async def insert_data_to_postgres(dataset_name: str, table_name: str):
+# Python types a column takes as they are; anything else goes through _merge_types
+_NATIVE_KINDS = {Integer: {int}, BigInteger: {int}, Float: {float}, Boolean: {bool}}
+
+# Type a column needs to hold a batch: types were inferred from the first rows
+# only, so later values may need a wider one. Text and JSONB hold anything.
+def _batch_column_type(values, dtype):
+    if dtype is String or dtype is JSONB:
+        return dtype
+    # Checking the Python types and integer range in bulk first keeps the common case fast
+    kinds = set(map(type, values))
+    kinds.discard(type(None))
+    if kinds <= _NATIVE_KINDS[dtype]:
+        if dtype is not Integer and dtype is not BigInteger:
+            return dtype
+        # Nulls and zeros are dropped, neither can be out of range
+        limit = _INT32_MAX if dtype is Integer else _INT64_MAX
+        if -limit - 1 <= min(filter(None, values), default=0) and max(filter(None, values), default=0) <= limit:
+            return dtype
+    for value_type in set(map(_value_type, values)):
+        dtype = _merge_types(dtype, value_type)
+    return dtype
+
+# Columns of a batch whose values do not fit their current type, with the type they need
+def widen_column_types(batch, column_types):
+    widened = {}
+    for name, dtype in column_types.items():
+        if name in batch:
+            needed = _batch_column_type(batch[name], dtype)
+            if needed is not dtype:
+                widened[name] = needed
+    return widened
+
+# Convert a column to what asyncpg's binary COPY expects for its type;
+# ints and bools are encoded as they are
+def _convert_column(values, dtype):
+    if dtype is JSONB:
+        dumps = json.dumps
+        return [None if value is None else dumps(value, default=str) for value in values]
+    if dtype is String:
+        dumps = json.dumps
+        return [
+            value if value is None or type(value) is str
+            else dumps(value, default=str) if isinstance(value, (dict, list)) else str(value)
+            for value in values
+        ]
+    if dtype is Float and int in set(map(type, values)):
+        return [value if value is None else float(value) for value in values]
+    return values
+
+# Turn a columnar batch ({column: [values]}) into COPY records
+def batch_to_records(batch, column_types):
+    size = len(next(iter(batch.values()))) if batch else 0
+    columns = [
+        _convert_column(batch[name], dtype) if name in batch else [None] * size
+        for name, dtype in column_types.items()
+    ]
+    return list(zip(*columns))
+
+# Columnar batches of the dataset, decoded from Arrow record batches
+def _iter_batches(dataset, batch_size):
+    for table in dataset.with_format("arrow").iter(batch_size=batch_size):
+        yield table.to_pydict()
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+# Widen columns and copy a batch in one transaction, so a failed batch changes nothing
+async def _copy_batch(connection, table_name, column_names, records, widened=None):
+    async with connection.transaction():
+        for name, dtype in (widened or {}).items():
+            column = _quote(name)
+            sql_type = dtype().compile(dialect=postgresql.dialect())
+            using = f"to_jsonb({column})" if dtype is JSONB else f"{column}::{sql_type}"
+            await connection.execute(
+                f"ALTER TABLE {_quote(table_name)} ALTER COLUMN {column} TYPE {sql_type} USING {using}"
+            )
+        if widened:
+            # COPY looks the column types up through asyncpg's statement cache
+            await connection.reload_schema_state()
+        await connection.copy_records_to_table(table_name, records=records, columns=column_names)
+
+async def insert_data_to_postgres(dataset_name: str, table_name: str, batch_size: int = COPY_BATCH_SIZE):
+    """Stream a Hugging Face dataset into a table with binary COPY.
+
+    Rows are read in Arrow-backed batches and each batch is copied and committed
+    on its own, so memory is bounded by ``batch_size`` and a failure only loses
+    the batch in progress. Column types come from the first rows; a later value
+    that does not fit widens its column (INTEGER to BIGINT to FLOAT, else JSONB).
+    """
     try:
-        # Load the dataset from Hugging Face
-        dataset = load_dataset(dataset_name, split='train')
-        
-        # Extract column types from the first sample
-        sample = dataset[0]
-        column_types = determine_column_types(sample)
-        
+        # Stream the dataset from Hugging Face instead of materializing it
+        dataset = load_dataset(dataset_name, split='train', streaming=True)
+
+        # Extract column types from the first rows
+        sample_batch = await asyncio.to_thread(next, _iter_batches(dataset, TYPE_SAMPLE_SIZE), None)
+        if not sample_batch:
+            return f"Dataset '{dataset_name}' is empty"
+        sample_rows = [dict(zip(sample_batch, values)) for values in zip(*sample_batch.values())]
+        column_types = determine_column_types(sample_rows)
+
         # Create the table class dynamically
         TableClass = create_table_class(table_name, column_types)
-        
+
         # Create the table if it doesn't exist
         await create_tables()
-        
-        # Insert data into the table
-        async with async_session() as session:
-            for item in dataset:
-                record = TableClass(**item)
-                session.add(record)
-            
-            await session.commit()
-        return f"Dataset '{dataset_name}' successfully loaded into table '{table_name}'"
-    
+
+        column_names = list(column_types)
+        batches = _iter_batches(dataset, batch_size)
+        loaded = 0
+        started = time.perf_counter()
+
+        async with engine.connect() as conn:
+            raw_connection = await conn.get_raw_connection()
+            connection = raw_connection.driver_connection
+
+            # Read the next batch in a thread while the current one is copied
+            next_batch = asyncio.create_task(asyncio.to_thread(next, batches, None))
+            while True:
+                batch = await next_batch
+                if not batch:
+                    break
+                next_batch = asyncio.create_task(asyncio.to_thread(next, batches, None))
+
+                # Values the sampled types cannot hold widen their column instead of failing the COPY
+                widened = await asyncio.to_thread(widen_column_types, batch, column_types)
+                for name, dtype in widened.items():
+                    print(f"Widening column '{name}' of '{table_name}' from {column_types[name].__name__} "
+                          f"to {dtype.__name__}")
+                records = await asyncio.to_thread(batch_to_records, batch, {**column_types, **widened})
+                await _copy_batch(connection, table_name, column_names, records, widened)
+                column_types.update(widened)
+
+                loaded += len(records)
+                elapsed = time.perf_counter() - started
+                print(f"Loaded {loaded} rows into '{table_name}' ({loaded / elapsed:.0f} rows/s)")
+
+        return f"Dataset '{dataset_name}' successfully loaded into table '{table_name}' ({loaded} rows)"
+
     except Exception as e:
         raise Exception(f"Error: {str(e)}")
 
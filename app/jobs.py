@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update, func
+from sqlalchemy.future import select
+from app.database import async_session
+from app.models import Jobs
+
+# Pipeline stages, in order; each stage enqueues the next when it finishes
+STAGES = ("download", "chunk", "transcribe")
+
+# A job is retried until it has been attempted this many times
+MAX_ATTEMPTS = 3
+
+
+def job_to_dict(job):
+    return {
+        "job_id": job.id,
+        "stage": job.stage,
+        "status": job.status,
+        "attempts": job.attempts,
+        "payload": job.payload,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
+    }
+
+
+# Add jobs to the queue within an existing session
+def add_jobs(session, stage, payloads):
+    jobs = [Jobs(stage=stage, payload=payload, status="queued", attempts=0) for payload in payloads]
+    session.add_all(jobs)
+    return jobs
+
+
+async def enqueue_jobs(stage, payloads):
+    """Queue one job per payload and return their ids."""
+    async with async_session() as session:
+        async with session.begin():
+            jobs = add_jobs(session, stage, payloads)
+        return [job.id for job in jobs]
+
+
+async def enqueue_job(stage, payload):
+    return (await enqueue_jobs(stage, [payload]))[0]
+
+
+async def get_job(job_id):
+    async with async_session() as session:
+        result = await session.execute(select(Jobs).where(Jobs.id == job_id))
+        return result.scalars().first()
+
+
+# Claim the oldest queued job of a stage; concurrent workers skip each other's rows
+async def claim_job(stage):
+    async with async_session() as session:
+        async with session.begin():
+            stmt = (
+                select(Jobs)
+                .where(Jobs.stage == stage, Jobs.status == "queued")
+                .order_by(Jobs.created_at)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            result = await session.execute(stmt)
+            job = result.scalars().first()
+            if job is None:
+                return None
+            job.status = "running"
+            job.attempts += 1
+        return job
+
+
+# Mark a job done and queue its follow-up jobs in the same transaction
+async def complete_job(job_id, result, next_stage=None, next_payloads=()):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Jobs).where(Jobs.id == job_id).values(status="done", result=result, error=None)
+            )
+            if next_stage and next_payloads:
+                add_jobs(session, next_stage, next_payloads)
+
+
+# Put a failed job back on the queue, or give up once it is out of attempts
+async def fail_job(job_id, error, retry=True):
+    async with async_session() as session:
+        async with session.begin():
+            result = await session.execute(select(Jobs).where(Jobs.id == job_id))
+            job = result.scalars().first()
+            if job is None:
+                return
+            job.error = error
+            job.status = "queued" if retry and job.attempts < MAX_ATTEMPTS else "failed"
+
+
+# Keep a running job's lease alive
+async def heartbeat_job(job_id):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(update(Jobs).where(Jobs.id == job_id).values(updated_at=func.now()))
+
+
+# Requeue jobs whose worker died while running them (no heartbeat within the lease)
+async def requeue_stale_jobs(stage, lease_seconds):
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=lease_seconds)
+    stale = (Jobs.stage == stage) & (Jobs.status == "running") & (Jobs.updated_at < cutoff)
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Jobs).where(stale, Jobs.attempts >= MAX_ATTEMPTS)
+                .values(status="failed", error="Worker lease expired")
+            )
+            result = await session.execute(update(Jobs).where(stale).values(status="queued"))
+        return result.rowcount
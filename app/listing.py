@@ -0,0 +1,159 @@
+import base64
+import csv
+import io
+import json
+import os
+from sqlalchemy import and_, func, not_, tuple_
+from sqlalchemy.future import select
+from app.database import engine, async_session
+from app.models import AudioChunks, Download_videos, TranscriptionStatus, offset_ms
+
+# Rows a listing page may hold
+LIST_PAGE_LIMIT = int(os.getenv("LIST_PAGE_LIMIT", "1000"))
+
+# Rows fetched from the server-side cursor at a time while exporting transcripts
+TRANSCRIPT_EXPORT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_EXPORT_BATCH_SIZE", "2000"))
+
+# Columns that can be listed, by name; the search column is Postgres' own
+VIDEO_FIELDS = {column.key: column for column in Download_videos.__table__.columns}
+CHUNK_FIELDS = {column.key: column for column in AudioChunks.__table__.columns if column.key != "transcript_tsv"}
+
+# Columns of a transcript export unless others are asked for; start_ms and end_ms
+# are worked out from the sample rate of the video's decoded WAV
+EXPORT_FIELDS = ("chunk_id", "video_uuid", "start_ms", "end_ms", "transcribe")
+_DERIVED_FIELDS = {"start_ms": "start_sample", "end_ms": "end_sample"}
+TRANSCRIPT_FIELDS = {**CHUNK_FIELDS, **{name: CHUNK_FIELDS[source] for name, source in _DERIVED_FIELDS.items()}}
+
+# Keys rows are listed in, matching the primary key and ix_audio_chunks_listing
+_VIDEO_KEY = (Download_videos.id,)
+_CHUNK_KEY = (AudioChunks.video_id, func.coalesce(AudioChunks.start_sample, -1), AudioChunks.chunk_id)
+
+
+def parse_fields(fields, available, default=None):
+    """Column names from a comma-separated ``fields``; all of ``available`` when empty."""
+    if not fields:
+        return list(default or available)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(available)}")
+    return list(dict.fromkeys(names))
+
+
+# Cursors are the key of the last row returned, opaque to clients
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list) or len(key) != length:
+        raise ValueError("Invalid cursor")
+    return key
+
+
+def _video_id_of(video_uuid):
+    return select(Download_videos.id).where(Download_videos.uuid == video_uuid).scalar_subquery()
+
+
+def _transcript_condition(has_transcript):
+    condition = and_(AudioChunks.transcription_status == TranscriptionStatus.DONE, AudioChunks.transcribe.is_not(None))
+    return condition if has_transcript else not_(condition)
+
+
+def _chunk_conditions(video_uuid=None, transcription_status=None, has_transcript=None):
+    conditions = []
+    if video_uuid is not None:
+        # Filtering on the video's id lets the listing index serve the order too
+        conditions.append(AudioChunks.video_id == _video_id_of(video_uuid))
+    if transcription_status is not None:
+        conditions.append(AudioChunks.transcription_status == transcription_status)
+    if has_transcript is not None:
+        conditions.append(_transcript_condition(has_transcript))
+    return conditions
+
+
+# One page of rows after ``cursor`` in key order, and the cursor of the next page
+async def _list_page(fields, available, key, conditions, cursor, limit):
+    names = parse_fields(fields, available)
+    keys = [column.label(f"_key{i}") for i, column in enumerate(key)]
+    stmt = select(*(available[name] for name in names), *keys).where(*conditions)
+    if cursor is not None:
+        stmt = stmt.where(tuple_(*key) > tuple_(*decode_cursor(cursor, len(key))))
+    stmt = stmt.order_by(*key).limit(limit + 1)
+
+    async with async_session() as session:
+        rows = (await session.execute(stmt)).all()
+
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > len(page):
+        last = page[-1]._mapping
+        next_cursor = encode_cursor(last[f"_key{i}"] for i in range(len(key)))
+    return {
+        "items": [{name: row._mapping[name] for name in names} for row in page],
+        "next_cursor": next_cursor,
+    }
+
+
+async def list_videos(fields=None, chunk_status=None, cursor=None, limit=100):
+    """A page of downloaded videos in id order, as ``{"items", "next_cursor"}``."""
+    conditions = [] if chunk_status is None else [Download_videos.chunk_status == chunk_status]
+    return await _list_page(fields, VIDEO_FIELDS, _VIDEO_KEY, conditions, cursor, limit)
+
+
+async def list_chunks(fields=None, video_uuid=None, transcription_status=None, has_transcript=None,
+                      cursor=None, limit=100):
+    """A page of chunks ordered by video and position, as ``{"items", "next_cursor"}``.
+
+    has_transcript selects chunks with (or without) a successful transcript.
+    """
+    conditions = _chunk_conditions(video_uuid, transcription_status, has_transcript)
+    return await _list_page(fields, CHUNK_FIELDS, _CHUNK_KEY, conditions, cursor, limit)
+
+
+# Transcript rows straight from a server-side cursor, a batch at a time
+async def stream_transcripts(names=EXPORT_FIELDS, video_uuid=None, transcription_status=None, has_transcript=True,
+                             batch_size=TRANSCRIPT_EXPORT_BATCH_SIZE):
+    """Yield lists of transcript rows, as dicts of the TRANSCRIPT_FIELDS ``names``, in listing order.
+
+    Only ``batch_size`` rows are held at once, so exports of any size run in
+    constant memory and the first rows go out as soon as they are read.
+    """
+    columns = dict.fromkeys(_DERIVED_FIELDS.get(name, name) for name in names)
+    stmt = select(*(CHUNK_FIELDS[name] for name in columns), Download_videos.sample_rate.label("_sample_rate")).join(
+        Download_videos, Download_videos.id == AudioChunks.video_id
+    ).where(*_chunk_conditions(video_uuid, transcription_status, has_transcript)).order_by(*_CHUNK_KEY)
+
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        async for partition in result.partitions(batch_size):
+            batch = []
+            for row in partition:
+                values = row._mapping
+                batch.append({
+                    name: offset_ms(values[_DERIVED_FIELDS[name]], values["_sample_rate"])
+                    if name in _DERIVED_FIELDS else values[name]
+                    for name in names
+                })
+            yield batch
+
+
+async def ndjson_export(batches):
+    async for batch in batches:
+        yield "".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in batch)
+
+
+async def csv_export(batches, names):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=names)
+    writer.writeheader()
+    yield buffer.getvalue()
+    async for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
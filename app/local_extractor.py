@@ -0,0 +1,88 @@
+import os
+import shutil
+import subprocess
+
+# Directory of media files served by the stand-in extractor
+LOCAL_MEDIA_DIRECTORY = os.getenv("LOCAL_MEDIA_DIRECTORY", "local_media")
+
+_MEDIA_EXTENSIONS = (".wav", ".mp3", ".m4a", ".webm", ".ogg", ".flac", ".mp4")
+
+
+# Offline stand-in for yt_dlp.YoutubeDL that "downloads" local media files.
+# Searches match the query words against file names; URLs are file:// paths.
+class LocalMediaExtractor:
+    def __init__(self, params, media_directory=None):
+        self.params = params
+        self.media_directory = media_directory or LOCAL_MEDIA_DIRECTORY
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def _media_files(self):
+        return sorted(
+            os.path.join(self.media_directory, name)
+            for name in os.listdir(self.media_directory)
+            if name.lower().endswith(_MEDIA_EXTENSIONS)
+        )
+
+    def _info(self, path):
+        return {
+            "webpage_url": f"file://{os.path.abspath(path)}",
+            "url": os.path.abspath(path),  # Media URL, as FFmpeg reads it
+            "title": os.path.splitext(os.path.basename(path))[0],
+            "filesize": os.path.getsize(path),
+            "duration": None,
+            "acodec": os.path.splitext(path)[1].lstrip("."),
+            "asr": None
+        }
+
+    def _search(self, query):
+        words = query.lower().split()
+        files = self._media_files()
+        matches = [path for path in files if all(word in os.path.basename(path).lower() for word in words)]
+        return {"entries": [self._info(path) for path in (matches or files)[:1]]}
+
+    def _report(self, status, path):
+        size = os.path.getsize(path)
+        for hook in self.params.get("progress_hooks", []):
+            hook({"status": status, "downloaded_bytes": size, "total_bytes": size})
+
+    def _report_postprocessor(self, status):
+        for hook in self.params.get("postprocessor_hooks", []):
+            hook({"status": status, "postprocessor": "ExtractAudio"})
+
+    # Same behaviour as the FFmpegExtractAudio post-processor: write <outtmpl>.wav
+    def _download(self, path):
+        output_path = f"{self.params['outtmpl']}.wav"
+        args = self.params.get("postprocessor_args", [])
+        self._report("downloading", path)
+        self._report("finished", path)
+        self._report_postprocessor("started")
+        if path.lower().endswith(".wav") and not args:
+            shutil.copyfile(path, output_path)
+        else:
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-i", path, *args, output_path],
+                check=True
+            )
+        self._report_postprocessor("finished")
+
+    def sanitize_info(self, info):
+        return dict(info)
+
+    def process_ie_result(self, info, download=True):
+        return self.extract_info(info["webpage_url"], download=download)
+
+    def extract_info(self, query, download=True):
+        if query.startswith("ytsearch:"):
+            return self._search(query[len("ytsearch:"):])
+
+        path = query[len("file://"):] if query.startswith("file://") else query
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No local media at {path}")
+        if download:
+            self._download(path)
+        return self._info(path)
@@ -0,0 +1,35 @@
+import os
+import shutil
+
+# Directory that stands in for the Hugging Face Hub when testing offline
+LOCAL_HUB_DIRECTORY = os.getenv("LOCAL_HUB_DIRECTORY", "local_hub")
+
+
+# Offline stand-in for the parts of huggingface_hub.HfApi used by the exporter.
+# Each repo is a directory under ``directory``; uploads are file copies.
+class LocalHub:
+    def __init__(self, directory=None):
+        self.directory = directory or LOCAL_HUB_DIRECTORY
+
+    def _repo_path(self, repo_id, repo_type):
+        return os.path.join(self.directory, f"{repo_type or 'model'}s", repo_id)
+
+    def create_repo(self, repo_id, repo_type=None, exist_ok=False, **kwargs):
+        os.makedirs(self._repo_path(repo_id, repo_type), exist_ok=exist_ok)
+
+    def list_repo_files(self, repo_id, repo_type=None, **kwargs):
+        root = self._repo_path(repo_id, repo_type)
+        return [
+            os.path.relpath(os.path.join(directory, name), root)
+            for directory, _, names in os.walk(root)
+            for name in names
+        ]
+
+    def upload_file(self, path_or_fileobj, path_in_repo, repo_id, repo_type=None, **kwargs):
+        destination = os.path.join(self._repo_path(repo_id, repo_type), path_in_repo)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(path_or_fileobj, destination)
+        return destination
+
+    def delete_file(self, path_in_repo, repo_id, repo_type=None, **kwargs):
+        os.remove(os.path.join(self._repo_path(repo_id, repo_type), path_in_repo))
@@ -1,33 +1,148 @@
-from fastapi import FastAPI, Query, HTTPException
-from app.audio_download import download_audio
+import json
+from typing import List, Optional
+from fastapi import FastAPI, Query, HTTPException, Body, Request
+from fastapi.responses import StreamingResponse, Response
+from app.audio_download import download_audio, download_many, stream_audio, download_progress, DOWNLOAD_CONCURRENCY
 # from app.audio_chunker import process_all_audios
-from app.database import engine
-from app.models import Base
+from app.database import engine, upgrade_schema
+from app.models import Base, ChunkStatus, TranscriptionStatus
 from app.topics import topics_to_download
-from app.database import fetch_data
 from app.core.config import ORIGINAL_DIRECTORY, CHUNK_OUTPUT
-from app.transcribe import transcribe_chunks
-from app.huggingface_handler import insert_data_to_postgres, upload_to_huggingface
-from app.audio_chunker import audio_chunker, split_audio_with_silence
-import os
+from app.transcribe import (
+    transcribe_chunks, transcribe_while_ingesting, TRANSCRIPTION_CONCURRENCY, TRANSCRIPTION_BATCH_SIZE
+)
+from app.huggingface_handler import insert_data_to_postgres
+from app.parquet_export import export_table
+from app.audio_chunker import audio_chunker, chunk_videos, CHUNK_WORKERS
+from app.chunk_reader import get_chunk, iter_chunk_audio, chunk_mime_type, materialize_chunk_by_id
+from app.jobs import enqueue_job, enqueue_jobs, get_job, job_to_dict
+from app.metrics import render_metrics, profile_request, PROFILE_ENDPOINT
+from app.chunk_encoding import chunk_profile, CODECS
+from app.silence import segment_params, CHUNK_STRATEGIES
+from app.envelope import preview_videos
+from app.dispatch import endpoint_status
+from app.search import search_transcripts
+from app.listing import (
+    list_videos, list_chunks, stream_transcripts, ndjson_export, csv_export, parse_fields, TRANSCRIPT_FIELDS,
+    EXPORT_FIELDS, LIST_PAGE_LIMIT
+)
+from app.admission import (
+    Admission, AdmissionMiddleware, SPLIT_AUDIO_LIMIT, TRANSCRIBE_LIMIT, DOWNLOAD_LIMIT, DATASET_LOAD_LIMIT,
+    EXPORT_LIMIT
+)
 app = FastAPI()
 
+# Heavy endpoints run a few requests at a time and queue a few more; the rest
+# are turned away with 429/503 so cheap endpoints stay responsive under load
+app.add_middleware(AdmissionMiddleware, rules=[
+    (r"/split-audio(/|$)", Admission("split_audio", SPLIT_AUDIO_LIMIT)),
+    (r"/chunks/[^/]+/materialize$", Admission("materialize", SPLIT_AUDIO_LIMIT)),
+    (r"(/videos/[^/]+)?/chunk_preview$", Admission("chunk_preview", SPLIT_AUDIO_LIMIT)),
+    (r"/transcribe_chunks$", Admission("transcription", TRANSCRIBE_LIMIT)),
+    (r"/(download_all_audios|download_audio_by_url|stream_audio_by_url)$", Admission("download", DOWNLOAD_LIMIT)),
+    (r"/load_dataset_to_db/?$", Admission("dataset_load", DATASET_LOAD_LIMIT)),
+    (r"/upload/", Admission("export", EXPORT_LIMIT)),
+    (r"/transcripts/export$", Admission("transcript_export", EXPORT_LIMIT)),
+])
+
+# Profiling is opt-in; without PROFILE_ENDPOINT the middleware is not installed at all
+if PROFILE_ENDPOINT:
+    @app.middleware("http")
+    async def profile_middleware(request: Request, call_next):
+        return await profile_request(request, call_next)
+
 # Ensure the table is created on startup
 @app.on_event("startup")
 async def startup_event():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await upgrade_schema()
 
 @app.get("/download_all_audios")
-async def download_all_audios():
-    results = []
-    
-    for topic in topics_to_download:
-        downloaded_video = await download_audio(query=topic, is_url=False)  # Add 'await'
-        results.append(downloaded_video)
+async def download_all_audios(
+    concurrency: int = Query(DOWNLOAD_CONCURRENCY, ge=1, description="Maximum downloads running at once")
+):
+    # Topics download in parallel; a failed topic is reported in its entry
+    results = [result async for result in download_many(topics_to_download, concurrency=concurrency)]
 
     return {"audios_downloaded": results}
 
+# Prometheus scrape endpoint: stage latencies, bytes and audio processed, queue depths
+@app.get("/metrics")
+async def metrics():
+    body, content_type = await render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# Ranked full-text search over transcripts
+@app.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, description='Words to find; "phrases", -excluded, OR and prefix* work too'),
+    video_uuid: Optional[str] = Query(None, description="Only search the chunks of this video"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000)
+):
+    try:
+        return await search_transcripts(q, limit=limit, offset=offset, video_uuid=video_uuid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+FIELDS_QUERY = Query(None, description="Comma-separated columns to return; all of them if omitted")
+CURSOR_QUERY = Query(None, description="next_cursor of the previous page")
+LIMIT_QUERY = Query(100, ge=1, le=LIST_PAGE_LIMIT)
+
+# Keyset-paginated listings; follow next_cursor until it is null
+@app.get("/videos")
+async def get_videos(
+    fields: Optional[str] = FIELDS_QUERY,
+    chunk_status: Optional[ChunkStatus] = Query(None),
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: int = LIMIT_QUERY
+):
+    try:
+        return await list_videos(fields, chunk_status=chunk_status, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/chunks")
+async def get_chunks(
+    fields: Optional[str] = FIELDS_QUERY,
+    video_uuid: Optional[str] = Query(None, description="Only the chunks of this video"),
+    transcription_status: Optional[TranscriptionStatus] = Query(None),
+    has_transcript: Optional[bool] = Query(None, description="Only chunks with (true) or without (false) a transcript"),
+    cursor: Optional[str] = CURSOR_QUERY,
+    limit: int = LIMIT_QUERY
+):
+    try:
+        return await list_chunks(fields, video_uuid=video_uuid, transcription_status=transcription_status,
+                                 has_transcript=has_transcript, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Every transcript as NDJSON or CSV, streamed from a server-side cursor as it is read
+@app.get("/transcripts/export")
+async def export_transcripts(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    fields: Optional[str] = Query(None, description=f"Comma-separated columns; {', '.join(EXPORT_FIELDS)} if omitted"),
+    video_uuid: Optional[str] = Query(None, description="Only the transcripts of this video")
+):
+    try:
+        names = parse_fields(fields, TRANSCRIPT_FIELDS, EXPORT_FIELDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    batches = stream_transcripts(names, video_uuid=video_uuid)
+    if format == "csv":
+        return StreamingResponse(csv_export(batches, names), media_type="text/csv")
+    return StreamingResponse(ndjson_export(batches), media_type="application/x-ndjson")
+
+# Load, latency and circuit breaker state of each transcription server
+@app.get("/transcription_endpoints")
+async def transcription_endpoints():
+    return {"endpoints": endpoint_status()}
+
+@app.get("/download_progress")
+async def get_download_progress():
+    return download_progress
+
 @app.get("/download_audio_by_url")
 async def download_audio_by_url(
     youtube_url: str = Query(..., description="The YouTube video URL to download"), 
@@ -45,8 +160,11 @@ async def download_audio_by_url(
 #     return {"processed_files": processed_files}
 
 @app.post("/transcribe_chunks")
-async def transcribe_audio_chunks():
-    result = await transcribe_chunks()  # Add 'await'
+async def transcribe_audio_chunks(
+    concurrency: int = Query(TRANSCRIPTION_CONCURRENCY, ge=1, description="Maximum transcription requests in flight"),
+    batch_size: int = Query(TRANSCRIPTION_BATCH_SIZE, ge=1, description="Results committed per checkpoint")
+):
+    result = await transcribe_chunks(concurrency, batch_size)  # Add 'await'
     return result
 
 @app.post("/load_dataset_to_db/")
@@ -59,19 +177,23 @@ async def load_dataset_to_db(dataset_name: str = Query(..., description="Name of
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload/{table_name}")
-async def upload_data(table_name: str):
+async def upload_data(
+    table_name: str,
+    repo_id: str = Query("MrBinit/srijan", description="Hugging Face dataset repo to push to"),
+    delta: bool = Query(False, description="Only export rows added since the last export"),
+    key_column: str = Query("id", description="Monotonic column used for ordering, sharding and the delta watermark")
+):
     try:
-        # Fetch data from the PostgreSQL database
-        df = await fetch_data(table_name)  # Add 'await'
+        # Stream the table into Parquet shards and push each one as it is written
+        summary = await export_table(table_name, repo_id, delta=delta, key_column=key_column)
 
-        if df.empty:
+        if summary["rows"] == 0 and not delta:
             raise HTTPException(status_code=404, detail="No data found in the table")
 
-        # Upload data to Hugging Face
-        upload_to_huggingface(df)
-
-        return {"message": f"Data from table '{table_name}' uploaded successfully to Hugging Face"}
+        return {"message": f"Data from table '{table_name}' uploaded successfully to Hugging Face", **summary}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
@@ -87,21 +209,213 @@ async def get_audio_location(uuid: str = Query(..., description = "UUID of the a
     
 
 
+# Chunk output format from the query; fields left out come from the environment
+def requested_profile(sample_rate, channels, codec):
+    try:
+        return chunk_profile(sample_rate, channels, codec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+SAMPLE_RATE_QUERY = Query(None, ge=0, description="Sample rate of exported chunks; 0 keeps the source rate")
+CHANNELS_QUERY = Query(None, ge=0, description="Channels of exported chunks; 0 keeps the source channels")
+CODEC_QUERY = Query(None, description=f"Codec of exported chunks: {', '.join(CODECS)}")
+
+# Segmentation parameters from the query; fields left out keep their defaults
+def requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy):
+    try:
+        return segment_params(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+SILENCE_THRESH_QUERY = Query(None, le=0, description="Level in dBFS below which audio counts as silence")
+MIN_SILENCE_LEN_QUERY = Query(None, gt=0, description="Shortest silence in ms that a chunk may end at")
+MIN_CHUNK_LEN_QUERY = Query(None, gt=0, description="Shortest chunk in ms")
+MAX_CHUNK_LEN_QUERY = Query(None, gt=0, description="Longest chunk in ms")
+STRATEGY_QUERY = Query(None, description=f"How chunk boundaries are chosen: {', '.join(CHUNK_STRATEGIES)}")
+
 @app.post("/split-audio/{uuid}")
-async def split_audio(uuid: str):
+async def split_audio(
+    uuid: str,
+    materialize: bool = Query(False, description="Also export every chunk as its own audio file"),
+    sample_rate: Optional[int] = SAMPLE_RATE_QUERY,
+    channels: Optional[int] = CHANNELS_QUERY,
+    codec: Optional[str] = CODEC_QUERY,
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    profile = requested_profile(sample_rate, channels, codec)
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+
     # Call the audio_chunker function which will handle chunking and database saving
-    video_info = await audio_chunker(uuid, CHUNK_OUTPUT)
+    video_info = await audio_chunker(uuid, CHUNK_OUTPUT, materialize=materialize, profile=profile,
+                                     segmentation=segmentation)
 
     # If an error occurs in audio_chunker, raise an HTTPException
     if "error" in video_info:
         raise HTTPException(status_code=404, detail=video_info["error"])
 
-    # Retrieve the paths of the split audio chunks
-    chunk_paths = video_info.get("chunks")
+    # Retrieve the offsets (and paths, when materialized) of the audio chunks
+    chunks = video_info.get("chunks")
     
-    if not chunk_paths:
+    if not chunks and not video_info.get("resumed_from"):
         raise HTTPException(status_code=500, detail="Failed to split the audio into chunks")
 
-    # Return the paths of the saved chunks
-    return {"chunk_paths": chunk_paths}
+    # Return the saved chunks
+    return {"chunks": chunks}
+
+# Decode, chunk and (optionally) transcribe in one pass; the first chunks are
+# registered while the rest of the audio is still being decoded
+@app.post("/stream_audio_by_url")
+async def stream_audio_by_url(
+    youtube_url: str = Query(..., description="The YouTube video URL to stream"),
+    use_sample_rate_16000: bool = Query(True, description="Decode to 16000 Hz mono instead of the source format"),
+    keep_source: bool = Query(True, description="Also keep the full-length WAV; otherwise only chunk files are kept"),
+    transcribe: bool = Query(False, description="Transcribe chunks as soon as they are cut"),
+    sample_rate: Optional[int] = SAMPLE_RATE_QUERY,
+    channels: Optional[int] = CHANNELS_QUERY,
+    codec: Optional[str] = CODEC_QUERY,
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    profile = requested_profile(sample_rate, channels, codec)
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+
+    def ingest(on_chunk=None):
+        return stream_audio(youtube_url, is_url=True, use_sample_rate_16000=use_sample_rate_16000,
+                            keep_source=keep_source, profile=profile, on_chunk=on_chunk,
+                            segmentation=segmentation)
+
+    if not transcribe:
+        return await ingest()
+    result, transcription = await transcribe_while_ingesting(ingest)
+    return dict(result, **transcription)
+
+# Serialize an async stream of dicts as newline-delimited JSON
+async def ndjson_lines(rows):
+    async for row in rows:
+        yield json.dumps(row) + "\n"
+
+@app.post("/split-audio")
+async def split_audio_batch(
+    uuids: Optional[List[str]] = Body(None, embed=True, description="Videos to chunk; all unchunked videos if omitted"),
+    materialize: bool = Query(False, description="Also export every chunk as its own audio file"),
+    workers: int = Query(CHUNK_WORKERS, ge=1, description="Number of chunking processes"),
+    sample_rate: Optional[int] = SAMPLE_RATE_QUERY,
+    channels: Optional[int] = CHANNELS_QUERY,
+    codec: Optional[str] = CODEC_QUERY,
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    profile = requested_profile(sample_rate, channels, codec)
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+    results = chunk_videos(uuids, CHUNK_OUTPUT, materialize=materialize, workers=workers, profile=profile,
+                           segmentation=segmentation)
+    return StreamingResponse(ndjson_lines(results), media_type="application/x-ndjson")
+
+# Chunk boundaries that new segmentation parameters would give, computed from
+# the stored envelope indexes without decoding audio or changing any chunks
+@app.get("/videos/{uuid}/chunk_preview")
+async def chunk_preview(
+    uuid: str,
+    include_ranges: bool = Query(True, description="Also return every [start_ms, end_ms] boundary"),
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+    async for result in preview_videos(segmentation, [uuid], include_ranges=include_ranges, workers=1):
+        if "error" in result:
+            raise HTTPException(status_code=404, detail=result["error"])
+        return result
+
+@app.post("/chunk_preview")
+async def chunk_preview_batch(
+    uuids: Optional[List[str]] = Body(None, embed=True, description="Videos to preview; all indexed videos if omitted"),
+    include_ranges: bool = Query(False, description="Also return every [start_ms, end_ms] boundary"),
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+    results = preview_videos(segmentation, uuids, include_ranges=include_ranges)
+    return StreamingResponse(ndjson_lines(results), media_type="application/x-ndjson")
+
+@app.get("/chunks/{chunk_id}/audio")
+async def chunk_audio(chunk_id: str):
+    chunk = await get_chunk(chunk_id)
+    if chunk is None:
+        raise HTTPException(status_code=404, detail="No chunk found with this id")
+    return StreamingResponse(iter_chunk_audio(chunk), media_type=chunk_mime_type(chunk))
+
+@app.post("/chunks/{chunk_id}/materialize")
+async def materialize_audio_chunk(
+    chunk_id: str,
+    sample_rate: Optional[int] = SAMPLE_RATE_QUERY,
+    channels: Optional[int] = CHANNELS_QUERY,
+    codec: Optional[str] = CODEC_QUERY
+):
+    profile = requested_profile(sample_rate, channels, codec)
+    file_path = await materialize_chunk_by_id(chunk_id, CHUNK_OUTPUT, profile)
+    if file_path is None:
+        raise HTTPException(status_code=404, detail="No chunk found with this id")
+    return {"file_path": file_path}
+
+
+# Queued versions of the pipeline endpoints; they return job ids right away and
+# the stage workers (python -m app.worker) chain download -> chunk -> transcribe
+@app.post("/jobs/download_all_audios")
+async def queue_download_all_audios():
+    payloads = [{"query": topic, "is_url": False} for topic in topics_to_download]
+    return {"job_ids": await enqueue_jobs("download", payloads)}
+
+@app.post("/jobs/download_audio_by_url")
+async def queue_download_audio_by_url(
+    youtube_url: str = Query(..., description="The YouTube video URL to download"),
+    use_sample_rate_16000: bool = Query(False, description="Set the sample rate to 16000 Hz and mono audio (True or False)")
+):
+    payload = {"query": youtube_url, "is_url": True, "use_sample_rate_16000": use_sample_rate_16000}
+    return {"job_id": await enqueue_job("download", payload)}
+
+@app.post("/jobs/split-audio/{uuid}")
+async def queue_split_audio(
+    uuid: str,
+    materialize: bool = Query(False, description="Also export every chunk as its own audio file"),
+    sample_rate: Optional[int] = SAMPLE_RATE_QUERY,
+    channels: Optional[int] = CHANNELS_QUERY,
+    codec: Optional[str] = CODEC_QUERY,
+    silence_thresh: Optional[float] = SILENCE_THRESH_QUERY,
+    min_silence_len: Optional[int] = MIN_SILENCE_LEN_QUERY,
+    min_chunk_len: Optional[int] = MIN_CHUNK_LEN_QUERY,
+    max_chunk_len: Optional[int] = MAX_CHUNK_LEN_QUERY,
+    strategy: Optional[str] = STRATEGY_QUERY
+):
+    # Validate now; the worker rebuilds the profile and segmentation from the payload
+    profile = requested_profile(sample_rate, channels, codec)
+    segmentation = requested_segmentation(silence_thresh, min_silence_len, min_chunk_len, max_chunk_len, strategy)
+    payload = {"uuid": uuid, "materialize": materialize, "profile": profile._asdict(),
+               "segmentation": segmentation._asdict()}
+    return {"job_id": await enqueue_job("chunk", payload)}
+
+@app.post("/jobs/transcribe_chunks")
+async def queue_transcribe_chunks():
+    return {"job_id": await enqueue_job("transcribe", {"video_uuid": None})}
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No job found with this id")
+    return job_to_dict(job)
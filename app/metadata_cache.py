@@ -0,0 +1,78 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Where cached yt-dlp metadata is persisted between restarts
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", "metadata_cache.sqlite3")
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "10000"))
+
+
+# Size-bounded LRU cache with per-entry TTL, backed by a SQLite file
+class MetadataCache:
+    """Cache of JSON-serializable values keyed by string.
+
+    Hot entries are served from memory; every entry is also written to SQLite
+    so the cache survives restarts. Both tiers are trimmed to ``max_entries``,
+    least recently used first. Safe to use from several threads.
+    """
+
+    def __init__(self, path=METADATA_CACHE_PATH, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS metadata_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_metadata_cache_used_at ON metadata_cache (used_at)")
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM metadata_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                entry = (json.loads(row[0]), row[1])
+
+            value, expires_at = entry
+            if expires_at <= now:
+                self._memory.pop(key, None)
+                self._db.execute("DELETE FROM metadata_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+
+            self._remember(key, entry)
+            self._db.execute("UPDATE metadata_cache SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            return value
+
+    def put(self, key, value, ttl):
+        now = time.time()
+        entry = (value, now + ttl)
+        with self._lock:
+            self._remember(key, entry)
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata_cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), entry[1], now)
+            )
+            self._db.execute(
+                "DELETE FROM metadata_cache WHERE key IN "
+                "(SELECT key FROM metadata_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._db.commit()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
@@ -0,0 +1,170 @@
+import os
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy import func
+from sqlalchemy.future import select
+from app.database import async_session
+from app.models import Download_videos, AudioChunks, Jobs, ChunkStatus, TranscriptionStatus
+from app.jobs import STAGES
+
+# Path prefix of the endpoint to profile (e.g. "/split-audio"); profiling is off when unset
+PROFILE_ENDPOINT = os.getenv("PROFILE_ENDPOINT", "")
+
+# Where per-request profiles are written, as .prof files readable with pstats or snakeviz
+PROFILE_DIRECTORY = os.getenv("PROFILE_DIRECTORY", "profiles")
+
+# Stages run from well under a millisecond (hashing a chunk) to many minutes (a long download)
+_STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=_STAGE_BUCKETS
+)
+BYTES_PROCESSED = Counter(
+    "pipeline_bytes_processed_total", "Bytes of audio processed by each pipeline stage", ["stage"]
+)
+AUDIO_SECONDS = Counter(
+    "pipeline_audio_seconds_total", "Seconds of audio processed by each pipeline stage", ["stage"]
+)
+TRANSCRIPTION_REQUESTS = Counter(
+    "transcription_requests_total", "Transcription API requests by outcome", ["outcome"]
+)
+TRANSCRIPTION_ENDPOINT_REQUESTS = Counter(
+    "transcription_endpoint_requests_total", "Requests sent to each transcription server by outcome",
+    ["endpoint", "outcome"]
+)
+TRANSCRIPTION_HEDGES = Counter(
+    "transcription_hedges_total", "Hedged transcription requests sent, and those that answered first", ["outcome"]
+)
+TRANSCRIPTION_ENDPOINT_EJECTED = Gauge(
+    "transcription_endpoint_ejected", "1 while a transcription server's circuit breaker is open", ["endpoint"]
+)
+IN_FLIGHT = Gauge(
+    "pipeline_in_flight", "Downloads and transcription requests running right now", ["stage"]
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "Requests turned away by admission control", ["endpoint", "status"]
+)
+QUEUE_DEPTH = Gauge(
+    "pipeline_queue_depth", "Work waiting in the database, refreshed on every scrape", ["queue"]
+)
+
+# Observations of the current worker-process task, when they are being collected
+_collected = threading.local()
+
+
+def _record(kind, stage, value):
+    records = getattr(_collected, "records", None)
+    if records is not None:
+        records.append((kind, stage, value))
+    elif kind == "seconds":
+        STAGE_SECONDS.labels(stage).observe(value)
+    elif kind == "bytes":
+        BYTES_PROCESSED.labels(stage).inc(value)
+    else:
+        AUDIO_SECONDS.labels(stage).inc(value)
+
+
+def observe_stage(stage, seconds):
+    _record("seconds", stage, seconds)
+
+
+# Time a block of sync or async code as one pipeline stage
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def count_audio(stage, num_bytes=0, seconds=0):
+    """Add to the bytes and audio seconds processed by a stage."""
+    if num_bytes:
+        _record("bytes", stage, num_bytes)
+    if seconds:
+        _record("audio_seconds", stage, seconds)
+
+
+# Metrics recorded in a worker process never reach the parent's registry, so the
+# worker collects its observations and returns them with its result
+@contextmanager
+def collect_metrics():
+    _collected.records = []
+    try:
+        yield _collected.records
+    finally:
+        _collected.records = None
+
+
+def replay_metrics(records):
+    """Record observations collected in another process."""
+    for kind, stage, value in records:
+        _record(kind, stage, value)
+
+
+# Count the pending work behind each stage; the partial indexes keep these cheap
+async def refresh_queue_depths():
+    async with async_session() as session:
+        pending_chunking = await session.execute(
+            select(func.count()).where(Download_videos.chunk_status == ChunkStatus.PENDING)
+        )
+        QUEUE_DEPTH.labels("chunking").set(pending_chunking.scalar())
+
+        pending_transcription = await session.execute(
+            select(func.count()).where(AudioChunks.transcription_status == TranscriptionStatus.PENDING)
+        )
+        QUEUE_DEPTH.labels("transcription").set(pending_transcription.scalar())
+
+        queued_jobs = await session.execute(
+            select(Jobs.stage, func.count()).where(Jobs.status == "queued").group_by(Jobs.stage)
+        )
+        counts = dict(queued_jobs.all())
+        for stage in STAGES:
+            QUEUE_DEPTH.labels(f"jobs_{stage}").set(counts.get(stage, 0))
+
+
+async def render_metrics():
+    """Return the Prometheus text exposition and its content type."""
+    await refresh_queue_depths()
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# Only one profiler can be attached to the event loop thread at a time
+_profiling = threading.Lock()
+
+
+def should_profile(path):
+    return bool(PROFILE_ENDPOINT) and path.startswith(PROFILE_ENDPOINT)
+
+
+async def profile_request(request, call_next):
+    """Run one request under cProfile and write the profile to PROFILE_DIRECTORY.
+
+    The profiler sees everything on the event loop while the request runs, so
+    profile with little other traffic. Requests arriving while another one is
+    being profiled are served unprofiled, and the body of a streaming response
+    is produced after the profile is closed.
+    """
+    if not should_profile(request.url.path) or not _profiling.acquire(blocking=False):
+        return await call_next(request)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            response = await call_next(request)
+        finally:
+            profiler.disable()
+    finally:
+        _profiling.release()
+
+    os.makedirs(PROFILE_DIRECTORY, exist_ok=True)
+    name = request.url.path.strip("/").replace("/", "_") or "root"
+    path = os.path.join(PROFILE_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.prof")
+    profiler.dump_stats(path)
+    print(f"Profile of {request.method} {request.url.path} written to {path}")
+    response.headers["X-Profile-Path"] = path
+    return response
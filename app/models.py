@@ -1,8 +1,40 @@
 import uuid
-from sqlalchemy import Column, String, ForeignKey, Integer, Text
-from sqlalchemy.orm import relationship
+import enum
+from sqlalchemy import Column, String, ForeignKey, Integer, Text, DateTime, Index, Enum, Computed, DDL, event, func, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from app.database import Base
+from app.transcript_text import TRANSCRIPT_TSVECTOR_FUNCTION
 from sqlalchemy import JSON
+
+class ChunkStatus(str, enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+class TranscriptionStatus(str, enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+def _enum_values(enum_class):
+    return [member.value for member in enum_class]
+
+# Namespace of chunk IDs; a chunk is identified by its video and first frame
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c3a52-9d0e-4b7a-8c45-2e1f0a9b7d31")
+
+def chunk_id_for(video_uuid, start_sample):
+    """Deterministic chunk ID, so chunking a video again yields the same rows."""
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{video_uuid}/{start_sample}"))
+
+def has_source_audio(meta_data):
+    """Whether a video's location is a WAV it can be chunked from; streams may keep only their chunks."""
+    return (meta_data or {}).get("source_kept", True)
+
+def offset_ms(sample, sample_rate):
+    """Milliseconds into a video of a sample offset; None while the rate is unknown."""
+    return int(sample * 1000 / sample_rate) if sample is not None and sample_rate else None
+
 class Download_videos(Base):
     __tablename__ = "download_videos"
     id = Column(Integer, primary_key=True, autoincrement=True) 
@@ -11,7 +43,22 @@ class Download_videos(Base):
     video_url = Column(String, index=True, nullable=True)  # Optional URL field
     location = Column(String, unique=True, nullable=False)  # Path to local file
     meta_data = Column(JSON, nullable = False, default = {})
-    chunk_status = Column(String, nullable = True,default = "False")
+    chunk_status = Column(
+        Enum(ChunkStatus, name="chunk_status", values_callable=_enum_values),
+        nullable=False, default=ChunkStatus.PENDING, server_default=ChunkStatus.PENDING.value
+    )
+    content_hash = Column(String, index=True, nullable=True)  # xxh3-128 of the decoded PCM payload
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    chunked_at = Column(DateTime(timezone=True), nullable=True)
+    chunk_checkpoint = Column(Integer, nullable=False, default=0, server_default="0")  # Frame up to which chunks are saved
+    envelope_path = Column(String, nullable=True)  # .npy of per-frame dBFS levels, written when chunking
+    duration_ms = Column(Integer, nullable=True)  # Length of the decoded audio
+    sample_rate = Column(Integer, nullable=True)  # Frame rate of the decoded WAV that chunk sample offsets index
+
+    # Only videos still waiting to be chunked are indexed
+    __table_args__ = (
+        Index("ix_download_videos_pending_chunking", "id", postgresql_where=text("chunk_status = 'pending'")),
+    )
 
     # Establish relationship with AudioChunks
     chunks = relationship("AudioChunks", backref="video")
@@ -20,6 +67,57 @@ class AudioChunks(Base):
     __tablename__ = "audio_chunks"
     chunk_id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))  
     video_id = Column(Integer, ForeignKey('download_videos.id'), nullable=False)  # Reference to the video
-    video_uuid = Column(String, nullable=False)  # UUID of the video
-    file_path = Column(String, nullable=False)  # File path of the audio chunk
+    video_uuid = Column(String, nullable=False, index=True)  # UUID of the video
+    file_path = Column(String, nullable=True)  # File path of the exported chunk, if materialized
+    source_path = Column(String, nullable=True)  # Parent WAV the chunk was cut from
+    start_sample = Column(Integer, nullable=True)  # First frame of the chunk in the parent WAV
+    end_sample = Column(Integer, nullable=True)  # Frame after the last one of the chunk
+    content_hash = Column(String, index=True, nullable=True)  # xxh3-128 of the chunk's PCM payload
     transcribe = Column(Text, nullable=True)  # Optional transcription field
+    transcription_status = Column(
+        Enum(TranscriptionStatus, name="transcription_status", values_callable=_enum_values),
+        nullable=False, default=TranscriptionStatus.PENDING, server_default=TranscriptionStatus.PENDING.value
+    )
+    transcribed_at = Column(DateTime(timezone=True), nullable=True)
+    # Words of the transcript for full-text search, kept up to date by Postgres
+    transcript_tsv = deferred(Column(TSVECTOR, Computed("transcript_tsvector(transcribe)", persisted=True)))
+
+    # Only chunks still waiting for transcription are indexed
+    __table_args__ = (
+        Index("ix_audio_chunks_pending_transcription", "chunk_id",
+              postgresql_where=text("transcription_status = 'pending'")),
+        Index("ix_audio_chunks_pending_transcription_by_video", "video_uuid", "chunk_id",
+              postgresql_where=text("transcription_status = 'pending'")),
+        Index("ix_audio_chunks_transcript_tsv", "transcript_tsv", postgresql_using="gin"),
+        # Listing and export order: by video, then by position in it
+        Index("ix_audio_chunks_listing", "video_id", text("coalesce(start_sample, -1)"), "chunk_id"),
+    )
+
+# The generated search column needs its function before the table is created
+event.listen(AudioChunks.__table__, "before_create", DDL(TRANSCRIPT_TSVECTOR_FUNCTION))
+
+
+class Jobs(Base):
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    stage = Column(String, nullable=False)  # download, chunk or transcribe
+    payload = Column(JSON, nullable=False, default={})  # Arguments for the stage handler
+    status = Column(String, nullable=False, default="queued")  # queued, running, done or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    result = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    # Workers only ever look for the oldest queued job of their stage
+    __table_args__ = (
+        Index("ix_jobs_queued", "stage", "created_at", postgresql_where=text("status = 'queued'")),
+    )
+
+
+class ExportWatermarks(Base):
+    __tablename__ = "export_watermarks"
+    table_name = Column(String, primary_key=True)
+    repo_id = Column(String, primary_key=True)
+    last_key = Column(JSON, nullable=True)  # Highest key pushed so far, in the key column's type
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
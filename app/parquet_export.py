@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import re
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from huggingface_hub import HfApi
+from app.database import engine, async_session
+from app.models import ExportWatermarks
+from app.local_hub import LocalHub
+from app.core.config import HUGGINGFACE_TOKEN
+
+# Rows fetched from the server-side cursor at a time
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+
+# A shard is closed and pushed once its file reaches this size
+EXPORT_SHARD_BYTES = int(os.getenv("EXPORT_SHARD_BYTES", str(256 * 1024 * 1024)))
+
+# Local staging directory for shards before they are pushed
+EXPORT_DIRECTORY = os.getenv("EXPORT_DIRECTORY", "exports")
+
+# "local" pushes to LocalHub (a directory) instead of the Hugging Face Hub
+HF_HUB_MODE = os.getenv("HF_HUB_MODE", "remote")
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Columns Postgres derives from others for its own indexes; they are not exported
+_DERIVED_COLUMNS = {"transcript_tsv"}
+
+
+def hub_client():
+    if HF_HUB_MODE == "local":
+        return LocalHub()
+    return HfApi(token=HUGGINGFACE_TOKEN)
+
+
+def _check_identifier(name):
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Invalid table or column name: {name}")
+    return name
+
+
+# Read a table in key order through a server-side cursor, a batch of rows at a time
+async def stream_table_batches(table_name, key_column="id", after_key=None, batch_size=EXPORT_BATCH_SIZE):
+    table_name, key_column = _check_identifier(table_name), _check_identifier(key_column)
+    query = f'SELECT * FROM "{table_name}"'
+    params = {}
+    if after_key is not None:
+        query += f' WHERE "{key_column}" > :after_key'
+        params["after_key"] = after_key
+    query += f' ORDER BY "{key_column}"'
+
+    async with engine.connect() as conn:
+        result = await conn.stream(text(query), params)
+        async for partition in result.partitions(batch_size):
+            yield [
+                {name: value for name, value in row._mapping.items() if name not in _DERIVED_COLUMNS}
+                for row in partition
+            ]
+
+
+# Nested values (JSON columns) are stored as JSON text so every shard has the same schema
+def _to_arrow(rows):
+    columns = {
+        name: [json.dumps(row[name]) if isinstance(row[name], (dict, list)) else row[name] for row in rows]
+        for name in rows[0]
+    }
+    return pa.table(columns)
+
+
+# Writes size-bounded Parquet shards named after the key range they hold
+class ShardWriter:
+    def __init__(self, directory, table_name, key_column, shard_bytes=EXPORT_SHARD_BYTES):
+        self.directory = directory
+        self.table_name = table_name
+        self.key_column = key_column
+        self.shard_bytes = shard_bytes
+        self._writer = None
+        self._path = None
+        self._first_key = None
+        self._last_key = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, rows):
+        """Append rows; return the shards closed by this write."""
+        closed = []
+        table = _to_arrow(rows)
+        if self._writer is not None and not table.schema.equals(self._writer.schema):
+            try:
+                table = table.cast(self._writer.schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                # Columns that were all null so far got a type now; start a new shard
+                closed.append(self.close())
+        if self._writer is None:
+            self._path = os.path.join(self.directory, f"{self.table_name}.partial.parquet")
+            self._writer = pq.ParquetWriter(self._path, table.schema)
+            self._first_key = rows[0][self.key_column]
+
+        self._writer.write_table(table)
+        self._last_key = rows[-1][self.key_column]
+        if os.path.getsize(self._path) >= self.shard_bytes:
+            closed.append(self.close())
+        return closed
+
+    def close(self):
+        """Finish the current shard and return (path, first_key, last_key)."""
+        if self._writer is None:
+            return None
+        self._writer.close()
+        name = f"part-{self._first_key}-{self._last_key}.parquet"
+        path = os.path.join(self.directory, name)
+        os.replace(self._path, path)
+        self._writer = None
+        return path, self._first_key, self._last_key
+
+
+async def get_watermark(table_name, repo_id):
+    async with async_session() as session:
+        result = await session.execute(
+            select(ExportWatermarks.last_key)
+            .where(ExportWatermarks.table_name == table_name, ExportWatermarks.repo_id == repo_id)
+        )
+        return result.scalar()
+
+
+async def set_watermark(table_name, repo_id, last_key):
+    async with async_session() as session:
+        async with session.begin():
+            stmt = insert(ExportWatermarks).values(table_name=table_name, repo_id=repo_id, last_key=last_key)
+            await session.execute(stmt.on_conflict_do_update(
+                index_elements=[ExportWatermarks.table_name, ExportWatermarks.repo_id],
+                set_={"last_key": stmt.excluded.last_key}
+            ))
+
+
+async def export_table(table_name, repo_id, delta=False, key_column="id",
+                       shard_bytes=EXPORT_SHARD_BYTES, batch_size=EXPORT_BATCH_SIZE, hub=None):
+    """Export a table to Parquet shards and push each shard as soon as it is written.
+
+    Shards already present in the repo are not pushed again. With ``delta`` only
+    rows whose key is above the last exported watermark are read; the watermark
+    advances after every pushed shard, so a failed export resumes where it stopped.
+    A full export replaces the table's shards: once it finishes, shards it did not
+    produce (left by earlier exports over other key ranges) are deleted.
+    """
+    hub = hub or hub_client()
+    await asyncio.to_thread(hub.create_repo, repo_id, repo_type="dataset", exist_ok=True)
+    existing = set(await asyncio.to_thread(hub.list_repo_files, repo_id, repo_type="dataset"))
+
+    after_key = await get_watermark(table_name, repo_id) if delta else None
+    writer = ShardWriter(os.path.join(EXPORT_DIRECTORY, repo_id, table_name), table_name, key_column, shard_bytes)
+    summary = {"rows": 0, "shards_pushed": 0, "shards_skipped": 0, "shards_removed": 0}
+    produced = set()
+
+    async def push(shard):
+        path, _, last_key = shard
+        path_in_repo = f"data/{table_name}/{os.path.basename(path)}"
+        produced.add(path_in_repo)
+        if path_in_repo in existing:
+            summary["shards_skipped"] += 1
+        else:
+            await asyncio.to_thread(
+                hub.upload_file, path_or_fileobj=path, path_in_repo=path_in_repo,
+                repo_id=repo_id, repo_type="dataset"
+            )
+            summary["shards_pushed"] += 1
+            print(f"Pushed {path_in_repo} to {repo_id}")
+        os.remove(path)
+        await set_watermark(table_name, repo_id, last_key)
+
+    async for rows in stream_table_batches(table_name, key_column, after_key, batch_size):
+        summary["rows"] += len(rows)
+        # Arrow conversion and Parquet encoding run off the event loop
+        for shard in await asyncio.to_thread(writer.write, rows):
+            await push(shard)
+
+    shard = await asyncio.to_thread(writer.close)
+    if shard:
+        await push(shard)
+
+    if not delta:
+        # Earlier shards hold rows this export has just pushed again under other names
+        for path_in_repo in sorted(existing - produced):
+            if path_in_repo.startswith(f"data/{table_name}/") and path_in_repo.endswith(".parquet"):
+                await asyncio.to_thread(
+                    hub.delete_file, path_in_repo=path_in_repo, repo_id=repo_id, repo_type="dataset"
+                )
+                summary["shards_removed"] += 1
+                print(f"Removed {path_in_repo} from {repo_id}")
+    return summary
@@ -0,0 +1,142 @@
+import os
+import re
+from sqlalchemy import cast, func
+from sqlalchemy.dialects.postgresql import TSQUERY
+from sqlalchemy.future import select
+from app.database import async_session
+from app.models import AudioChunks, Download_videos, TranscriptionStatus, offset_ms
+from app.transcript_text import words, word_spans
+from app.metrics import stage_timer
+
+# Matches ranked per query; for very common terms the best hits are picked
+# from this many, which keeps such queries in milliseconds too
+SEARCH_RANK_CANDIDATES = int(os.getenv("SEARCH_RANK_CANDIDATES", "10000"))
+
+# Words shown around the best match of a hit
+SNIPPET_WORDS = int(os.getenv("SEARCH_SNIPPET_WORDS", "16"))
+
+# A "quoted phrase" (optionally -negated) or a bare term
+_QUERY_TERM = re.compile(r'(-?)"([^"]*)"?|(\S+)')
+
+
+def _lexeme(word, prefix=False):
+    return "'" + word.replace("\\", "\\\\").replace("'", "''") + "'" + (":*" if prefix else "")
+
+
+def parse_query(query):
+    """Turn a web-search style query into tsquery text and the terms to highlight.
+
+    Words are all required; "quoted words" must appear together and in order,
+    a leading - excludes a word or phrase, OR between terms accepts either, and
+    a trailing * matches any word starting with what comes before it. Raises
+    ValueError when there is nothing to search for.
+    """
+    groups, group, highlight = [], [], []
+    for match in _QUERY_TERM.finditer(query):
+        sign, phrase, bare = match.groups()
+        if bare is not None:
+            if bare == "OR":
+                if group:
+                    groups.append(group)
+                    group = []
+                continue
+            sign, phrase = ("-", bare[1:]) if bare.startswith("-") else ("", bare)
+
+        prefix = phrase.rstrip().endswith("*")
+        term_words = words(phrase)
+        if not term_words:
+            continue
+        term = " <-> ".join(
+            _lexeme(word, prefix and i == len(term_words) - 1) for i, word in enumerate(term_words)
+        )
+        if len(term_words) > 1:
+            term = f"({term})"
+        if sign:
+            term = "!" + term
+        else:
+            highlight.append((term_words, prefix))
+        group.append((term, not sign))
+    if group:
+        groups.append(group)
+
+    # Only required words can be looked up in the index
+    if not groups or not all(any(required for _, required in group) for group in groups):
+        raise ValueError("The query needs at least one word to search for in every alternative")
+    tsquery = " | ".join("(" + " & ".join(term for term, _ in group) + ")" for group in groups)
+    return tsquery, highlight
+
+
+def snippet(transcript, terms, size=SNIPPET_WORDS):
+    """Up to ``size`` words of ``transcript`` around its best match, with matches in <b></b>."""
+    spans = word_spans(transcript)
+    exact = {word for term_words, prefix in terms for word in (term_words[:-1] if prefix else term_words)}
+    prefixes = tuple(term_words[-1] for term_words, prefix in terms if prefix)
+    matched = [word in exact or (prefixes and word.startswith(prefixes)) for _, _, word in spans]
+    hits = [i for i, is_match in enumerate(matched) if is_match]
+    if not hits:
+        return transcript[:spans[size - 1][1]] if len(spans) > size else transcript
+
+    # The window holding the most matches, with a little context before the first
+    best = max(hits, key=lambda first: sum(1 for hit in hits if first <= hit < first + size))
+    start = max(0, min(best - size // 4, len(spans) - size))
+    end = min(len(spans), start + size)
+
+    pieces = ["…" if start else ""]
+    previous = spans[start][0]
+    for i in range(start, end):
+        word_start, word_end, _ = spans[i]
+        pieces.append(transcript[previous:word_start])
+        word = transcript[word_start:word_end]
+        pieces.append(f"<b>{word}</b>" if matched[i] else word)
+        previous = word_end
+    pieces.append("…" if end < len(spans) else "")
+    return "".join(pieces)
+
+
+async def search_transcripts(query, limit=20, offset=0, video_uuid=None, candidates=SEARCH_RANK_CANDIDATES):
+    """Rank transcribed chunks against ``query`` through the GIN index on transcript_tsv.
+
+    Returns ``{"query", "hits"}``, each hit carrying its chunk id, video UUID,
+    sample and millisecond offsets, rank and a highlighted snippet.
+    """
+    tsquery, terms = parse_query(query)
+    condition = AudioChunks.transcript_tsv.op("@@")(cast(tsquery, TSQUERY))
+
+    matches = select(
+        AudioChunks.chunk_id, AudioChunks.video_id, AudioChunks.video_uuid, AudioChunks.start_sample,
+        AudioChunks.end_sample, AudioChunks.transcribe, AudioChunks.transcript_tsv
+    ).where(condition, AudioChunks.transcription_status == TranscriptionStatus.DONE)
+    if video_uuid is not None:
+        matches = matches.where(AudioChunks.video_uuid == video_uuid)
+    matches = matches.limit(candidates).subquery()
+
+    rank = func.ts_rank_cd(matches.c.transcript_tsv, cast(tsquery, TSQUERY)).label("rank")
+    ranked = select(
+        matches.c.chunk_id, matches.c.video_id, matches.c.video_uuid, matches.c.start_sample,
+        matches.c.end_sample, matches.c.transcribe, rank
+    ).order_by(rank.desc(), matches.c.chunk_id).limit(limit).offset(offset).subquery()
+
+    stmt = select(ranked, Download_videos.sample_rate).join(
+        Download_videos, Download_videos.id == ranked.c.video_id
+    ).order_by(ranked.c.rank.desc(), ranked.c.chunk_id)
+
+    with stage_timer("search"):
+        async with async_session() as session:
+            rows = (await session.execute(stmt)).all()
+
+    return {
+        "query": tsquery,
+        "hits": [
+            {
+                "chunk_id": row.chunk_id,
+                "video_uuid": row.video_uuid,
+                "start_sample": row.start_sample,
+                "end_sample": row.end_sample,
+                "start_ms": offset_ms(row.start_sample, row.sample_rate),
+                "end_ms": offset_ms(row.end_sample, row.sample_rate),
+                "rank": row.rank,
+                "snippet": snippet(row.transcribe, terms),
+            }
+            for row in rows
+        ],
+    }
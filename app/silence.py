@@ -0,0 +1,437 @@
+import os
+from collections import namedtuple
+import numpy as np
+
+# Frame size (ms) of the fine energy envelope; coarser envelopes are built from it
+ENVELOPE_FRAME_MS = 10
+
+# How chunk_ranges cuts audio: "pack" fits all speech into chunks within the
+# length bounds; "silence" only splits on silence and drops what does not fit
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "pack")
+
+# Costs of the segment packer, in seconds of speech left out of every chunk
+_REQUEST_COST = 0.5  # One more transcription request
+_SILENCE_COST = 0.05  # Each second of silence sent inside a chunk
+_CUT_COST = 1.0  # Cutting through sound 30 dB or more above the silence threshold
+_PADDING_WEIGHT = 0.5  # keep_silence padding next to speech, relative to speech itself
+
+# Costs are summed as integer microseconds, so equal placements tie exactly
+# wherever the packed stretch of audio starts
+_COST_UNITS = 1_000_000
+
+# Number of frames converted to float per block when building the envelope
+_BLOCK_FRAMES = 4096
+
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+
+def samples_from_bytes(raw_data, sample_width):
+    """View raw little-endian PCM bytes as a numpy array without copying."""
+    return np.frombuffer(raw_data, dtype=SAMPLE_DTYPES[sample_width])
+
+
+def frame_length(sample_rate, frame_ms=ENVELOPE_FRAME_MS):
+    """Number of samples (per channel) in one envelope frame."""
+    return max(1, int(round(sample_rate * frame_ms / 1000)))
+
+
+# Mean-square power of each frame, normalised to full scale (0 dBFS == 1.0)
+def frame_power(samples, channels, sample_width, frame_len):
+    """Compute the per-frame power envelope of interleaved PCM samples.
+
+    The last partial frame is kept so the envelope covers the whole input.
+    """
+    samples = np.asarray(samples).reshape(-1)
+    per_frame = frame_len * channels
+    n_full = len(samples) // per_frame
+    remainder = len(samples) - n_full * per_frame
+    power = np.empty(n_full + (1 if remainder else 0), dtype=np.float64)
+
+    for start in range(0, n_full, _BLOCK_FRAMES):
+        stop = min(start + _BLOCK_FRAMES, n_full)
+        block = samples[start * per_frame:stop * per_frame].reshape(-1, per_frame).astype(np.float64)
+        power[start:stop] = np.einsum("ij,ij->i", block, block) / per_frame
+
+    if remainder:
+        tail = samples[n_full * per_frame:].astype(np.float64)
+        power[-1] = np.dot(tail, tail) / len(tail)
+
+    full_scale = float(1 << (8 * sample_width - 1))
+    return power / (full_scale * full_scale)
+
+
+def downsample_power(power, factor):
+    """Average consecutive frames together to get a coarser envelope."""
+    if factor <= 1:
+        return power
+    n_full = len(power) // factor
+    coarse = power[:n_full * factor].reshape(-1, factor).mean(axis=1)
+    if len(power) > n_full * factor:
+        coarse = np.append(coarse, power[n_full * factor:].mean())
+    return coarse
+
+
+def power_to_dbfs(power):
+    """Convert a power envelope to dBFS (silent frames become -inf)."""
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10(power)
+
+
+def dbfs_to_power(dbfs):
+    """Convert a dBFS envelope back to normalised power."""
+    return np.power(10.0, np.asarray(dbfs, dtype=np.float64) / 10)
+
+
+# Vectorised equivalent of pydub.silence.detect_nonsilent on a power envelope
+def nonsilent_ranges(power, frame_ms, min_silence_len=1000, silence_thresh=-40, duration_ms=None):
+    """Return [start_ms, end_ms] ranges that are not silent.
+
+    A window of ``min_silence_len`` starting at every frame is silent when its
+    RMS is at or below ``silence_thresh`` dBFS; the union of silent windows is
+    the silence, everything else is returned. Boundaries are exact to one frame.
+    """
+    n = len(power)
+    if duration_ms is None:
+        duration_ms = int(n * frame_ms)
+    if n == 0:
+        return []
+
+    window = max(1, int(round(min_silence_len / frame_ms)))
+    if n < window:
+        return [[0, duration_ms]]
+
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    window_power = (cumulative[window:] - cumulative[:-window]) / window
+    silent_starts = window_power <= 10 ** (silence_thresh / 10)
+
+    # A frame is silent if any silent window starting in [j - window + 1, j] covers it
+    starts_count = np.concatenate(([0], np.cumsum(silent_starts)))
+    frames = np.arange(n)
+    n_starts = len(silent_starts)
+    low = np.clip(frames - window + 1, 0, n_starts)
+    high = np.clip(frames + 1, 0, n_starts)
+    silent = (starts_count[high] - starts_count[low]) > 0
+
+    edges = np.diff(np.concatenate(([0], (~silent).astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    return [
+        [int(start * frame_ms), min(int(end * frame_ms), duration_ms)]
+        for start, end in zip(run_starts, run_ends)
+    ]
+
+
+# Vectorised equivalent of pydub.silence.split_on_silence for one range
+def split_range_on_silence(power, frame_ms, start_ms, end_ms, min_silence_len=1000,
+                           silence_thresh=-40, keep_silence=500):
+    """Split [start_ms, end_ms] at inner silences, padding pieces by ``keep_silence``."""
+    first = int(start_ms // frame_ms)
+    last = int(-(-end_ms // frame_ms))
+    length = end_ms - start_ms
+    pieces = nonsilent_ranges(power[first:last], frame_ms, min_silence_len, silence_thresh, length)
+
+    padded = [[start - keep_silence, end + keep_silence] for start, end in pieces]
+    for current, following in zip(padded, padded[1:]):
+        if following[0] < current[1]:
+            current[1] = (current[1] + following[0]) // 2
+            following[0] = current[1]
+
+    return [
+        [start_ms + max(start, 0), start_ms + min(end, length)]
+        for start, end in padded
+    ]
+
+
+# Keep a nonsilent range whose length is within bounds; split longer ones on
+# additional silence and keep the pieces that are within bounds
+def fit_range(power, frame_ms, start, end, silence_thresh=-40, min_silence_len=1000,
+              min_chunk_len=5000, max_chunk_len=18000, keep_silence=500):
+    """Return the chunks [start_ms, end_ms] that the nonsilent range [start, end] yields."""
+    length = end - start
+    if min_chunk_len <= length <= max_chunk_len:
+        return [[start, end]]
+    if length < min_chunk_len:
+        return []
+    # Split larger ranges based on additional silence
+    return [
+        [sub_start, sub_end]
+        for sub_start, sub_end in split_range_on_silence(
+            power, frame_ms, start, end, min_silence_len, silence_thresh, keep_silence
+        )
+        if min_chunk_len <= sub_end - sub_start <= max_chunk_len
+    ]
+
+
+# Chunk boundaries split_audio_with_silence has always produced
+def silence_ranges(power, frame_ms=ENVELOPE_FRAME_MS, duration_ms=None, silence_thresh=-40,
+                   min_silence_len=1000, min_chunk_len=5000, max_chunk_len=18000,
+                   seek_step=100, keep_silence=500):
+    """Return [start_ms, end_ms] chunk boundaries within the configured length bounds.
+
+    Speech that does not fit the bounds after splitting on silence is dropped.
+    """
+    if duration_ms is None:
+        duration_ms = int(len(power) * frame_ms)
+
+    factor = max(1, int(round(seek_step / frame_ms)))
+    coarse = downsample_power(power, factor)
+    ranges = nonsilent_ranges(coarse, frame_ms * factor, min_silence_len, silence_thresh, duration_ms)
+
+    chunks = []
+    for start, end in ranges:
+        chunks.extend(fit_range(power, frame_ms, start, end, silence_thresh, min_silence_len,
+                                min_chunk_len, max_chunk_len, keep_silence))
+    return chunks
+
+
+# Place chunks so that as much speech as possible lands in one within the length bounds
+def pack_ranges(power, frame_ms=ENVELOPE_FRAME_MS, duration_ms=None, silence_thresh=-40,
+                min_silence_len=1000, min_chunk_len=5000, max_chunk_len=18000,
+                seek_step=100, keep_silence=500):
+    """Return [start_ms, end_ms] chunk boundaries that cover the speech, cut where it is quietest.
+
+    Speech is what nonsilent_ranges finds, padded by ``keep_silence``. Chunk
+    boundaries lie on a ``seek_step`` grid, and a dynamic program over that grid
+    minimises speech left out of every chunk, plus a cost per chunk, per second
+    of silence inside a chunk and per cut through sound. Short runs of speech are
+    merged, or padded with silence up to ``min_chunk_len``, and long runs are cut
+    at their quietest points.
+    """
+    if duration_ms is None:
+        duration_ms = int(len(power) * frame_ms)
+    factor = max(1, int(round(seek_step / frame_ms)))
+    step = frame_ms * factor
+    coarse = downsample_power(power, factor)
+    n = len(coarse)
+    if n == 0 or duration_ms < min_chunk_len:
+        return []
+
+    speech = np.zeros(n, dtype=bool)
+    for start, end in nonsilent_ranges(coarse, step, min_silence_len, silence_thresh, duration_ms):
+        speech[start // step:-(-end // step)] = True
+    if not speech.any():
+        return []
+
+    # Cost of leaving each frame out of every chunk, and of sending silence
+    units = _COST_UNITS * step / 1000
+    pad = int(round(keep_silence / step))
+    padded = np.convolve(speech, np.ones(2 * pad + 1), mode="same") > 0
+    skip_cost = np.rint(np.where(speech, 1.0, np.where(padded, _PADDING_WEIGHT, 0.0)) * units).astype(np.int64)
+    silence_cost = np.concatenate(([0], np.cumsum(~speech * round(_SILENCE_COST * units))))
+    request_cost = round(_REQUEST_COST * _COST_UNITS)
+
+    # Cost of a boundary between frames b - 1 and b, from how loud the audio there is
+    level = power_to_dbfs(np.concatenate(([0.0], (coarse[:-1] + coarse[1:]) / 2, [0.0])))
+    cut_cost = np.rint(_CUT_COST * _COST_UNITS * np.clip((level - silence_thresh) / 30, 0, 1)).astype(np.int64)
+
+    # best[e] is the cost of the audio before boundary e. A chunk [s, e) adds
+    # silence_cost[e] - silence_cost[s] + cut_cost[s] + cut_cost[e] + request_cost,
+    # so the best start is the argmin of from_start[s] over the allowed lengths
+    ends_ms = np.minimum(np.arange(n + 1) * step, duration_ms)
+    best = np.empty(n + 1, dtype=np.int64)
+    from_start = np.empty(n + 1, dtype=np.int64)
+    previous = np.full(n + 1, -1)
+    best[0] = 0
+    from_start[0] = cut_cost[0]
+    for e in range(1, n + 1):
+        best[e] = best[e - 1] + skip_cost[e - 1]
+        first = max(0, -(-(int(ends_ms[e]) - max_chunk_len) // step))
+        last = (int(ends_ms[e]) - min_chunk_len) // step
+        if last >= first:
+            s = first + int(np.argmin(from_start[first:last + 1]))
+            cost = from_start[s] + silence_cost[e] + cut_cost[e] + request_cost
+            if cost < best[e]:
+                best[e] = cost
+                previous[e] = s
+        from_start[e] = best[e] + cut_cost[e] - silence_cost[e]
+
+    chunks = []
+    e = n
+    while e > 0:
+        if previous[e] < 0:
+            e -= 1
+        else:
+            chunks.append([int(previous[e] * step), int(ends_ms[e])])
+            e = previous[e]
+    return chunks[::-1]
+
+
+_STRATEGIES = {"pack": pack_ranges, "silence": silence_ranges}
+CHUNK_STRATEGIES = tuple(_STRATEGIES)
+
+# The chunk_ranges parameters a caller may tune per request
+SegmentParams = namedtuple(
+    "SegmentParams", ["silence_thresh", "min_silence_len", "min_chunk_len", "max_chunk_len", "strategy"],
+    defaults=(-40, 1000, 5000, 18000, CHUNK_STRATEGY)
+)
+
+
+def segment_params(silence_thresh=None, min_silence_len=None, min_chunk_len=None, max_chunk_len=None,
+                   strategy=None):
+    """Build segmentation parameters, taking unset fields from the defaults."""
+    given = dict(silence_thresh=silence_thresh, min_silence_len=min_silence_len, min_chunk_len=min_chunk_len,
+                 max_chunk_len=max_chunk_len, strategy=strategy)
+    params = SegmentParams(**{name: value for name, value in given.items() if value is not None})
+    if params.strategy not in _STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy {params.strategy!r}; expected one of {', '.join(_STRATEGIES)}")
+    if not 0 < params.min_chunk_len <= params.max_chunk_len:
+        raise ValueError("Chunk lengths must be positive, with min_chunk_len no larger than max_chunk_len")
+    if params.min_silence_len <= 0:
+        raise ValueError("min_silence_len must be positive")
+    return params
+
+
+DEFAULT_SEGMENTATION = segment_params()
+
+
+# Chunk boundaries used by the chunkers, computed from a fine envelope
+def chunk_ranges(power, frame_ms=ENVELOPE_FRAME_MS, duration_ms=None, silence_thresh=-40,
+                 min_silence_len=1000, min_chunk_len=5000, max_chunk_len=18000,
+                 seek_step=100, keep_silence=500, strategy=CHUNK_STRATEGY):
+    """Return [start_ms, end_ms] chunk boundaries with the pack or silence strategy."""
+    if strategy not in _STRATEGIES:
+        raise ValueError(f"Unknown chunk strategy {strategy!r}; expected one of {', '.join(_STRATEGIES)}")
+    return _STRATEGIES[strategy](power, frame_ms, duration_ms, silence_thresh, min_silence_len,
+                                 min_chunk_len, max_chunk_len, seek_step, keep_silence)
+
+
+# chunk_ranges for audio that arrives a block at a time
+class StreamingChunker:
+    """Cut chunks from a growing power envelope as soon as they can no longer change.
+
+    A nonsilent range is final once a whole ``min_silence_len`` window of audio
+    has arrived after it: later audio only adds silent windows that start after
+    that point, so they cannot reach back into the range.
+
+    With the silence strategy final ranges are fitted exactly as chunk_ranges
+    fits them. The packer looks further: no chunk can reach across a confirmed
+    silence longer than twice ``max_chunk_len + keep_silence``, so the speech
+    before such a silence is packed on its own. Either way the envelope before
+    the emitted chunks is dropped and the result equals chunk_ranges over the
+    whole envelope. Speech that runs on for ``horizon_ms`` without such a
+    silence is packed up to the newest audio, and only the chunks ending
+    ``horizon_ms / 2`` or more before it are emitted; those may differ slightly
+    from the batch result.
+    """
+
+    def __init__(self, frame_ms=ENVELOPE_FRAME_MS, silence_thresh=-40, min_silence_len=1000,
+                 min_chunk_len=5000, max_chunk_len=18000, seek_step=100, keep_silence=500,
+                 strategy=CHUNK_STRATEGY, horizon_ms=600000):
+        if strategy not in _STRATEGIES:
+            raise ValueError(f"Unknown chunk strategy {strategy!r}; expected one of {', '.join(_STRATEGIES)}")
+        self.frame_ms = frame_ms
+        self.factor = max(1, int(round(seek_step / frame_ms)))
+        self.window = max(1, int(round(min_silence_len / (frame_ms * self.factor))))
+        self.options = dict(silence_thresh=silence_thresh, min_silence_len=min_silence_len,
+                            min_chunk_len=min_chunk_len, max_chunk_len=max_chunk_len,
+                            keep_silence=keep_silence)
+        self.strategy = strategy
+        self.horizon_ms = horizon_ms
+        self.offset = 0  # Fine frames dropped so far
+        self._power = np.zeros(0, dtype=np.float64)
+
+    @property
+    def offset_ms(self):
+        return self.offset * self.frame_ms
+
+    def _ranges(self, coarse, duration_ms):
+        return nonsilent_ranges(coarse, self.frame_ms * self.factor, self.options["min_silence_len"],
+                                self.options["silence_thresh"], duration_ms)
+
+    def _fit(self, ranges):
+        chunks = []
+        for start, end in ranges:
+            for chunk_start, chunk_end in fit_range(self._power, self.frame_ms, start, end, **self.options):
+                chunks.append([self.offset_ms + chunk_start, self.offset_ms + chunk_end])
+        return chunks
+
+    def _pack(self, frames, duration_ms):
+        """Pack the first ``frames`` fine frames and drop them from the envelope."""
+        chunks = [
+            [self.offset_ms + start, self.offset_ms + end]
+            for start, end in pack_ranges(self._power[:frames], self.frame_ms, duration_ms,
+                                          seek_step=self.frame_ms * self.factor, **self.options)
+        ]
+        self._power = self._power[frames:]
+        self.offset += frames
+        return chunks
+
+    def _feed_packed(self, coarse, n_coarse):
+        coarse_ms = self.frame_ms * self.factor
+        confirmed_ms = (n_coarse - self.window) * coarse_ms
+        reach = self.options["max_chunk_len"] + self.options["keep_silence"]
+
+        # The latest point that no chunk can cross: at least `reach` after the
+        # speech before it and `reach` before the speech after it
+        cut_ms = None
+        speech_end = None
+        ranges = self._ranges(coarse, n_coarse * coarse_ms)
+        for start, end in ranges + [[confirmed_ms, None]]:
+            start = min(start, confirmed_ms)
+            cut = (start - reach) // coarse_ms * coarse_ms
+            if cut > 0 and (speech_end is None or cut >= speech_end + reach):
+                cut_ms = cut
+            if end is None or end > confirmed_ms:
+                break
+            speech_end = end
+        if cut_ms is not None:
+            return self._pack(cut_ms // self.frame_ms, cut_ms)
+
+        if n_coarse * coarse_ms < self.horizon_ms:
+            return []
+        # No such silence for a long time; keep the chunks well behind the newest audio
+        horizon = confirmed_ms - self.horizon_ms // 2
+        chunks = [
+            [start, end]
+            for start, end in pack_ranges(self._power[:confirmed_ms // self.frame_ms], self.frame_ms,
+                                          confirmed_ms, seek_step=coarse_ms, **self.options)
+            if end <= horizon
+        ]
+        if not chunks:
+            return []
+        emitted = [[self.offset_ms + start, self.offset_ms + end] for start, end in chunks]
+        dropped = chunks[-1][1] // self.frame_ms
+        self._power = self._power[dropped:]
+        self.offset += dropped
+        return emitted
+
+    def feed(self, power):
+        """Add complete envelope frames; return the chunks that became final."""
+        self._power = np.concatenate((self._power, power))
+        n_coarse = len(self._power) // self.factor
+        if n_coarse <= self.window:
+            return []
+        if self.strategy == "pack":
+            coarse = downsample_power(self._power[:n_coarse * self.factor], self.factor)
+            return self._feed_packed(coarse, n_coarse)
+
+        # Only whole coarse frames are used; a partial one may still grow
+        coarse = downsample_power(self._power[:n_coarse * self.factor], self.factor)
+        coarse_ms = self.frame_ms * self.factor
+        final = [
+            [start, end] for start, end in self._ranges(coarse, n_coarse * coarse_ms)
+            if end // coarse_ms <= n_coarse - self.window
+        ]
+        if not final:
+            return []
+
+        chunks = self._fit(final)
+        drop = (final[-1][1] // coarse_ms) * self.factor
+        self._power = self._power[drop:]
+        self.offset += drop
+        return chunks
+
+    def finish(self, duration_ms, tail_power=None):
+        """Return the remaining chunks once the stream of ``duration_ms`` has ended.
+
+        ``tail_power`` is the power of the last, partial frame, if there was one.
+        """
+        if tail_power is not None:
+            self._power = np.concatenate((self._power, tail_power))
+        if self.strategy == "pack":
+            return self._pack(len(self._power), duration_ms - self.offset_ms)
+        coarse = downsample_power(self._power, self.factor)
+        chunks = self._fit(self._ranges(coarse, duration_ms - self.offset_ms))
+        self._power = self._power[:0]
+        return chunks
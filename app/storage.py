@@ -0,0 +1,44 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+# Files live under <root>/<ab>/<cd>/<key>, taking ab and cd from the key's hex digits,
+# so no directory grows past 256 entries per level until there are billions of files
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+
+
+def shard_path(root, key, depth=SHARD_DEPTH, width=SHARD_WIDTH):
+    """Return the sharded location of ``key`` under ``root``."""
+    digits = key.replace("-", "")
+    parts = [digits[i * width:(i + 1) * width] for i in range(depth)]
+    return os.path.join(root, *parts, key)
+
+
+def video_path(root, video_uuid):
+    """Where the decoded WAV of a downloaded video is stored."""
+    return shard_path(root, video_uuid) + ".wav"
+
+
+def chunk_directory(root, video_uuid):
+    """Directory holding the materialized chunks of a video."""
+    return shard_path(root, video_uuid)
+
+
+# A unique sibling name; renaming it over ``path`` is atomic on the same filesystem
+def temp_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.tmp-{uuid.uuid4().hex}")
+
+
+@contextmanager
+def atomic_output(path):
+    """Yield a temporary path to write to; it replaces ``path`` only on success."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary = temp_path(path)
+    try:
+        yield temporary
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
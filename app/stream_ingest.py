@@ -0,0 +1,271 @@
+import asyncio
+import os
+import shutil
+import numpy as np
+import xxhash
+from sqlalchemy import update, delete, func
+from app.database import async_session
+from app.models import Download_videos, AudioChunks, ChunkStatus, chunk_id_for
+from app.audio_chunker import upsert_chunks
+from app.silence import StreamingChunker, frame_length, frame_power, DEFAULT_SEGMENTATION
+from app.envelope import envelope_path, quantize, save_envelope
+from app.wavfile import wav_header
+from app.storage import video_path, chunk_directory
+from app.chunk_encoding import DEFAULT_PROFILE, pcm_to_float, write_frames
+from app.metrics import stage_timer, count_audio
+from app.core.config import ORIGINAL_DIRECTORY, CHUNK_OUTPUT
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# Seconds of PCM read from the FFmpeg pipe per step
+STREAM_BLOCK_SECONDS = float(os.getenv("STREAM_BLOCK_SECONDS", "1"))
+
+# Bytes of FFmpeg's error output kept for the error message of a failed decode
+STDERR_TAIL_BYTES = int(os.getenv("STDERR_TAIL_BYTES", str(8 * 1024)))
+
+# The pipe carries 16-bit little-endian PCM
+_SAMPLE_WIDTH = 2
+
+# Header size fields of a WAV that is still being written; readers use the file length
+_STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def ffmpeg_command(source, sample_rate, channels, headers=None):
+    """FFmpeg arguments that decode ``source`` (a path or media URL) to raw PCM on stdout."""
+    command = [FFMPEG_BINARY, "-nostdin", "-loglevel", "error"]
+    if headers:
+        command += ["-headers", "".join(f"{key}: {value}\r\n" for key, value in headers.items())]
+    return command + [
+        "-i", source, "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ar", str(sample_rate), "-ac", str(channels), "pipe:1"
+    ]
+
+
+# Writes the decoded PCM to a WAV as it arrives; readers can map it while it grows
+class GrowingWav:
+    def __init__(self, path, sample_rate, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.data_size = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(wav_header(sample_rate, channels, _SAMPLE_WIDTH, _STREAMING_DATA_SIZE))
+
+    def write(self, data):
+        self._file.write(data)
+        # Chunks registered from this data must be readable from the file right away
+        self._file.flush()
+        self.data_size += len(data)
+
+    def close(self):
+        """Fill in the real sizes once the stream has ended."""
+        self._file.seek(0)
+        self._file.write(wav_header(self.sample_rate, self.channels, _SAMPLE_WIDTH, self.data_size))
+        self._file.close()
+
+
+async def create_streamed_video(video_uuid, video_name, video_url, location, meta_data, sample_rate):
+    async with async_session() as session:
+        async with session.begin():
+            video = Download_videos(
+                uuid=video_uuid, video_name=video_name, video_url=video_url, location=location,
+                meta_data=meta_data, chunk_status=ChunkStatus.PENDING, sample_rate=sample_rate
+            )
+            session.add(video)
+        return video.id
+
+
+async def register_chunk(row, checkpoint):
+    async with async_session() as session:
+        with stage_timer("chunk_db_commit"):
+            async with session.begin():
+                await upsert_chunks(session, [row])
+                await session.execute(
+                    update(Download_videos)
+                    .where(Download_videos.id == row["video_id"])
+                    .values(chunk_checkpoint=checkpoint)
+                )
+
+
+async def finish_streamed_video(video_id, content_hash, meta_data, envelope_file, duration):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(
+                update(Download_videos)
+                .where(Download_videos.id == video_id)
+                .values(chunk_status=ChunkStatus.DONE, chunked_at=func.now(),
+                        content_hash=content_hash, meta_data=meta_data,
+                        envelope_path=envelope_file, duration_ms=duration)
+            )
+
+
+# A failed stream leaves nothing behind, so the video can be streamed again
+async def discard_streamed_video(video_id, location):
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(delete(AudioChunks).where(AudioChunks.video_id == video_id))
+            await session.execute(delete(Download_videos).where(Download_videos.id == video_id))
+    if os.path.isdir(location):
+        shutil.rmtree(location, ignore_errors=True)
+    elif os.path.exists(location):
+        os.remove(location)
+
+
+async def _read_block(stream, size):
+    """Read ``size`` bytes, or fewer at the end of the stream."""
+    try:
+        return await stream.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+
+# FFmpeg blocks once its stderr pipe is full, so the pipe is drained while stdout is read
+async def _stderr_tail(stream, limit=STDERR_TAIL_BYTES):
+    """Read ``stream`` to its end and return its last ``limit`` bytes."""
+    tail = b""
+    while True:
+        block = await stream.read(64 * 1024)
+        if not block:
+            return tail
+        tail = (tail + block)[-limit:]
+
+
+async def stream_ingest(source, video_uuid, video_name=None, video_url=None, sample_rate=16000, channels=1,
+                        headers=None, keep_source=True, profile=DEFAULT_PROFILE, on_chunk=None,
+                        segmentation=DEFAULT_SEGMENTATION):
+    """Decode ``source`` through an FFmpeg pipe and register chunks as they are cut.
+
+    Silence is detected online with StreamingChunker, so each chunk is saved to
+    AudioChunks as soon as a long enough silence follows it, while the rest of
+    the audio is still being decoded. With ``keep_source`` the PCM is also
+    written to the usual WAV location and chunks are virtual slices of it;
+    without it only the chunks are kept, encoded with ``profile``, the
+    video's location is their directory and the video cannot be chunked again.
+    ``on_chunk`` is called with the row of every registered chunk. The power
+    envelope is kept as well and saved as the video's envelope index.
+
+    Returns ``{"uuid", "location", "chunks"}``.
+    """
+    if keep_source:
+        location = video_path(ORIGINAL_DIRECTORY, video_uuid)
+    else:
+        location = chunk_directory(CHUNK_OUTPUT, video_uuid)
+        os.makedirs(location, exist_ok=True)
+    meta_data = {"streamed": True, "sampling_frequency(Hz)": sample_rate, "channels": channels,
+                 "source_kept": keep_source}
+    video_id = await create_streamed_video(video_uuid, video_name, video_url, location, meta_data, sample_rate)
+
+    frame_len = frame_length(sample_rate)
+    frame_bytes = frame_len * channels * _SAMPLE_WIDTH
+    block_bytes = max(1, int(STREAM_BLOCK_SECONDS * 1000 / 10)) * frame_bytes
+    chunker = StreamingChunker(**segmentation._asdict())
+    envelope = []  # Power of every analysed block, saved as the index once the stream ends
+
+    wav = GrowingWav(location, sample_rate, channels) if keep_source else None
+    digest = xxhash.xxh3_128()
+    pending = bytearray()  # PCM from frame `buffer_start` on; older audio is in finished chunks
+    buffer_start = 0
+    total_frames = 0
+    chunk_count = 0
+
+    async def emit(chunks):
+        nonlocal chunk_count
+        for start_ms, end_ms in chunks:
+            start_sample = min(int(start_ms * sample_rate / 1000), total_frames)
+            end_sample = min(int(end_ms * sample_rate / 1000), total_frames)
+            first = (start_sample - buffer_start) * channels * _SAMPLE_WIDTH
+            last = (end_sample - buffer_start) * channels * _SAMPLE_WIDTH
+            payload = bytes(pending[first:last])
+            chunk_count += 1
+
+            file_path = None
+            if not keep_source:
+                samples = np.frombuffer(payload, dtype=np.int16)
+                with stage_timer("chunk_export"):
+                    file_path = await asyncio.to_thread(
+                        write_frames, os.path.join(location, f"chunk_{chunk_count}"),
+                        pcm_to_float(samples, channels, _SAMPLE_WIDTH), sample_rate, profile
+                    )
+            row = {
+                "chunk_id": chunk_id_for(video_uuid, start_sample),
+                "video_id": video_id,
+                "video_uuid": video_uuid,
+                "file_path": file_path,
+                "source_path": location if keep_source else None,
+                "start_sample": start_sample if keep_source else None,
+                "end_sample": end_sample if keep_source else None,
+                "content_hash": xxhash.xxh3_128(payload).hexdigest()
+            }
+            await register_chunk(row, end_sample)
+            count_audio("chunk_output", seconds=(end_sample - start_sample) / sample_rate)
+            if on_chunk is not None:
+                on_chunk(row)
+
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command(source, sample_rate, channels, headers),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stderr_task = asyncio.create_task(_stderr_tail(process.stderr))
+    try:
+        unanalysed = b""
+        while True:
+            block = await _read_block(process.stdout, block_bytes)
+            if not block:
+                break
+            total_frames += len(block) // (channels * _SAMPLE_WIDTH)
+            digest.update(block)
+            pending += block
+            if wav is not None:
+                wav.write(block)
+
+            # Only whole envelope frames are analysed; the rest waits for the next block
+            unanalysed += block
+            whole = len(unanalysed) // frame_bytes * frame_bytes
+            with stage_timer("silence_detection"):
+                samples = np.frombuffer(unanalysed[:whole], dtype=np.int16)
+                power = quantize(frame_power(samples, channels, _SAMPLE_WIDTH, frame_len))
+                envelope.append(power)
+                chunks = chunker.feed(power)
+            unanalysed = unanalysed[whole:]
+            await emit(chunks)
+
+            # Audio before the chunker's offset can no longer be part of a chunk
+            drop = chunker.offset * frame_len - buffer_start
+            if drop > 0:
+                del pending[:drop * channels * _SAMPLE_WIDTH]
+                buffer_start += drop
+
+        stderr = await stderr_task
+        if await process.wait() != 0:
+            raise RuntimeError(f"FFmpeg failed for {source}: {stderr.decode(errors='replace').strip()}")
+
+        tail_power = None
+        if unanalysed:
+            samples = np.frombuffer(unanalysed[:len(unanalysed) // _SAMPLE_WIDTH * _SAMPLE_WIDTH], dtype=np.int16)
+            tail_power = quantize(frame_power(samples, channels, _SAMPLE_WIDTH, frame_len))
+            envelope.append(tail_power)
+        duration_ms = int(total_frames * 1000 / sample_rate)
+        await emit(chunker.finish(duration_ms, tail_power))
+        envelope_file = await asyncio.to_thread(
+            save_envelope, envelope_path(video_uuid), np.concatenate(envelope) if envelope else np.zeros(0)
+        )
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        if wav is not None:
+            wav.close()
+        await discard_streamed_video(video_id, location)
+        raise
+
+    if wav is not None:
+        wav.close()
+
+    count_audio("download", total_frames * channels * _SAMPLE_WIDTH, total_frames / sample_rate)
+    count_audio("chunking", total_frames * channels * _SAMPLE_WIDTH, total_frames / sample_rate)
+    meta_data["audio_length(sec)"] = total_frames / sample_rate
+    await finish_streamed_video(video_id, digest.hexdigest(), meta_data, envelope_file, duration_ms)
+    print(f"Streamed {source}: {chunk_count} chunks from {total_frames / sample_rate:.1f}s of audio")
+    return {"uuid": video_uuid, "location": location, "chunks": chunk_count}
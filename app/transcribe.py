@@ -1,73 +1,263 @@
 import os
-import requests
+import asyncio
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import update
 from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import async_session
-from app.models import AudioChunks
-from app.core.config import TRANSCRIPTION_API_URL
+from app.models import AudioChunks, TranscriptionStatus
+from app.chunk_reader import open_chunk_upload, chunk_content_hash
+from app.metrics import stage_timer, count_audio, TRANSCRIPTION_REQUESTS, IN_FLIGHT
+from app.dispatch import TranscriptionDispatcher, TRANSCRIPTION_API_URLS
 
-async def transcribe_chunks():
-    # Fetch all audio chunks that need transcription
+# Maximum number of chunks in flight against the transcription servers
+TRANSCRIPTION_CONCURRENCY = int(os.getenv("TRANSCRIPTION_CONCURRENCY", "8"))
+
+# Per-request timeouts (seconds); the read timeout covers the server's inference time
+TRANSCRIPTION_CONNECT_TIMEOUT = float(os.getenv("TRANSCRIPTION_CONNECT_TIMEOUT", "10"))
+TRANSCRIPTION_READ_TIMEOUT = float(os.getenv("TRANSCRIPTION_READ_TIMEOUT", "120"))
+
+# Number of results written per bulk UPDATE / commit
+TRANSCRIPTION_BATCH_SIZE = int(os.getenv("TRANSCRIPTION_BATCH_SIZE", "100"))
+
+
+# Values stored when a chunk could not be transcribed; such chunks are marked failed
+FAILED_TRANSCRIPTIONS = (
+    'Transcription failed',
+    'File not found',
+    'Error during transcription',
+    'Error: Non-JSON response',
+)
+
+# Pooled async client sized to the concurrency limit, with room for hedged requests
+def transcription_client(concurrency=TRANSCRIPTION_CONCURRENCY):
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=2 * concurrency, max_keepalive_connections=2 * concurrency),
+        timeout=httpx.Timeout(TRANSCRIPTION_READ_TIMEOUT, connect=TRANSCRIPTION_CONNECT_TIMEOUT),
+        headers={'accept': 'application/json'}
+    )
+
+# Send one chunk to the transcription servers and return the text to store for it
+async def transcribe_chunk(dispatcher, semaphore, chunk):
+    async with semaphore:
+        IN_FLIGHT.labels("transcription").inc()
+        outcome = "ok"
+        try:
+            print(f"Processing chunk: {chunk.chunk_id}")
+
+            # Virtual chunks are resampled and encoded off the event loop
+            async def open_files():
+                with stage_timer("chunk_encode"):
+                    filename, audio_file, content_type = await asyncio.to_thread(open_chunk_upload, chunk)
+                return {'audio': (filename, audio_file, content_type)}
+
+            files = await open_files()
+            audio_file = files['audio'][1]
+
+            # The multipart body is streamed from the file in blocks; only a
+            # hedged or retried request opens the chunk a second time
+            with audio_file, stage_timer("transcription_request"):
+                count_audio("transcription", audio_file.seek(0, os.SEEK_END))
+                audio_file.seek(0)
+                response = await dispatcher.post(files, open_files)
+            response.raise_for_status()  # Raise an error for bad status codes
+
+            # Attempt to parse JSON response
+            try:
+                response_data = response.json()
+                transcription = response_data.get('transcription', 'No transcription found')
+            except ValueError:
+                # If response is not JSON, handle the error
+                print(f"Error: Response is not in JSON format. Response text: {response.text}")
+                transcription = 'Error: Non-JSON response'
+                outcome = "non_json"
+
+            print(f"Transcription for {chunk.chunk_id}: {transcription}")
+            return transcription
+        except httpx.HTTPError as e:
+            print(f"Request error for chunk {chunk.chunk_id}: {e}")
+            outcome = "http_error"
+            return 'Transcription failed'
+        except FileNotFoundError:
+            print(f"File not found: {chunk.chunk_id}")
+            outcome = "file_not_found"
+            return 'File not found'
+        except Exception as e:
+            print(f"Error processing chunk {chunk.chunk_id}: {e}")
+            outcome = "error"
+            return 'Error during transcription'
+        finally:
+            IN_FLIGHT.labels("transcription").dec()
+            TRANSCRIPTION_REQUESTS.labels(outcome).inc()
+
+# Transcribe chunks concurrently, at most ``concurrency`` requests at a time
+async def transcribe_many(chunks, concurrency=TRANSCRIPTION_CONCURRENCY, api_urls=TRANSCRIPTION_API_URLS):
+    semaphore = asyncio.Semaphore(concurrency)
+    async with transcription_client(concurrency) as client:
+        dispatcher = TranscriptionDispatcher(client, api_urls)
+        return await asyncio.gather(
+            *(transcribe_chunk(dispatcher, semaphore, chunk) for chunk in chunks)
+        )
+
+# Fetch the next page of chunks that need transcription, after ``after_id``
+async def fetch_pending_chunks(after_id, limit, video_uuid=None):
     async with async_session() as session:
-        async with session.begin():
-            stmt = select(AudioChunks).where(AudioChunks.transcribe == None)
-            result = await session.execute(stmt)
-            audio_chunks = result.scalars().all()
+        stmt = select(
+            AudioChunks.chunk_id,
+            AudioChunks.file_path,
+            AudioChunks.source_path,
+            AudioChunks.start_sample,
+            AudioChunks.end_sample,
+            AudioChunks.content_hash
+        ).where(AudioChunks.transcription_status == TranscriptionStatus.PENDING)
+        if video_uuid is not None:
+            stmt = stmt.where(AudioChunks.video_uuid == video_uuid)
+        if after_id is not None:
+            stmt = stmt.where(AudioChunks.chunk_id > after_id)
+        result = await session.execute(stmt.order_by(AudioChunks.chunk_id).limit(limit))
+        return result.all()
 
-            if not audio_chunks:
-                print("No audio chunks found that need transcription.")
-                return {"message": "No audio chunks to transcribe."}
-
-            # Process each chunk with the transcription API
-            for chunk in audio_chunks:
-                try:
-                    # Read the chunk audio file
-                    print(f"Processing chunk: {chunk.file_path}")
-                    with open(chunk.file_path, 'rb') as audio_file:
-                        files = {'audio': ('chunk_1.mp3', audio_file, 'audio/mpeg')}
-                        headers = {
-                            'accept': 'application/json'
+# Content hashes of a page of chunks, hashing the ones chunked without one;
+# a chunk that cannot be read gets None and fails when it is sent
+async def hash_chunks(chunks):
+    hashes = []
+    for chunk in chunks:
+        content_hash = chunk.content_hash
+        if not content_hash:
+            try:
+                with stage_timer("chunk_hash"):
+                    content_hash = await asyncio.to_thread(chunk_content_hash, chunk)
+            except (OSError, ValueError) as e:
+                print(f"Could not hash chunk {chunk.chunk_id}: {e}")
+        hashes.append(content_hash)
+    return hashes
+
+# Write a batch of results in one bulk UPDATE and commit it as a checkpoint
+async def save_transcriptions(chunks, transcriptions, hashes):
+    now = datetime.now(timezone.utc)
+    async with async_session() as session:
+        with stage_timer("transcription_db_commit"):
+            async with session.begin():
+                await session.execute(
+                    update(AudioChunks),
+                    [
+                        {
+                            "chunk_id": chunk.chunk_id,
+                            "content_hash": content_hash,
+                            "transcribe": transcription,
+                            "transcription_status": (
+                                TranscriptionStatus.FAILED if transcription in FAILED_TRANSCRIPTIONS
+                                else TranscriptionStatus.DONE
+                            ),
+                            "transcribed_at": now
                         }
-                        # Send the audio file to the transcription API
-                        response = requests.post(TRANSCRIPTION_API_URL, headers=headers, files=files)
-                        response.raise_for_status()  # Raise an error for bad status codes
-
-                        # Debugging: Print raw response text to understand what is being returned
-                        print(f"Raw response: {response.text}")
-
-                        # Attempt to parse JSON response
-                        try:
-                            response_data = response.json()
-                            transcription = response_data.get('transcription', 'No transcription found')
-                        except ValueError:
-                            # If response is not JSON, handle the error
-                            print(f"Error: Response is not in JSON format. Response text: {response.text}")
-                            transcription = 'Error: Non-JSON response'
-
-                        print(f"Transcription for {chunk.file_path}: {transcription}")
-                    
-                    # Update the chunk's transcribe field
-                    chunk.transcribe = transcription
-
-                    # Update the database entry
-                    session.add(chunk)
-                except requests.exceptions.RequestException as e:
-                    print(f"Request error for chunk {chunk.file_path}: {e}")
-                    chunk.transcribe = 'Transcription failed'
-                    session.add(chunk)
-                except FileNotFoundError:
-                    print(f"File not found: {chunk.file_path}")
-                    chunk.transcribe = 'File not found'
-                    session.add(chunk)
-                except Exception as e:
-                    print(f"Error processing chunk {chunk.file_path}: {e}")
-                    chunk.transcribe = 'Error during transcription'
-                    session.add(chunk)
-            
-        await session.commit()  # Commit changes to the database
+                        for chunk, transcription, content_hash in zip(chunks, transcriptions, hashes)
+                    ]
+                )
+
+# Earlier transcriptions of the same audio, keyed by chunk content hash
+async def lookup_cached_transcriptions(content_hashes):
+    if not content_hashes:
+        return {}
+    async with async_session() as session:
+        stmt = select(AudioChunks.content_hash, AudioChunks.transcribe).where(
+            AudioChunks.content_hash.in_(content_hashes),
+            AudioChunks.transcription_status == TranscriptionStatus.DONE
+        ).distinct(AudioChunks.content_hash)
+        result = await session.execute(stmt)
+        return dict(result.all())
+
+# Transcribe a page of chunks, sending each distinct uncached audio payload once
+async def transcribe_batch(dispatcher, semaphore, chunks, hashes):
+    """Return (transcriptions in chunk order, number of API calls made); ``hashes`` are from hash_chunks."""
+    cached = await lookup_cached_transcriptions({content_hash for content_hash in hashes if content_hash})
+
+    to_send = {}
+    for chunk, content_hash in zip(chunks, hashes):
+        if content_hash not in cached:
+            to_send.setdefault(content_hash or chunk.chunk_id, chunk)
+
+    results = await asyncio.gather(
+        *(transcribe_chunk(dispatcher, semaphore, chunk) for chunk in to_send.values())
+    )
+    sent = dict(zip(to_send, results))
+
+    transcriptions = [
+        cached[content_hash] if content_hash in cached else sent[content_hash or chunk.chunk_id]
+        for chunk, content_hash in zip(chunks, hashes)
+    ]
+    return transcriptions, len(to_send)
+
+# Transcribe chunks while they are still being cut, e.g. by stream_audio
+async def transcribe_while_ingesting(ingest, concurrency=TRANSCRIPTION_CONCURRENCY,
+                                     api_urls=TRANSCRIPTION_API_URLS):
+    """Run ``ingest(on_chunk)`` and transcribe the chunks it reports as they arrive.
+
+    Returns the ingest result and a transcription summary. An ingest failure is
+    raised after the chunks registered so far have been handled.
+    """
+    ready = asyncio.Event()
+    video_uuids = set()
+
+    def on_chunk(row):
+        video_uuids.add(row["video_uuid"])
+        ready.set()
+
+    ingest_task = asyncio.create_task(ingest(on_chunk))
+    transcribed = 0
+    api_calls = 0
+    while True:
+        waiter = asyncio.create_task(ready.wait())
+        await asyncio.wait({ingest_task, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        finished = ingest_task.done()
+        ready.clear()
+        for video_uuid in video_uuids:
+            result = await transcribe_chunks(concurrency, video_uuid=video_uuid, api_urls=api_urls)
+            transcribed += result["transcribed"]
+            api_calls += result["api_calls"]
+        if finished:
+            break
+    return ingest_task.result(), {"transcribed": transcribed, "api_calls": api_calls}
+
+async def transcribe_chunks(concurrency=TRANSCRIPTION_CONCURRENCY, batch_size=TRANSCRIPTION_BATCH_SIZE,
+                            video_uuid=None, api_urls=TRANSCRIPTION_API_URLS):
+    """Transcribe every pending chunk (of one video, if given), committing every ``batch_size``.
+
+    Pending chunks are read page by page in chunk_id order, so memory stays flat
+    and a restarted run resumes after the last committed batch.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    transcribed = 0
+    api_calls = 0
+    last_id = None
+
+    async with transcription_client(concurrency) as client:
+        dispatcher = TranscriptionDispatcher(client, api_urls)
+        while True:
+            audio_chunks = await fetch_pending_chunks(last_id, batch_size, video_uuid)
+            if not audio_chunks:
+                break
+
+            # Process the batch with the transcription servers without blocking the event loop
+            hashes = await hash_chunks(audio_chunks)
+            transcriptions, calls = await transcribe_batch(dispatcher, semaphore, audio_chunks, hashes)
+            await save_transcriptions(audio_chunks, transcriptions, hashes)
+
+            transcribed += len(audio_chunks)
+            api_calls += calls
+            last_id = audio_chunks[-1].chunk_id
+            print(f"Checkpoint: {transcribed} chunks transcribed (last chunk {last_id})")
 
-    return {"message": f"Transcription completed for {len(audio_chunks)} chunks."}
+    if not transcribed:
+        print("No audio chunks found that need transcription.")
+        return {"message": "No audio chunks to transcribe.", "transcribed": 0, "api_calls": 0}
 
+    return {
+        "message": f"Transcription completed for {transcribed} chunks.",
+        "transcribed": transcribed,
+        "api_calls": api_calls
+    }
 
  
 # import random
@@ -0,0 +1,64 @@
+import re
+
+# Runs of these characters separate words in transcripts. Postgres' own
+# parser follows the database locale and drops Devanagari under C, so words
+# are split on this pattern instead, in SQL and in Python alike. Non-ASCII
+# separators are listed as whole characters rather than ranges so the pattern
+# also holds in SQL_ASCII databases, where the regex sees UTF-8 bytes; the
+# zero-width joiners used inside Devanagari conjuncts are not separators
+_ASCII_SEPARATORS = r" \t-\r!-/:-@\[-`{-~"
+_OTHER_SEPARATORS = (
+    "\u00a0\u00a1\u00ab\u00b7\u00bb\u00bf"  # No-break space and Latin-1 punctuation
+    "\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u200b"  # Spaces
+    "\u2010\u2011\u2012\u2013\u2014\u2015\u2018\u2019\u201a\u201c\u201d\u201e"  # Dashes and quotes
+    "\u2022\u2026\u2028\u2029\u202f\u2032\u2033\u2039\u203a\u205f"
+    "\u3000\u3001\u3002\u300c\u300d"  # CJK space and punctuation
+    "\u0964\u0965"  # Devanagari danda and double danda
+)
+WORD_SEPARATORS = "(?:[" + _ASCII_SEPARATORS + "]|" + "|".join(_OTHER_SEPARATORS) + ")+"
+
+# Lexemes longer than this (in bytes) are not indexed; tsvector rejects them
+_MAX_LEXEME_BYTES = 2047
+
+# Highest word position a tsvector stores
+_MAX_POSITION = 16383
+
+# Transcript -> tsvector of its words and their positions. Only ASCII letters
+# are case-folded, the same as lower_word below, so both sides always agree
+TRANSCRIPT_TSVECTOR_FUNCTION = rf"""DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'transcript_tsvector') THEN
+        CREATE FUNCTION transcript_tsvector(transcript text) RETURNS tsvector
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $fn$
+            SELECT coalesce(string_agg(
+                '''' || replace(replace(word, '\', '\\'), '''', '''''') || ''':' || position, ' '
+            ), '')::tsvector
+            FROM unnest(regexp_split_to_array(lower(transcript COLLATE "C"), '{WORD_SEPARATORS}'))
+                WITH ORDINALITY AS words(word, position)
+            WHERE word <> '' AND octet_length(word) <= {_MAX_LEXEME_BYTES} AND position <= {_MAX_POSITION}
+        $fn$;
+    END IF;
+END $$"""
+
+_SEPARATOR = re.compile(WORD_SEPARATORS)
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+def lower_word(word):
+    return word.translate(_ASCII_LOWER)
+
+
+def words(text):
+    """The indexed words of ``text``, in order."""
+    return [lower_word(word) for word in _SEPARATOR.split(text) if word]
+
+
+def word_spans(text):
+    """(start, end, indexed word) of every word of ``text``."""
+    spans, start = [], 0
+    for separator in _SEPARATOR.finditer(text):
+        if separator.start() > start:
+            spans.append((start, separator.start(), lower_word(text[start:separator.start()])))
+        start = separator.end()
+    if start < len(text):
+        spans.append((start, len(text), lower_word(text[start:])))
+    return spans
@@ -0,0 +1,205 @@
+import io
+import mmap
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+import xxhash
+from app.silence import SAMPLE_DTYPES
+from app.storage import atomic_output
+
+# Layout of the PCM payload of a WAV file
+WavInfo = namedtuple("WavInfo", ["sample_rate", "channels", "sample_width", "data_offset", "data_size"])
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+# Parse the RIFF header of a WAV file without reading the samples
+def read_wav_info(path):
+    """Return the format and payload position of a PCM WAV file."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a RIFF/WAVE file")
+
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+
+            if chunk_id == b"fmt ":
+                body = f.read(chunk_size + (chunk_size & 1))
+                fmt = struct.unpack("<HHIIHH", body[:16])
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"{path} has a data chunk before its fmt chunk")
+                format_tag, channels, sample_rate, _, block_align, bits = fmt
+                if format_tag not in (_WAVE_FORMAT_PCM, _WAVE_FORMAT_EXTENSIBLE):
+                    raise ValueError(f"{path} is not PCM encoded")
+
+                data_offset = f.tell()
+                # Streamed writers leave the size unset; trust the file length instead
+                data_size = min(chunk_size, file_size - data_offset)
+                data_size -= data_size % block_align
+                return WavInfo(sample_rate, channels, bits // 8, data_offset, data_size)
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def is_mappable(info):
+    """Whether the payload can be viewed directly as signed samples."""
+    return info.sample_width in (2, 4)
+
+
+def block_align(info):
+    return info.channels * info.sample_width
+
+
+def frame_count(info):
+    return info.data_size // block_align(info)
+
+
+def duration_ms(info):
+    return int(frame_count(info) * 1000 / info.sample_rate)
+
+
+def ms_to_frame(info, ms):
+    return min(int(ms * info.sample_rate / 1000), frame_count(info))
+
+
+# Memory-map the samples so only the pages being read are resident
+def open_samples(path, info):
+    """Return the interleaved samples of a WAV file as a read-only memmap."""
+    if info.data_size == 0:
+        return np.zeros(0, dtype=SAMPLE_DTYPES[info.sample_width])
+    return np.memmap(
+        path,
+        dtype=SAMPLE_DTYPES[info.sample_width],
+        mode="r",
+        offset=info.data_offset,
+        shape=(info.data_size // info.sample_width,)
+    )
+
+
+def wav_header(sample_rate, channels, sample_width, data_size):
+    """Build a 44-byte canonical PCM WAV header for ``data_size`` bytes of samples."""
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, _WAVE_FORMAT_PCM, channels, sample_rate,
+        sample_rate * block_align, block_align, sample_width * 8,
+        b"data", data_size
+    )
+
+
+# Raw payload bytes, for copying slices regardless of sample width
+def open_payload(path, info):
+    """Return the PCM payload of a WAV file as a read-only byte memmap."""
+    if info.data_size == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode="r", offset=info.data_offset, shape=(info.data_size,))
+
+
+# Hash of the PCM payload between two sample offsets; header differences don't matter
+def payload_hash(info, payload, start_sample=0, end_sample=None, block_size=1 << 24):
+    """Return the xxh3-128 hex digest of frames [start_sample, end_sample)."""
+    align = block_align(info)
+    end_sample = frame_count(info) if end_sample is None else end_sample
+    view = payload[start_sample * align:end_sample * align]
+    digest = xxhash.xxh3_128()
+    for offset in range(0, len(view), block_size):
+        digest.update(memoryview(view[offset:offset + block_size]))
+    return digest.hexdigest()
+
+
+def file_content_hash(path):
+    """Hash the PCM payload of a WAV file, or the raw bytes of any other file."""
+    try:
+        info = read_wav_info(path)
+    except ValueError:
+        digest = xxhash.xxh3_128()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    return payload_hash(info, open_payload(path, info))
+
+
+# Write the frames between two sample offsets as a standalone WAV file
+def write_wav_frames(path, info, payload, start_sample, end_sample):
+    """Export frames [start_sample, end_sample) straight from the mapped payload."""
+    align = block_align(info)
+    view = memoryview(payload[start_sample * align:end_sample * align])
+    with atomic_output(path) as temporary, open(temporary, "wb") as f:
+        f.write(wav_header(info.sample_rate, info.channels, info.sample_width, len(view)))
+        f.write(view)
+    return path
+
+
+# File-like view of a frame range of a WAV file with a synthesized header
+class WavSlice(io.RawIOBase):
+    """Read frames [start_sample, end_sample) of ``path`` as a complete WAV file.
+
+    The payload is served from a memory map of the parent file, so nothing is
+    copied until the caller reads it.
+    """
+
+    def __init__(self, path, start_sample, end_sample):
+        super().__init__()
+        info = read_wav_info(path)
+        align = block_align(info)
+        start = info.data_offset + min(start_sample, frame_count(info)) * align
+        end = info.data_offset + min(end_sample, frame_count(info)) * align
+
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._payload = memoryview(self._map)[start:max(start, end)]
+        self._header = wav_header(info.sample_rate, info.channels, info.sample_width, len(self._payload))
+        self._position = 0
+
+    def __len__(self):
+        return len(self._header) + len(self._payload)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self)
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        out = memoryview(buffer).cast("B")
+        written = 0
+        header_size = len(self._header)
+        while written < len(out) and self._position < len(self):
+            if self._position < header_size:
+                source = self._header[self._position:]
+            else:
+                source = self._payload[self._position - header_size:]
+            count = min(len(out) - written, len(source))
+            out[written:written + count] = source[:count]
+            written += count
+            self._position += count
+        return written
+
+    def close(self):
+        if not self.closed:
+            self._payload.release()
+            self._map.close()
+            self._file.close()
+        super().close()
@@ -0,0 +1,124 @@
+# Queue worker for one pipeline stage.
+#
+#   python -m app.worker --stage chunk --concurrency 4 --metrics-port 9101
+import argparse
+import asyncio
+import os
+import traceback
+from prometheus_client import start_http_server
+from fastapi import HTTPException
+from app.audio_download import download_audio
+from app.audio_chunker import audio_chunker
+from app.transcribe import transcribe_chunks
+from app.chunk_encoding import chunk_profile
+from app.silence import segment_params
+from app.database import create_tables, upgrade_schema
+from app.core.config import CHUNK_OUTPUT
+from app.jobs import STAGES, claim_job, complete_job, fail_job, heartbeat_job, requeue_stale_jobs
+
+# Seconds to wait before polling again when the queue is empty
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+
+# A running job without a heartbeat for this long is handed to another worker
+LEASE_SECONDS = int(os.getenv("WORKER_LEASE_SECONDS", "300"))
+
+
+# Raised by a handler when retrying the job cannot help
+class PermanentJobError(Exception):
+    pass
+
+
+async def run_download(payload):
+    try:
+        result = await download_audio(
+            query=payload["query"],
+            is_url=payload.get("is_url", False),
+            use_sample_rate_16000=payload.get("use_sample_rate_16000", False)
+        )
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise PermanentJobError(e.detail)
+        raise
+    return result, "chunk", [{"uuid": result["uuid"], "materialize": payload.get("materialize", False)}]
+
+
+async def run_chunk(payload):
+    profile = chunk_profile(**payload.get("profile", {}))
+    segmentation = segment_params(**payload.get("segmentation", {}))
+    result = await audio_chunker(payload["uuid"], CHUNK_OUTPUT, materialize=payload.get("materialize", False),
+                                 profile=profile, segmentation=segmentation)
+    if "error" in result:
+        raise PermanentJobError(result["error"])
+    # A resumed run may have nothing left to cut, but its earlier chunks still need transcribing
+    next_jobs = [{"video_uuid": payload["uuid"]}] if result["chunks"] or result["resumed_from"] else []
+    return {"uuid": payload["uuid"], "chunks": len(result["chunks"])}, "transcribe", next_jobs
+
+
+async def run_transcribe(payload):
+    result = await transcribe_chunks(video_uuid=payload.get("video_uuid"))
+    return result, None, []
+
+
+HANDLERS = {
+    "download": run_download,
+    "chunk": run_chunk,
+    "transcribe": run_transcribe,
+}
+
+
+async def _heartbeat(job_id):
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        await heartbeat_job(job_id)
+
+
+# Run a claimed job and record its outcome, queueing the next stage on success
+async def run_job(job):
+    heartbeat = asyncio.create_task(_heartbeat(job.id))
+    try:
+        result, next_stage, next_payloads = await HANDLERS[job.stage](job.payload)
+        await complete_job(job.id, result, next_stage, next_payloads)
+        print(f"Job {job.id} ({job.stage}) done")
+    except PermanentJobError as e:
+        print(f"Job {job.id} ({job.stage}) failed: {e}")
+        await fail_job(job.id, str(e), retry=False)
+    except Exception as e:
+        traceback.print_exc()
+        await fail_job(job.id, f"{type(e).__name__}: {e}")
+    finally:
+        heartbeat.cancel()
+
+
+async def work(stage):
+    while True:
+        job = await claim_job(stage)
+        if job is None:
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        await run_job(job)
+
+
+async def reap(stage):
+    while True:
+        requeued = await requeue_stale_jobs(stage, LEASE_SECONDS)
+        if requeued:
+            print(f"Requeued {requeued} stale {stage} jobs")
+        await asyncio.sleep(LEASE_SECONDS)
+
+
+async def main(stage, concurrency):
+    await create_tables()
+    await upgrade_schema()
+    print(f"Worker started for stage '{stage}' with {concurrency} slots")
+    await asyncio.gather(reap(stage), *(work(stage) for _ in range(concurrency)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipeline queue worker")
+    parser.add_argument("--stage", choices=STAGES, required=True)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    args = parser.parse_args()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    asyncio.run(main(args.stage, args.concurrency))
@@ -0,0 +1,67 @@
+# Compare the vectorized silence detector against the pydub implementation.
+#
+#   python -m benchmarks.bench_silence --minutes 60
+import argparse
+import time
+from pydub.silence import detect_nonsilent, split_on_silence
+from app.silence import samples_from_bytes, frame_power, frame_length, chunk_ranges
+from benchmarks.fixtures import synthetic_segment
+
+SILENCE_THRESH = -40
+MIN_SILENCE_LEN = 1000
+MIN_CHUNK_LEN = 5 * 1000
+MAX_CHUNK_LEN = 18 * 1000
+
+
+# The chunk boundaries split_audio_with_silence produced before the numpy engine
+def pydub_ranges(audio):
+    ranges = []
+    nonsilent = detect_nonsilent(audio, min_silence_len=MIN_SILENCE_LEN, silence_thresh=SILENCE_THRESH, seek_step=100)
+    for start, end in nonsilent:
+        length = end - start
+        if MIN_CHUNK_LEN <= length <= MAX_CHUNK_LEN:
+            ranges.append((start, end))
+        elif length > MAX_CHUNK_LEN:
+            pieces = split_on_silence(audio[start:end], min_silence_len=MIN_SILENCE_LEN,
+                                      silence_thresh=SILENCE_THRESH, keep_silence=500)
+            ranges.extend((None, len(piece)) for piece in pieces
+                          if MIN_CHUNK_LEN <= len(piece) <= MAX_CHUNK_LEN)
+    return ranges
+
+
+def numpy_ranges(audio):
+    samples = samples_from_bytes(audio.raw_data, audio.sample_width)
+    power = frame_power(samples, audio.channels, audio.sample_width, frame_length(audio.frame_rate))
+    return chunk_ranges(power, duration_ms=len(audio), silence_thresh=SILENCE_THRESH,
+                        min_silence_len=MIN_SILENCE_LEN, min_chunk_len=MIN_CHUNK_LEN,
+                        max_chunk_len=MAX_CHUNK_LEN, strategy="silence")
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--skip-pydub", action="store_true", help="Only time the numpy engine")
+    args = parser.parse_args()
+
+    audio = synthetic_segment(args.minutes * 60, args.sample_rate, args.channels)
+    print(f"Input: {args.minutes:g} min, {args.sample_rate} Hz, {args.channels} ch")
+
+    fast, fast_time = timed(numpy_ranges, audio)
+    print(f"numpy: {len(fast)} chunks in {fast_time:.2f}s")
+
+    if not args.skip_pydub:
+        slow, slow_time = timed(pydub_ranges, audio)
+        print(f"pydub: {len(slow)} chunks in {slow_time:.2f}s")
+        print(f"speedup: {slow_time / fast_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
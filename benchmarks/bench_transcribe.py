@@ -0,0 +1,45 @@
+# Measure transcription throughput against a local stand-in server.
+#
+#   python -m benchmarks.fake_transcription_server --latency 0.5 &
+#   python -m benchmarks.bench_transcribe --chunks 200 --concurrency 1 4 16
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from app.transcribe import transcribe_many
+from benchmarks.fixtures import write_wav
+
+
+def fake_chunks(count, directory, seconds=10):
+    path = write_wav(os.path.join(directory, "chunk.wav"), seconds, sample_rate=16000, channels=1)
+    return [SimpleNamespace(chunk_id=str(i), file_path=path, source_path=None) for i in range(count)]
+
+
+async def run(chunks, concurrency, api_urls):
+    started = time.perf_counter()
+    results = await transcribe_many(chunks, concurrency, api_urls)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for text in results if not text.startswith("chunk_"))
+    return elapsed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcription throughput benchmark")
+    parser.add_argument("--url", nargs="+", default=["http://127.0.0.1:8028/transcribe/"],
+                        help="Transcription servers; requests are spread across all of them")
+    parser.add_argument("--chunks", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        chunks = fake_chunks(args.chunks, directory)
+        for concurrency in args.concurrency:
+            elapsed, failed = asyncio.run(run(chunks, concurrency, args.url))
+            print(f"concurrency={concurrency}: {len(chunks) / elapsed:.1f} chunks/s "
+                  f"({elapsed:.2f}s, {failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# Local stand-in for the transcription API, for offline concurrency tests.
+#
+#   python -m benchmarks.fake_transcription_server --port 8028 --latency 0.5 --capacity 16
+#   python -m benchmarks.fake_transcription_server --port 8028 --instances 3 --failure-rate 0.05
+#
+# With --instances N the servers listen on consecutive ports from --port. Each
+# one's behaviour can be changed while it runs, e.g. to make it hang or fail:
+#
+#   curl -X POST localhost:8029/control -H 'content-type: application/json' -d '{"failure_rate": 1}'
+import argparse
+import asyncio
+import os
+import random
+from fastapi import Body, FastAPI, File, HTTPException, UploadFile
+import uvicorn
+
+# Simulated inference time per request and number of requests served at once
+LATENCY = float(os.getenv("FAKE_TRANSCRIPTION_LATENCY", "0.2"))
+CAPACITY = int(os.getenv("FAKE_TRANSCRIPTION_CAPACITY", "16"))
+
+# Share of requests answered with a 503, and share that take TAIL_LATENCY instead of LATENCY
+FAILURE_RATE = float(os.getenv("FAKE_TRANSCRIPTION_FAILURE_RATE", "0"))
+TAIL_RATE = float(os.getenv("FAKE_TRANSCRIPTION_TAIL_RATE", "0"))
+TAIL_LATENCY = float(os.getenv("FAKE_TRANSCRIPTION_TAIL_LATENCY", "5"))
+
+# Settings that POST /control may change
+_CONTROLS = ("latency", "failure_rate", "tail_rate", "tail_latency")
+
+
+def create_app(latency=LATENCY, capacity=CAPACITY, failure_rate=FAILURE_RATE, tail_rate=TAIL_RATE,
+               tail_latency=TAIL_LATENCY, seed=0):
+    app = FastAPI()
+    slots = asyncio.Semaphore(capacity)
+    rng = random.Random(seed)
+    settings = {"latency": latency, "failure_rate": failure_rate, "tail_rate": tail_rate,
+                "tail_latency": tail_latency}
+    stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "bytes": 0, "failures": 0, "tail": 0}
+
+    @app.post("/transcribe/")
+    async def transcribe(audio: UploadFile = File(...)):
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        try:
+            size = len(await audio.read())
+            stats["bytes"] += size
+            delay = settings["latency"]
+            if rng.random() < settings["tail_rate"]:
+                stats["tail"] += 1
+                delay = settings["tail_latency"]
+            async with slots:
+                await asyncio.sleep(delay)
+            if rng.random() < settings["failure_rate"]:
+                stats["failures"] += 1
+                raise HTTPException(status_code=503, detail="Injected failure")
+            return {"transcription": f"{audio.filename} ({size} bytes)"}
+        finally:
+            stats["in_flight"] -= 1
+
+    @app.get("/stats")
+    async def get_stats():
+        return dict(stats, **settings)
+
+    @app.post("/control")
+    async def control(changes: dict = Body(...)):
+        unknown = set(changes) - set(_CONTROLS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown settings: {', '.join(sorted(unknown))}")
+        settings.update({key: float(value) for key, value in changes.items()})
+        return settings
+
+    return app
+
+
+async def serve(apps, host, port):
+    servers = [
+        uvicorn.Server(uvicorn.Config(app, host=host, port=port + offset, log_level="warning"))
+        for offset, app in enumerate(apps)
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake transcription server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8028)
+    parser.add_argument("--instances", type=int, default=1, help="Servers to run, on consecutive ports")
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    parser.add_argument("--capacity", type=int, default=CAPACITY)
+    parser.add_argument("--failure-rate", type=float, default=FAILURE_RATE)
+    parser.add_argument("--tail-rate", type=float, default=TAIL_RATE)
+    parser.add_argument("--tail-latency", type=float, default=TAIL_LATENCY)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    apps = [
+        create_app(args.latency, args.capacity, args.failure_rate, args.tail_rate, args.tail_latency,
+                   seed=args.seed + instance)
+        for instance in range(args.instances)
+    ]
+    asyncio.run(serve(apps, args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
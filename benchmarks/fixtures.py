@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pydub import AudioSegment
+
+# Speech and silence length ranges (seconds) for the synthetic fixtures
+SILENCE_PATTERNS = {
+    # Sentences of ordinary length with pauses between them
+    "speech": {"speech_range": (2.0, 25.0), "silence_range": (0.3, 2.5)},
+    # Short utterances and long gaps, as in interviews or call recordings
+    "sparse": {"speech_range": (0.5, 4.0), "silence_range": (1.0, 6.0)},
+    # Long monologues with rare pauses, which force splits inside speech
+    "continuous": {"speech_range": (20.0, 90.0), "silence_range": (0.2, 1.2)},
+}
+
+# Generate speech-like audio: bursts of modulated noise separated by silences
+def synthetic_speech(duration_sec, sample_rate=44100, channels=2, speech_range=(2.0, 25.0),
+                     silence_range=(0.3, 2.5), seed=0):
+    """Return int16 interleaved samples alternating speech bursts and silences."""
+    rng = np.random.default_rng(seed)
+    total = int(duration_sec * sample_rate)
+    mono = np.zeros(total, dtype=np.float32)
+
+    position = 0
+    while position < total:
+        speech = int(rng.uniform(*speech_range) * sample_rate)
+        end = min(position + speech, total)
+        t = np.arange(end - position, dtype=np.float32) / sample_rate
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(2, 6) * t)
+        mono[position:end] = rng.normal(0, 0.2, end - position).astype(np.float32) * envelope
+        position = end + int(rng.uniform(*silence_range) * sample_rate)
+
+    mono += rng.normal(0, 0.001, total).astype(np.float32)
+    pcm = (np.clip(mono, -1, 1) * 32767).astype(np.int16)
+    return np.repeat(pcm, channels) if channels > 1 else pcm
+
+
+def synthetic_segment(duration_sec, sample_rate=44100, channels=2, seed=0, pattern="speech"):
+    """Wrap synthetic samples in a pydub AudioSegment."""
+    samples = synthetic_speech(duration_sec, sample_rate, channels, seed=seed, **SILENCE_PATTERNS[pattern])
+    return AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=channels)
+
+
+def write_wav(path, duration_sec, sample_rate=44100, channels=2, seed=0, pattern="speech"):
+    """Write a synthetic fixture WAV to ``path`` and return the path."""
+    synthetic_segment(duration_sec, sample_rate, channels, seed, pattern).export(path, format="wav")
+    return path
+
+
+def write_dataset(directory, rows, seed=0):
+    """Write a Parquet dataset that ``datasets.load_dataset(directory)`` can stream."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    table = pa.table({
+        "text": [f"transcript {i}" for i in range(rows)],
+        "duration": rng.uniform(5, 18, rows),
+        "speaker": rng.integers(0, 1000, rows),
+        "verified": rng.random(rows) < 0.5,
+    })
+    pq.write_table(table, os.path.join(directory, "train-00000.parquet"))
+    return directory
+
+
+# Words of synthetic transcripts, English and Nepali; numbered variants make up
+# the long tail of a realistic vocabulary
+_BASE_WORDS = (
+    "the", "budget", "government", "said", "today", "people", "year", "new", "water", "school",
+    "नेपाल", "सरकार", "बजेट", "आज", "भन्नुभयो", "मानिस", "वर्ष", "नयाँ", "पानी", "विद्यालय",
+)
+VOCABULARY_SIZE = 50000
+
+
+def vocabulary_word(rank):
+    """The word of a given frequency rank (0 is the most common)."""
+    base = _BASE_WORDS[rank % len(_BASE_WORDS)]
+    return base if rank < len(_BASE_WORDS) else f"{base}{rank // len(_BASE_WORDS)}"
+
+
+def synthetic_transcripts(count, words_per_chunk=25, seed=0):
+    """Return ``count`` transcripts whose word frequencies fall off like natural text."""
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(1.3, (count, words_per_chunk)) - 1, VOCABULARY_SIZE - 1)
+    return [" ".join(vocabulary_word(rank) for rank in row) for row in ranks]
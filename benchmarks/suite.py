@@ -0,0 +1,590 @@
+# Reproducible benchmark suite for chunking, transcription and database ingestion.
+#
+#   python -m benchmarks.suite run --output results.json
+#   python -m benchmarks.suite check baseline.json results.json --threshold 0.15
+#
+# Fixtures are synthetic and seeded, so two runs on the same machine measure the
+# same work. The database benchmarks write to the Postgres configured in
+# app.core.config and remove what they wrote; --skip-db leaves them out.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+import httpx
+import numpy as np
+from benchmarks.fixtures import (
+    SILENCE_PATTERNS, synthetic_speech, write_wav, write_dataset, synthetic_transcripts, vocabulary_word
+)
+
+# Metrics where a larger value is better and where a smaller one is; anything
+# else (chunk counts, for example) is reported but never fails a check
+HIGHER_IS_BETTER = {"audio_minutes_per_second", "chunks_per_second", "rows_per_second", "speech_coverage"}
+LOWER_IS_BETTER = {"wall_seconds", "peak_rss_mb", "peak_traced_mb", "first_byte_seconds"}
+
+CHUNKERS = ("split_audio_with_silence", "split_audio_streaming")
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Runs in a fresh process so its peak RSS belongs to this chunker alone
+def _run_chunker(chunker, audio_file, output_dir):
+    from app import audio_chunker
+
+    started = time.perf_counter()
+    if chunker == "split_audio_streaming":
+        chunks = audio_chunker.split_audio_streaming(audio_file, output_dir, materialize=True)
+    else:
+        chunks = audio_chunker.split_audio_with_silence(audio_file, output_dir)
+    return {"wall_seconds": time.perf_counter() - started, "peak_rss_mb": _peak_rss_mb(), "chunks": len(chunks)}
+
+
+def bench_chunking(directory, minutes, sample_rate, channels, patterns, repeat):
+    results = {}
+    context = get_context("spawn")
+    for pattern in patterns:
+        audio_file = write_wav(
+            os.path.join(directory, f"{pattern}.wav"), minutes * 60, sample_rate, channels, pattern=pattern
+        )
+        for chunker in CHUNKERS:
+            runs = []
+            for attempt in range(repeat):
+                output_dir = os.path.join(directory, f"{chunker}-{pattern}-{attempt}")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    runs.append(pool.submit(_run_chunker, chunker, audio_file, output_dir).result())
+
+            wall = statistics.median(run["wall_seconds"] for run in runs)
+            chunks = runs[0]["chunks"]
+            results[f"chunking.{chunker}.{pattern}"] = {
+                "wall_seconds": wall,
+                "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+                "chunks": chunks,
+                "chunks_per_audio_minute": chunks / minutes,
+                "audio_minutes_per_second": minutes / wall,
+            }
+            print(f"chunking {chunker} [{pattern}]: {wall:.2f}s, {chunks} chunks")
+    return results
+
+
+# How much of the audible audio each segmentation strategy puts into chunks
+def bench_segmentation(minutes, sample_rate, patterns):
+    from app.silence import frame_power, frame_length, downsample_power, dbfs_to_power, chunk_ranges
+
+    results = {}
+    for pattern in patterns:
+        samples = synthetic_speech(minutes * 60, sample_rate, channels=1, **SILENCE_PATTERNS[pattern])
+        power = frame_power(samples, 1, 2, frame_length(sample_rate))
+        # Audible 100 ms frames, at the default silence threshold
+        audible = downsample_power(power, 10) > dbfs_to_power(-40)
+        for strategy in ("silence", "pack"):
+            started = time.perf_counter()
+            ranges = chunk_ranges(power, strategy=strategy)
+            wall = time.perf_counter() - started
+
+            covered = np.zeros(len(audible), dtype=bool)
+            for start, end in ranges:
+                covered[start // 100:end // 100] = True
+            coverage = (covered & audible).sum() / max(1, audible.sum())
+            results[f"segmentation.{strategy}.{pattern}"] = {
+                "wall_seconds": wall,
+                "chunks": len(ranges),
+                "speech_coverage": float(coverage),
+                "mean_chunk_seconds": sum(end - start for start, end in ranges) / max(1, len(ranges)) / 1000,
+            }
+            print(f"segmentation {strategy} [{pattern}]: {len(ranges)} chunks, {coverage:.1%} of speech covered")
+    return results
+
+
+# Boundaries for new parameters, from the audio and from a stored envelope index
+def bench_rechunk(directory, minutes, sample_rate, channels, patterns):
+    from app.envelope import compute_envelope, save_envelope, load_envelope
+    from app.silence import chunk_ranges
+    from app.wavfile import read_wav_info
+
+    results = {}
+    for pattern in patterns:
+        audio_file = os.path.join(directory, f"{pattern}.wav")
+        if not os.path.exists(audio_file):
+            write_wav(audio_file, minutes * 60, sample_rate, channels, pattern=pattern)
+        info = read_wav_info(audio_file)
+        index_file = save_envelope(os.path.join(directory, f"{pattern}.envelope.npy"),
+                                   compute_envelope(audio_file, info))
+
+        for source in ("decode", "index"):
+            started = time.perf_counter()
+            power = compute_envelope(audio_file, info) if source == "decode" else load_envelope(index_file)
+            chunks = len(chunk_ranges(power, max_chunk_len=12000))
+            wall = time.perf_counter() - started
+            results[f"rechunk.{source}.{pattern}"] = {
+                "wall_seconds": wall,
+                "chunks": chunks,
+                "audio_minutes_per_second": minutes / wall,
+            }
+            print(f"rechunk from {source} [{pattern}]: {wall:.3f}s, {chunks} chunks")
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Consecutive free ports, as the stand-in server listens on --port and the ones after it
+def _free_ports(count):
+    while True:
+        first = _free_port()
+        try:
+            for port in range(first + 1, first + count):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", port))
+        except OSError:
+            continue
+        return list(range(first, first + count))
+
+
+# Start the stand-in transcription servers and wait until they answer; returns
+# the process and the base URL of each instance
+def _start_transcription_server(latency, capacity, instances=1, extra_args=()):
+    ports = _free_ports(instances)
+    server = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_transcription_server", "--port", str(ports[0]),
+        "--instances", str(instances), "--latency", str(latency), "--capacity", str(capacity), *extra_args
+    ])
+    base_urls = [f"http://127.0.0.1:{port}" for port in ports]
+    for _ in range(100):
+        try:
+            for base_url in base_urls:
+                httpx.get(f"{base_url}/stats")
+            return server, base_urls
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("The stand-in transcription server did not start")
+
+
+# A video row to hang benchmark chunks on; deleted again with delete_bench_video
+async def create_bench_video(location):
+    from app.database import async_session
+    from app.models import Download_videos
+
+    async with async_session() as session:
+        async with session.begin():
+            video = Download_videos(
+                uuid=f"bench-{uuid.uuid4()}", video_name="benchmark", location=location, meta_data={}
+            )
+            session.add(video)
+        return video.id, video.uuid
+
+
+async def delete_bench_video(video_id):
+    from sqlalchemy import delete
+    from app.database import async_session
+    from app.models import Download_videos, AudioChunks
+
+    async with async_session() as session:
+        async with session.begin():
+            await session.execute(delete(AudioChunks).where(AudioChunks.video_id == video_id))
+            await session.execute(delete(Download_videos).where(Download_videos.id == video_id))
+
+
+def _virtual_chunks(source_path, count, frames):
+    return [
+        {"file_path": None, "source_path": source_path, "start_sample": i * frames,
+         "end_sample": (i + 1) * frames, "content_hash": None}
+        for i in range(count)
+    ]
+
+
+# save_chunk_batch arguments that finish a bench video with exactly ``chunks``
+def _finished(video_id, video_uuid, chunks):
+    from app.models import chunk_id_for
+
+    chunk_ids = [chunk_id_for(video_uuid, chunk["start_sample"]) for chunk in chunks]
+    return {video_id: {"resume_from": 0, "chunk_ids": chunk_ids, "envelope_file": None, "duration": None,
+                       "sample_rate": None}}
+
+
+async def bench_transcription(directory, count, seconds, latency, capacity, concurrency):
+    from app.audio_chunker import save_chunk_batch
+    from app.transcribe import transcribe_chunks
+
+    sample_rate = 16000
+    source = write_wav(os.path.join(directory, "transcribe.wav"), count * seconds, sample_rate, channels=1)
+    server, (base_url,) = _start_transcription_server(latency, capacity)
+    video_id, video_uuid = await create_bench_video(source)
+    try:
+        chunks = _virtual_chunks(source, count, seconds * sample_rate)
+        rows = [dict(chunk, video_id=video_id, video_uuid=video_uuid) for chunk in chunks]
+        await save_chunk_batch(rows, [video_id], _finished(video_id, video_uuid, chunks))
+
+        started = time.perf_counter()
+        result = await transcribe_chunks(concurrency, video_uuid=video_uuid, api_urls=[f"{base_url}/transcribe/"])
+        wall = time.perf_counter() - started
+    finally:
+        await delete_bench_video(video_id)
+        server.terminate()
+        server.wait()
+
+    print(f"transcribe_chunks: {count / wall:.1f} chunks/s at concurrency {concurrency}")
+    return {"transcription.transcribe_chunks": {
+        "wall_seconds": wall,
+        "chunks_per_second": result["transcribed"] / wall,
+        "api_calls": result["api_calls"],
+        "latency_seconds": latency,
+        "concurrency": concurrency,
+    }}
+
+
+# Three stand-in servers: one healthy, one with a slow tail and one that fails
+# every request; with a single server the slow one would set the pace
+async def bench_dispatch(directory, count, latency, concurrency):
+    from app.transcribe import transcribe_many
+
+    path = write_wav(os.path.join(directory, "dispatch.wav"), 5, 16000, channels=1)
+    chunks = [SimpleNamespace(chunk_id=str(i), file_path=path, source_path=None) for i in range(count)]
+    server, base_urls = _start_transcription_server(latency, 64, instances=3)
+    try:
+        httpx.post(f"{base_urls[1]}/control", json={"tail_rate": 0.1, "tail_latency": 20 * latency})
+        httpx.post(f"{base_urls[2]}/control", json={"failure_rate": 1})
+        started = time.perf_counter()
+        results = await transcribe_many(chunks, concurrency, [f"{url}/transcribe/" for url in base_urls])
+        wall = time.perf_counter() - started
+        served = [httpx.get(f"{url}/stats").json()["requests"] for url in base_urls]
+    finally:
+        server.terminate()
+        server.wait()
+
+    failed = sum(1 for text in results if not text.startswith("dispatch"))
+    print(f"dispatch: {count / wall:.1f} chunks/s, {failed} failed, requests per server {served}")
+    return {"transcription.dispatch": {
+        "wall_seconds": wall,
+        "chunks_per_second": count / wall,
+        "failed": failed,
+        "requests_per_server": served,
+    }}
+
+
+async def bench_save_chunks(directory, count):
+    from app.audio_chunker import save_chunks_to_db, save_chunk_batch
+
+    source = os.path.join(directory, "save_chunks.wav")
+    results = {}
+    for name in ("save_chunks_to_db", "save_chunk_batch"):
+        video_id, video_uuid = await create_bench_video(f"{source}#{name}")
+        try:
+            chunks = _virtual_chunks(source, count, 16000)
+            started = time.perf_counter()
+            if name == "save_chunks_to_db":
+                await save_chunks_to_db(video_uuid, video_id, chunks)
+            else:
+                await save_chunk_batch(
+                    [dict(chunk, video_id=video_id, video_uuid=video_uuid) for chunk in chunks], [video_id],
+                    _finished(video_id, video_uuid, chunks)
+                )
+            wall = time.perf_counter() - started
+        finally:
+            await delete_bench_video(video_id)
+        results[f"database.{name}"] = {"wall_seconds": wall, "rows_per_second": count / wall}
+        print(f"{name}: {count / wall:.0f} rows/s")
+    return results
+
+
+# Give a bench video ``rows`` transcribed chunks
+async def insert_bench_transcripts(video_id, video_uuid, rows, batch_size=10000):
+    from sqlalchemy import insert
+    from app.database import async_session
+    from app.models import AudioChunks, TranscriptionStatus
+
+    for first in range(0, rows, batch_size):
+        transcripts = synthetic_transcripts(min(batch_size, rows - first), seed=first)
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(insert(AudioChunks), [
+                    {"chunk_id": str(uuid.uuid4()), "video_id": video_id, "video_uuid": video_uuid,
+                     "start_sample": i * 160000, "end_sample": (i + 1) * 160000,
+                     "transcribe": transcript, "transcription_status": TranscriptionStatus.DONE}
+                    for i, transcript in enumerate(transcripts)
+                ])
+
+
+# Query latency of transcript search over ``rows`` indexed chunks, by kind of query
+async def bench_search(directory, rows, repeat=20):
+    from sqlalchemy import text
+    from app.database import engine
+    from app.search import search_transcripts
+
+    queries = {
+        "common": vocabulary_word(0),
+        "frequent": vocabulary_word(150),
+        "rare": vocabulary_word(20000),
+        "phrase": f'"{vocabulary_word(0)} {vocabulary_word(1)}"',
+        "prefix": vocabulary_word(11) + "*",
+        "devanagari": f"{vocabulary_word(10)} {vocabulary_word(12)}",
+    }
+    video_id, video_uuid = await create_bench_video(os.path.join(directory, "search.wav"))
+    results = {}
+    try:
+        started = time.perf_counter()
+        await insert_bench_transcripts(video_id, video_uuid, rows)
+        wall = time.perf_counter() - started
+        results["search.index"] = {"wall_seconds": wall, "rows_per_second": rows / wall}
+        print(f"search index: {rows / wall:.0f} transcripts/s")
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE audio_chunks"))
+
+        for kind, query in queries.items():
+            latencies = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                hits = len((await search_transcripts(query))["hits"])
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            results[f"search.{kind}"] = {
+                "wall_seconds": statistics.median(latencies),
+                "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))],
+                "hits": hits,
+            }
+            print(f"search {kind} [{query}]: {1000 * statistics.median(latencies):.1f} ms median, {hits} hits")
+    finally:
+        await delete_bench_video(video_id)
+    return results
+
+
+# Python memory held while a function runs, in MB
+async def _traced_peak_mb(coroutine):
+    tracemalloc.start()
+    try:
+        result = await coroutine
+        return result, tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+# Streaming NDJSON transcript export of ``rows`` chunks against reading them all into a DataFrame
+async def bench_transcript_export(directory, rows):
+    from app.database import fetch_data
+    from app.listing import stream_transcripts, ndjson_export
+
+    async def stream():
+        started = time.perf_counter()
+        first_byte, size = None, 0
+        async for piece in ndjson_export(stream_transcripts(video_uuid=video_uuid)):
+            first_byte = first_byte or time.perf_counter() - started
+            size += len(piece.encode())
+        return first_byte, size
+
+    async def materialize():
+        return len(await fetch_data("audio_chunks"))
+
+    video_id, video_uuid = await create_bench_video(os.path.join(directory, "export.wav"))
+    results = {}
+    try:
+        await insert_bench_transcripts(video_id, video_uuid, rows)
+        for name, export in (("stream", stream), ("dataframe", materialize)):
+            started = time.perf_counter()
+            outcome, peak = await _traced_peak_mb(export())
+            results[f"transcript_export.{name}"] = {
+                "wall_seconds": time.perf_counter() - started, "peak_traced_mb": peak, "rows": rows
+            }
+            if name == "stream":
+                results[f"transcript_export.{name}"].update(first_byte_seconds=outcome[0], bytes=outcome[1])
+            print(f"transcript export {name}: {results[f'transcript_export.{name}']['wall_seconds']:.2f}s, "
+                  f"peak {peak:.0f} MB traced")
+    finally:
+        await delete_bench_video(video_id)
+    return results
+
+
+async def bench_dataset_ingest(directory, rows):
+    from sqlalchemy import text
+    from app.database import engine
+    from app.huggingface_handler import insert_data_to_postgres
+
+    table_name = "bench_dataset_ingest"
+    dataset = write_dataset(os.path.join(directory, "dataset"), rows)
+    drop = text(f'DROP TABLE IF EXISTS "{table_name}"')
+    async with engine.begin() as conn:
+        await conn.execute(drop)
+    try:
+        started = time.perf_counter()
+        await insert_data_to_postgres(dataset, table_name)
+        wall = time.perf_counter() - started
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(drop)
+
+    print(f"insert_data_to_postgres: {rows / wall:.0f} rows/s")
+    return {"database.insert_data_to_postgres": {"wall_seconds": wall, "rows_per_second": rows / wall}}
+
+
+# Claim throughput of the job queue with ``workers`` competing claimers; its
+# guarantees are checked by tests/test_jobs.py
+async def bench_job_queue(jobs, workers):
+    from sqlalchemy import delete
+    from app.database import async_session
+    from app.models import Jobs
+    from app.jobs import enqueue_jobs, claim_job
+
+    # A stage of its own keeps real workers away from these jobs
+    stage = f"bench-{uuid.uuid4()}"
+
+    async def drain():
+        claimed = 0
+        while await claim_job(stage) is not None:
+            claimed += 1
+        return claimed
+
+    try:
+        await enqueue_jobs(stage, [{"n": i} for i in range(jobs)])
+        started = time.perf_counter()
+        claims = sum(await asyncio.gather(*(drain() for _ in range(workers))))
+        wall = time.perf_counter() - started
+    finally:
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(delete(Jobs).where(Jobs.stage == stage))
+
+    print(f"job queue: {claims / wall:.0f} claims/s across {workers} workers")
+    return {"database.job_queue": {"wall_seconds": wall, "rows_per_second": claims / wall, "workers": workers}}
+
+
+async def run_database_benchmarks(directory, args):
+    from app.database import create_tables, upgrade_schema, engine
+
+    await create_tables()
+    await upgrade_schema()
+    results = {}
+    try:
+        results.update(await bench_transcription(
+            directory, args.transcribe_chunks, args.chunk_seconds, args.latency, args.capacity, args.concurrency
+        ))
+        results.update(await bench_save_chunks(directory, args.save_rows))
+        results.update(await bench_job_queue(args.queue_jobs, args.concurrency))
+        results.update(await bench_dataset_ingest(directory, args.dataset_rows))
+        results.update(await bench_search(directory, args.search_rows))
+        results.update(await bench_transcript_export(directory, args.export_rows))
+    finally:
+        await engine.dispose()
+    return results
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        results.update(bench_chunking(
+            directory, args.minutes, args.sample_rate, args.channels, args.patterns, args.repeat
+        ))
+        results.update(bench_segmentation(args.minutes, args.sample_rate, args.patterns))
+        results.update(bench_rechunk(directory, args.minutes, args.sample_rate, args.channels, args.patterns))
+        results.update(asyncio.run(bench_dispatch(directory, args.transcribe_chunks, args.latency, args.concurrency)))
+        if not args.skip_db:
+            results.update(asyncio.run(run_database_benchmarks(directory, args)))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "params": {key: value for key, value in vars(args).items() if key != "func"},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+# Compare two result files; any metric worse by more than the threshold is a regression
+def check(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    with open(args.current) as f:
+        current = json.load(f)["results"]
+
+    regressions = []
+    for name, metrics in baseline.items():
+        if name not in current:
+            print(f"{name}: missing from {args.current}")
+            continue
+        for metric, before in metrics.items():
+            after = current[name].get(metric)
+            if metric not in HIGHER_IS_BETTER | LOWER_IS_BETTER or after is None or not before:
+                continue
+            change = (after - before) / before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            status = "REGRESSION" if worse > args.threshold else "ok"
+            print(f"{status:>10}  {name} {metric}: {before:.4g} -> {after:.4g} ({change:+.1%})")
+            if status != "ok":
+                regressions.append((name, metric))
+
+    if regressions:
+        print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print("No regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write a JSON report")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--minutes", type=float, default=10, help="Length of each chunking fixture")
+    run_parser.add_argument("--sample-rate", type=int, default=44100)
+    run_parser.add_argument("--channels", type=int, default=2)
+    run_parser.add_argument("--patterns", nargs="+", choices=sorted(SILENCE_PATTERNS), default=["speech"])
+    run_parser.add_argument("--repeat", type=int, default=3, help="Chunking runs per fixture; the median is kept")
+    run_parser.add_argument("--skip-db", action="store_true", help="Only run the chunking benchmarks")
+    run_parser.add_argument("--transcribe-chunks", type=int, default=200)
+    run_parser.add_argument("--chunk-seconds", type=int, default=10)
+    run_parser.add_argument("--latency", type=float, default=0.2, help="Stand-in server latency per request")
+    run_parser.add_argument("--capacity", type=int, default=16, help="Requests the stand-in serves at once")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--save-rows", type=int, default=5000)
+    run_parser.add_argument("--queue-jobs", type=int, default=2000, help="Jobs claimed in the job queue benchmark")
+    run_parser.add_argument("--dataset-rows", type=int, default=200000)
+    run_parser.add_argument("--search-rows", type=int, default=200000, help="Transcripts indexed for search")
+    run_parser.add_argument("--export-rows", type=int, default=200000, help="Transcripts exported as NDJSON")
+    run_parser.set_defaults(func=run)
+
+    check_parser = commands.add_parser("check", help="Fail when a metric regressed against a baseline")
+    check_parser.add_argument("baseline")
+    check_parser.add_argument("current")
+    check_parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown")
+    check_parser.set_defaults(func=check)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import asyncio
+import uuid
+from datetime import datetime, timezone
+import pytest
+
+# These tests need app.core.config and the Postgres database it points at
+database = pytest.importorskip("app.database")
+
+from sqlalchemy import delete, update
+from app.models import Jobs
+from app.jobs import MAX_ATTEMPTS, enqueue_jobs, enqueue_job, claim_job, fail_job, get_job, requeue_stale_jobs
+
+# Claimers racing each other in the concurrency tests
+WORKERS = 16
+
+
+# Each test gets its own event loop, so pooled connections are dropped after it
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await database.engine.dispose()
+    return asyncio.run(main())
+
+
+@pytest.fixture(scope="module", autouse=True)
+def tables():
+    try:
+        run(database.create_tables())
+    except OSError as error:
+        pytest.skip(f"No database at {database.POSTGRES_HOST}:{database.POSTGRES_PORT}: {error}")
+
+
+# A stage of its own keeps real workers away from the test's jobs
+@pytest.fixture
+def stage():
+    stage = f"test-{uuid.uuid4()}"
+    yield stage
+
+    async def cleanup():
+        async with database.async_session() as session:
+            async with session.begin():
+                await session.execute(delete(Jobs).where(Jobs.stage == stage))
+    run(cleanup())
+
+
+def test_each_job_is_claimed_once(stage):
+    async def main():
+        queued = await enqueue_jobs(stage, [{"n": i} for i in range(500)])
+
+        async def drain():
+            claimed = []
+            while (job := await claim_job(stage)) is not None:
+                claimed.append(job.id)
+            return claimed
+
+        claims = [job_id for claimed in await asyncio.gather(*(drain() for _ in range(WORKERS))) for job_id in claimed]
+        return queued, claims
+
+    queued, claims = run(main())
+    assert len(claims) == len(set(claims))
+    assert set(claims) == set(queued)
+
+
+def test_one_worker_wins_a_single_job(stage):
+    async def main():
+        winners = []
+        for _ in range(20):
+            await enqueue_job(stage, {})
+            claimed = await asyncio.gather(*(claim_job(stage) for _ in range(WORKERS)))
+            winners.append(len([job for job in claimed if job is not None]))
+        return winners
+
+    assert run(main()) == [1] * 20
+
+
+def test_failed_job_is_retried_until_max_attempts(stage):
+    async def main():
+        job_id = await enqueue_job(stage, {})
+        attempts = []
+        for _ in range(MAX_ATTEMPTS):
+            job = await claim_job(stage)
+            attempts.append((job.id, job.attempts))
+            await fail_job(job_id, "test failure")
+        return job_id, attempts, await get_job(job_id), await claim_job(stage)
+
+    job_id, attempts, job, next_job = run(main())
+    assert attempts == [(job_id, attempt) for attempt in range(1, MAX_ATTEMPTS + 1)]
+    assert job.status == "failed"
+    assert next_job is None
+
+
+def test_stale_job_is_requeued(stage):
+    async def main():
+        job_id = await enqueue_job(stage, {})
+        await claim_job(stage)
+        # The worker's last heartbeat was long before the lease ran out
+        async with database.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    update(Jobs).where(Jobs.id == job_id).values(updated_at=datetime(2000, 1, 1, tzinfo=timezone.utc))
+                )
+        requeued = await requeue_stale_jobs(stage, lease_seconds=60)
+        return job_id, requeued, await claim_job(stage)
+
+    job_id, requeued, job = run(main())
+    assert requeued == 1
+    assert job is not None and job.id == job_id and job.attempts == 2
+
+
+def test_running_job_with_a_live_lease_is_left_alone(stage):
+    async def main():
+        await enqueue_job(stage, {})
+        await claim_job(stage)
+        return await requeue_stale_jobs(stage, lease_seconds=60), await claim_job(stage)
+
+    requeued, job = run(main())
+    assert requeued == 0
+    assert job is None